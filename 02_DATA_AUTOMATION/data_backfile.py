@@ -21,16 +21,20 @@
 
 import src.eia_api as api
 import src.eia_data as Eia_data
+import src.eia_etl as etl
+import src.eia_metrics as eia_metrics
+import src.eia_plot as eia_plot
 import pandas as pd
-import numpy as np
-import requests
 import json
 import os
 import datetime
-import matplotlib.pyplot as plt
+import logging
 
 pd.set_option('display.max_columns', None)
 
+# Progress messages of the pipeline functions, use logging.DEBUG for the individual requests
+logging.basicConfig(level = logging.INFO, format = "%(asctime)s %(levelname)s %(name)s: %(message)s")
+
 
 # ===========================
 # 2. SETTING PARAMETERS
@@ -39,118 +43,88 @@ eia_api_key = os.getenv('API_Key')
 
 raw_json = open("metadata/series.json")
 meta_json = json.load(raw_json)
-series = pd.DataFrame(meta_json["series"])
 api_path = meta_json["api_path"]
 
 
-facets_template = {
-  "parent" : None,
-  "subba" : None
-}
-
 start = datetime.datetime(2018, 7, 1, 8)
 end = datetime.datetime(2024, 2, 18, 1)
-offset = 2250
+workers = 4
+
+# Pooled keep-alive client shared by all requests of the run
+client = api.eia_client(pool_size = workers)
+
+# The series listed in series.json, or, when it has a "select" entry (e.g. {"parent": "CISO", "subba": "*"}),
+# the matching series of the catalog enumerated from the API facets and cached in metadata/catalog.json
+series = Eia_data.get_series(config = meta_json, api_key = eia_api_key, client = client)
+
+# On-disk response cache, so re-running the backfill after a failure only fetches the missing pages
+cache = api.eia_cache(path = "cache/eia_cache.sqlite")
+
+# Folder of the checkpoint manifests, so a restarted backfill resumes from the completed windows
+checkpoint = "cache/checkpoints"
+
+meta_path = "metadata/ciso_log.csv"
+data_path = "csv/ciso_data.csv"
+# The series attributes are stored once per series in the dimension table, keyed by series.json
+dimension_path = "csv/ciso_series.csv"
+# The chart and rollup queries of the CSV history are served from a memory-mapped copy sorted by series
+series_cache_path = "cache/ciso_data.arrow"
+# A .db/.sqlite path selects the SQLite warehouse (e.g. "db/ciso.db"), a folder the Parquet dataset (e.g. "parquet/ciso_data")
+storage = Eia_data.get_storage(data_path, dimension_path = dimension_path, cache_path = series_cache_path)
+# Daily, monthly and parent totals of the history, maintained incrementally by the refresh
+rollup_path = "csv/rollups"
+# Charts of the series, with a manifest of the rollup rows each one was rendered from
+plot_path = "plots"
 
 # ===========================
-# 3. PULLING DATA
+# 3. PULLING AND SAVING DATA
 # ===========================
 
-metadata = api.eia_metadata(api_key = eia_api_key, api_path = api_path)
+metadata = api.eia_metadata(api_key = eia_api_key, api_path = api_path, client = client)
 print(metadata.meta.keys())
 print(metadata.meta["startPeriod"])
 print(metadata.meta["endPeriod"])
 
-
-for i in series.index:
-  facets = facets_template
-  facets["parent"] = series.at[i, "parent_id"]
-  facets["subba"] = series.at[i, "subba_id"]
-  print(facets)
-  temp = api.eia_backfill(api_key = eia_api_key,
-        api_path = api_path+ "data",
-        facets = facets,
-        start = start,
-        end = end,
-        offset = offset)
-  ts_obj = pd.DataFrame(np.arange(start = start, stop = end + datetime.timedelta(hours = 1),
-                                  step = datetime.timedelta(hours = 1)).astype(datetime.datetime),
-                        columns=["index"])
-  ts_obj  = ts_obj.merge(temp.data, left_on = "index", right_on = "period", how="left")
-  ts_obj.drop("period", axis = 1, inplace= True)
-  ts_obj = ts_obj.rename(columns= {"index": "period"})
-
-  meta_temp = Eia_data.create_metadata(data = ts_obj, start = start, end = end, type = "backfill")
-  meta_temp["index"] = 1
-  meta_df = pd.DataFrame([meta_temp])
-
-  if i == series.index.start:
-    data = ts_obj
-    meta = meta_df
-  else:
-    data = data._append(ts_obj)
-    meta = meta._append(meta_df)
+Eia_data.update_dimension(dimension_path, Eia_data.series_dimension(series))
+
+# Stream each parent window by window: every window is placed on the hourly grid and flushed to the
+# storage, so the memory use does not grow with the history length or the number of series
+run = etl.backfill_pipeline(api_key = eia_api_key,
+                            api_path = api_path,
+                            series = series,
+                            start = start,
+                            end = end,
+                            storage = storage,
+                            meta_path = meta_path,
+                            watermark_path = "metadata/ciso_watermarks.json",
+                            workers = workers,
+                            client = client,
+                            cache = cache,
+                            run_log_path = "metadata/ciso_runs.csv",
+                            qc_path = "metadata/ciso_qc.csv",
+                            rollup_path = rollup_path,
+                            checkpoint = checkpoint)
+meta = run.meta
+
+# Render the charts in a background thread while the quality checks are reported
+report = eia_plot.start_report(storage = storage, rollup_path = rollup_path, path = plot_path, formats = ["png", "svg"])
 
 # ===========================
 # 4. DATA QUALITY CHECKS
 # ===========================
 print(meta)
-#    index parent subba                             time               start  \
-# 0      1   CISO  PGAE 2024-09-30 00:50:36.215848+00:00 2018-07-01 08:00:00
-# 0      1   CISO   SCE 2024-09-30 00:50:37.623904+00:00 2018-07-01 08:00:00
-# 0      1   CISO  SDGE 2024-09-30 00:50:39.114743+00:00 2018-07-01 08:00:00
-# 0      1   CISO   VEA 2024-09-30 00:50:40.563749+00:00 2018-07-01 08:00:00
-#                   end           start_act             end_act  start_match  \
-# 0 2024-02-18 01:00:00 2018-07-01 08:00:00 2024-02-18 01:00:00         True
-# 0 2024-02-18 01:00:00 2018-07-01 08:00:00 2024-02-18 01:00:00         True
-# 0 2024-02-18 01:00:00 2018-07-01 08:00:00 2024-02-18 01:00:00         True
-# 0 2024-02-18 01:00:00 2018-07-01 08:00:00 2024-02-18 01:00:00         True
-#    end_match  n_obs     na      type  update  success  \
-# 0       True  49386  44386  backfill   False    False
-# 0       True  49386  44386  backfill   False    False
-# 0       True  49386  44386  backfill   False    False
-# 0       True  49386  44386  backfill   False    False
-#                       comments
-# 0  Missing values were found;
-# 0  Missing values were found;
-# 0  Missing values were found;
-# 0  Missing values were found;
-
-# ===========================
-# 5. SAVING DATA
-# ===========================
-
-meta_path = "metadata/ciso_log.csv"
-data_path = "csv/ciso_data.csv"
-d = Eia_data.append_data(data_path = data_path, new_data = data, init = True, save = True)
+print(run.gaps)
+print(run.qc[["parent", "subba", "issues", "passed"]])
+print(cache.stats())
 
-# ===========================
-# 6. SAVING META-DATA AS LOG CSV FILE
-# ===========================
-meta["success"] = True
-meta["update"] = True
-m = Eia_data.append_metadata(meta_path = "metadata/ciso_log.csv", meta = meta, save = True, init = True)
-print(m)
+# Metrics of the run are also exported as a Prometheus text file for the node_exporter textfile collector
+eia_metrics.registry.to_prometheus(path = "metadata/ciso_metrics.prom", labels = {"job": "backfill"})
 
 # ===========================
-# 6. PLOTTING THE SERIES
+# 5. PLOTTING THE SERIES
 # ===========================
 
-data_sorted = data.sort_values(by=["subba", "period"])
-
-plt.figure(figsize=(20, 10))
-
-# Iterate through each unique group in 'subba' and plot them
-for label, group in data_sorted.groupby('subba'):
-    plt.plot(group['period'], group['value'], label=label)  # Plot each group with a different color
-
-plt.xlabel('Period')
-plt.ylabel('Value')
-plt.title('Time Series Plot of Value Over Time by Subba')
-plt.xticks(rotation=45)
-plt.legend()
-plt.tight_layout()
-plt.show()
-
-
-
+# One chart per subba from its hourly series downsampled to the chart width (LTTB), and one per parent from
+# its daily totals, rendered headless (Agg) to plots/
+charts = report.result()
+print(charts[["chart", "rendered", "points", "seconds"]])
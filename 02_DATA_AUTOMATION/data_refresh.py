@@ -9,17 +9,19 @@
 
 import src.eia_api as api
 import src.eia_data as Eia_data
+import src.eia_etl as etl
+import src.eia_plot as eia_plot
 import pandas as pd
-import numpy as np
-import requests
 import json
 import os
-import datetime
-import matplotlib.pyplot as plt
+import logging
 import great_tables as gt
 
 pd.set_option('display.max_columns', None)
 
+# Progress messages of the pipeline functions, use logging.DEBUG for the individual requests
+logging.basicConfig(level = logging.INFO, format = "%(asctime)s %(levelname)s %(name)s: %(message)s")
+
 # ===========================
 # 2. SETTING PARAMETERS
 # ===========================
@@ -27,18 +29,44 @@ eia_api_key = os.getenv('API_Key')
 
 raw_json = open("metadata/series.json")
 meta_json = json.load(raw_json)
-series = pd.DataFrame(meta_json["series"])
 api_path = meta_json["api_path"]
 
+workers = 4
+
+# Pooled keep-alive client shared by all requests of the run
+client = api.eia_client(pool_size = workers)
 
-facets_template = {
-  "parent" : None,
-  "subba" : None
-}
-offset = 2250
+# The series listed in series.json, or, when it has a "select" entry (e.g. {"parent": "CISO", "subba": "*"}),
+# the matching series of the catalog enumerated from the API facets and cached in metadata/catalog.json
+series = Eia_data.get_series(config = meta_json, api_key = eia_api_key, client = client)
 
 meta_path = "metadata/ciso_log.csv"
+# Per-series watermarks (last successful end_act), maintained with each log append
+watermark_path = "metadata/ciso_watermarks.json"
 data_path = "csv/ciso_data.csv"
+# The series attributes are stored once per series in the dimension table, keyed by series.json
+dimension_path = "csv/ciso_series.csv"
+# Memory-mapped copy of the CSV history sorted by series, serving the chart queries after the refresh
+series_cache_path = "cache/ciso_data.arrow"
+# A .db/.sqlite path selects the SQLite warehouse (e.g. "db/ciso.db"), a folder the Parquet dataset (e.g. "parquet/ciso_data")
+storage = Eia_data.get_storage(data_path, dimension_path=dimension_path, cache_path=series_cache_path)
+# A CSV history written before the dimension table (wide layout) is converted once to the fact layout
+if data_path.endswith(".csv"):
+    Eia_data.convert_csv(data_path, dimension_path)
+
+# Trailing window (in hours) re-fetched on every run, so that EIA revisions of the stored values are picked up
+lookback = 72
+revision_path = "metadata/ciso_revisions.csv"
+
+# Metrics of each run (requests, bytes, cache hits, rows, stage durations), as a CSV log joined to the
+# series log on the index and as a Prometheus text file for the node_exporter textfile collector
+run_log_path = "metadata/ciso_runs.csv"
+metrics_path = "metadata/ciso_metrics.prom"
+qc_path = "metadata/ciso_qc.csv"
+# Daily, monthly and parent totals, updated for the days touched by each run
+rollup_path = "csv/rollups"
+# Charts of the series, with a manifest of the rollup rows each one was rendered from
+plot_path = "plots"
 
 # api_metadata = api.eia_metadata(api_key = eia_api_key, api_path = api_path)
 # print(api_metadata.meta["endPeriod"])
@@ -49,7 +77,8 @@ data_path = "csv/ciso_data.csv"
 # 3. PULLING DATA
 # ===========================
 
-meta_obj = Eia_data.get_metadata(api_key = eia_api_key, api_path = api_path, meta_path = meta_path, series = series)
+meta_obj = Eia_data.get_metadata(api_key = eia_api_key, api_path = api_path, meta_path = meta_path, series = series,
+                                 client = client, watermark_path = watermark_path)
 gt.GT(meta_obj.request_meta,)
 # GT(_tbl_data=      parent subba             end_act       request_start  \
 # index
@@ -69,109 +98,39 @@ gt.GT(meta_obj.request_meta,)
 # ===========================
 
 m = meta_obj.request_meta
-index = meta_obj.last_index + 1
-data = None
-
-for i in m.index:
-
-    facets = facets_template
-    facets["parent"] = m.at[i, "parent"]
-    facets["subba"] = m.at[i, "subba"]
-    start = m.at[i, "request_start"]
-    end = m.at[i, "end"]
-
-    print(facets)
-    if m.at[i, "updates_available"]:
-        temp = api.eia_backfill(api_key=eia_api_key,
-                                api_path=api_path + "data",
-                                facets=facets,
-                                start=start.to_pydatetime(),
-                                end=end.to_pydatetime(),
-                                offset=offset)
-
-        ts_obj = pd.DataFrame(
-            np.arange(start=start, stop=end + datetime.timedelta(hours=1), step=datetime.timedelta(hours=1)).astype(
-                datetime.datetime), columns=["index"])
-        ts_obj = ts_obj.merge(temp.data, left_on="index", right_on="period", how="left")
-        ts_obj.drop("period", axis=1, inplace=True)
-        ts_obj = ts_obj.rename(columns={"index": "period"})
-    else:
-        ts_obj = None
-        print("No new data is available")
-
-    meta_temp = Eia_data.create_metadata(data=ts_obj, start=start, end=end, type="refresh")
-
-    if ts_obj is None:
-        meta_temp["parent"] = m.at[i, "parent"]
-        meta_temp["subba"] = m.at[i, "subba"]
-
-    if meta_temp["success"]:
-        print("Append the new data")
-        d = Eia_data.append_data(data_path=data_path, new_data=ts_obj, save=True)
-        meta_temp["update"] = True
-    else:
-        meta_temp["update"] = False
-        meta_temp["comments"] = meta_temp["comments"] + "The data refresh failed, please check the log; "
-
-    meta_df = pd.DataFrame([meta_temp])
-
-    if data is None:
-        data = ts_obj
-    else:
-        data = data._append(ts_obj)
-
-    if i == series.index.start:
-        meta_new = meta_df
-    else:
-        meta_new = meta_new._append(meta_df)
 
-gt.GT(meta_new,rowname_col = "index")
+# Fetch the parents concurrently, validate the series concurrently and append them through a single writer
+run = etl.refresh_pipeline(api_key=eia_api_key,
+                           api_path=api_path,
+                           request_meta=m,
+                           storage=storage,
+                           meta_path=meta_path,
+                           watermark_path=watermark_path,
+                           revision_path=revision_path,
+                           lookback=lookback,
+                           workers=workers,
+                           client=client,
+                           run_log_path=run_log_path,
+                           metrics_path=metrics_path,
+                           qc_path=qc_path,
+                           rollup_path=rollup_path)
+data = run.data
+meta_new = run.meta
+
+# Render the charts in a background thread while the run is reported
+report = eia_plot.start_report(storage=storage, rollup_path=rollup_path, path=plot_path, formats=["png", "svg"])
+
+print(run.timings)
 
-meta_updated = Eia_data.append_metadata(meta_path = meta_path,
-                                        meta = meta_new,
-                                        save = True,
-                                        init = False)
+gt.GT(meta_new,rowname_col = "index")
 
 # ===========================
 # 4. PLOTTING DATA
 # ===========================
-if data is not None:
-    # Sort the data by 'subba' and 'period'
-    data_sorted = data.sort_values(by=["subba", "period"])
-
-    # Create a color map for different groups
-    plt.figure(figsize=(20, 10))
-
-    # Iterate through each group in 'subba' and plot them with different colors
-    for label, group in data_sorted.groupby('subba'):
-        plt.plot(group['period'], group['value'], label=label)  # Plot each group
-
-    plt.xlabel('Period')
-    plt.ylabel('Value')
-    plt.title('Time Series Plot of Value Over Time by Subba')
-    plt.xticks(rotation=45)
-    plt.legend()
-    plt.tight_layout()
-    plt.show()
-
-else:
+# One chart per subba from its hourly series downsampled to the chart width (LTTB), and one per parent from
+# its daily totals, rendered headless (Agg) to plots/. A chart is only rendered again when its series changed
+if data is None:
     print("No new data is available")
 
-full_data = pd.read_csv(data_path)
-full_data.head()
-full_data["period"] = pd.to_datetime(full_data["period"])
-
-# Create a line plot with matplotlib
-plt.figure(figsize=(10, 6))
-
-for label, df in full_data.groupby('subba'):
-    plt.plot(df['period'], df['value'], label=label)
-
-plt.xlabel('Period')
-plt.ylabel('Value')
-plt.title('Line Plot of Value Over Time by Subba')
-plt.legend()
-plt.show()
-
-
-
+charts = report.result()
+print(charts[["chart", "rendered", "points", "seconds"]])
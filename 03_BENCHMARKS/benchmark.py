@@ -0,0 +1,430 @@
+################################################
+# EIA API - PIPELINE BENCHMARKS
+################################################
+
+# The goal of this doc is to measure the throughput and the memory of the pipeline stages against
+# a local fake of the EIA API v2 (fake_eia_server.py), and to detect regressions against stored baselines.
+
+# Each scenario pulls N series over Y years of hourly history and times the following stages:
+# - stream_backfill: backfill_pipeline, streaming the windows straight to a CSV storage
+# - fetch: eia_get_series, one paginated stream per parent
+# - backfill: eia_backfill, one request per window of at most 5000 rows
+# - gap_fill: reindex_hourly over the complete hourly grid
+# - append_init / append: append_data writing the history, then appending the last day to it
+# - series_cache / load_series: build_series_cache over the CSV history, then load_series of one subba over 30 days
+# - load_metadata / load_metadata_wm: load_metadata scanning the log, and reading the watermark store
+
+# Each scenario runs in a fresh process, so its max RSS is not inflated by the previous scenarios.
+# The max_rss_mb of a stage is the high-water mark of the process up to the end of that stage.
+
+# Usage (from the repository root):
+# PYTHONPATH=. python 03_BENCHMARKS/benchmark.py                   # run and compare against the baseline
+# PYTHONPATH=. python 03_BENCHMARKS/benchmark.py --quick           # the 1 year scenarios only
+# PYTHONPATH=. python 03_BENCHMARKS/benchmark.py --save-baseline   # record a new baseline
+
+# ===========================
+# 1. LOAD LIBRARIES
+# ===========================
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import platform
+import resource
+import tempfile
+import subprocess
+import contextlib
+import numpy as np
+import pandas as pd
+import src.eia_api as api
+import src.eia_data as eia_data
+import src.eia_etl as etl
+from fake_eia_server import fake_eia, make_universe
+
+# ===========================
+# 2. SETTINGS
+# ===========================
+
+api_path = "electricity/rto/region-sub-ba-data/"
+api_key = "0" * 40
+folder = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(folder)
+baseline_path = os.path.join(folder, "baseline.json")
+
+# Scenarios as series x years of hourly history
+scenarios = {
+    "1x1y": (1, 1),
+    "4x1y": (4, 1),
+    "40x1y": (40, 1),
+    "1x10y": (1, 10),
+    "4x10y": (4, 10),
+    "40x10y": (40, 10)
+}
+
+# The metrics compared against the baseline, and whether a higher value is better
+checks = {
+    "rows_per_sec": True,
+    "max_rss_mb": False
+}
+
+# Stages shorter than this in the baseline are too noisy to compare their throughput
+min_seconds = 0.05
+
+# The fake API serves 10 parents of 4 subbas, ending at the same hour for every scenario
+universe = make_universe(parents=10, subbas=4)
+data_end = datetime.datetime(2024, 1, 1, 0)
+data_start = datetime.datetime(2014, 1, 1, 0)
+
+
+# ===========================
+# 3. MEASUREMENT
+# ===========================
+
+class timed_client(api.eia_client):
+    """
+    An eia_client recording the latency and the size of every request it sends.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.latencies = []
+        self.bytes = 0
+
+    def send(self, url):
+        t = time.perf_counter()
+        r = super().send(url)
+        # Reading the body is part of the latency, the content is cached by the response
+        n = len(r.content)
+        with self.lock:
+            self.latencies.append(time.perf_counter() - t)
+            self.bytes += n
+        return r
+
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return rss / 1024 ** 2
+    return rss / 1024
+
+
+def measure(stage, func, client=None, rows=None, quiet=True):
+    # Time one stage, with the rows it processed and the requests it sent
+    if client is not None:
+        requests_before = client.requests
+        n_latencies = len(client.latencies)
+        bytes_before = client.bytes
+
+    t = time.perf_counter()
+    if quiet:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            result = func()
+    else:
+        result = func()
+    seconds = time.perf_counter() - t
+
+    n_rows = rows(result) if rows is not None else None
+    metrics = {
+        "stage": stage,
+        "seconds": round(seconds, 4),
+        "rows": n_rows,
+        "rows_per_sec": round(n_rows / seconds, 1) if n_rows is not None and seconds > 0 else None,
+        "requests": None,
+        "req_per_sec": None,
+        "mb_received": None,
+        "latency_p50_ms": None,
+        "latency_p90_ms": None,
+        "latency_p99_ms": None,
+        "max_rss_mb": round(max_rss_mb(), 1)
+    }
+
+    if client is not None:
+        n_requests = client.requests - requests_before
+        latencies = np.array(client.latencies[n_latencies:]) * 1000
+        metrics["requests"] = n_requests
+        metrics["req_per_sec"] = round(n_requests / seconds, 1) if seconds > 0 else None
+        metrics["mb_received"] = round((client.bytes - bytes_before) / 1024 ** 2, 2)
+        if len(latencies) > 0:
+            metrics["latency_p50_ms"] = round(float(np.percentile(latencies, 50)), 2)
+            metrics["latency_p90_ms"] = round(float(np.percentile(latencies, 90)), 2)
+            metrics["latency_p99_ms"] = round(float(np.percentile(latencies, 99)), 2)
+
+    return result, metrics
+
+
+def make_log(series, start, end):
+    # A log of one backfill entry per series followed by one daily refresh entry per series
+    days = pd.date_range(start=start + datetime.timedelta(days=1), end=end, freq="D")
+    n = len(series)
+    index = np.concatenate([np.ones(n, dtype=int), np.repeat(np.arange(2, len(days) + 2), n)])
+    end_act = np.concatenate([np.repeat(np.datetime64(start, "ns"), n), np.repeat(days.to_numpy(), n)])
+    log = pd.DataFrame({
+        "index": index,
+        "parent": np.tile(series["parent_id"].to_numpy(), len(days) + 1),
+        "subba": np.tile(series["subba_id"].to_numpy(), len(days) + 1),
+        "time": pd.Timestamp(data_end, tz="UTC"),
+        "start": start,
+        "end": end_act,
+        "start_act": start,
+        "end_act": end_act,
+        "start_match": True,
+        "end_match": True,
+        "n_obs": 24,
+        "na": 0,
+        "type": np.where(index == 1, "backfill", "refresh"),
+        "update": True,
+        "success": True,
+        "comments": ""
+    })
+
+    return log
+
+
+def run_scenario(name, base_url, workers, quiet=True):
+    n_series, years = scenarios[name]
+    end = data_end
+    start = end - datetime.timedelta(days=365 * years)
+    series = pd.DataFrame(universe[:n_series], columns=["parent_id", "subba_id"])
+    groups = series.groupby("parent_id", sort=False)["subba_id"].agg(list)
+
+    # The token bucket is opened up, the fake API has no quota
+    client = timed_client(base_url=base_url, pool_size=workers, rate=10 ** 9, burst=10 ** 6)
+    work = tempfile.mkdtemp(prefix="eia_benchmark_")
+    results = []
+
+    try:
+        # Streaming backfill first, so its max RSS is not raised by the in-memory stages
+        def stream_backfill():
+            storage = eia_data.get_storage(os.path.join(work, "stream.csv"))
+            return etl.backfill_pipeline(api_key=api_key, api_path=api_path, series=series, start=start, end=end,
+                                         storage=storage, meta_path=os.path.join(work, "stream_log.csv"),
+                                         workers=workers, client=client)
+
+        _, metrics = measure("stream_backfill", stream_backfill, client=client,
+                             rows=lambda r: int(r.gaps["n_obs"].sum()), quiet=quiet)
+        results.append(metrics)
+
+        # Fetch: one paginated stream per parent
+        def fetch():
+            dfs = []
+            for p, subba in groups.items():
+                temp = api.eia_get_series(start=start, end=end, api_key=api_key, api_path=api_path + "data",
+                                          parent=p, subba=subba, workers=workers, client=client)
+                dfs.append(temp.data)
+            return api.categorize(pd.concat(dfs, ignore_index=True))
+
+        data, metrics = measure("fetch", fetch, client=client, rows=len, quiet=quiet)
+        results.append(metrics)
+
+        # Backfill: windows sized to stay under the 5000 rows cap
+        def backfill():
+            dfs = []
+            for p, subba in groups.items():
+                temp = api.eia_backfill(start=start, end=end, offset=5000 // len(subba) - 1, api_key=api_key,
+                                        api_path=api_path + "data", facets={"parent": p, "subba": subba},
+                                        workers=workers, client=client)
+                dfs.append(temp.data)
+            return pd.concat(dfs, ignore_index=True)
+
+        _, metrics = measure("backfill", backfill, client=client, rows=len, quiet=quiet)
+        results.append(metrics)
+
+        # Gap filling on the complete hourly grid
+        grid, metrics = measure("gap_fill", lambda: eia_data.reindex_hourly(data=data, start=start, end=end),
+                                rows=lambda r: len(r.data), quiet=quiet)
+        results.append(metrics)
+
+        # Append: write the history, then append the last day to it
+        data_path = os.path.join(work, "data.csv")
+        cut = end - datetime.timedelta(hours=23)
+        history = grid.data[grid.data["period"] < cut]
+        last_day = grid.data[grid.data["period"] >= cut]
+        _, metrics = measure("append_init",
+                             lambda: eia_data.append_data(data_path=data_path, new_data=history, init=True, save=True),
+                             rows=len, quiet=quiet)
+        results.append(metrics)
+        _, metrics = measure("append",
+                             lambda: eia_data.append_data(data_path=data_path, new_data=last_day, save=True),
+                             rows=len, quiet=quiet)
+        results.append(metrics)
+
+        # Query one subba over the last 30 days from the memory-mapped series cache
+        _, metrics = measure("series_cache", lambda: eia_data.build_series_cache(data_path=data_path),
+                             rows=lambda r: sum(k[3] for k in r["series"]), quiet=quiet)
+        results.append(metrics)
+        _, metrics = measure("load_series",
+                             lambda: eia_data.load_series(data_path=data_path, subba=series["subba_id"].iloc[0],
+                                                          start=end - datetime.timedelta(days=30), end=end),
+                             rows=len, quiet=quiet)
+        results.append(metrics)
+
+        # Load the metadata, scanning the log and then from the watermark store
+        meta_path = os.path.join(work, "log.csv")
+        watermark_path = os.path.join(work, "watermarks.json")
+        log = make_log(series, start, end)
+        log.to_csv(meta_path, index=False)
+        _, metrics = measure("load_metadata",
+                             lambda: eia_data.load_metadata(path=meta_path, series=series),
+                             rows=lambda r: len(log), quiet=quiet)
+        results.append(metrics)
+        eia_data.build_watermarks(path=watermark_path, meta_path=meta_path)
+        _, metrics = measure("load_metadata_wm",
+                             lambda: eia_data.load_metadata(path=meta_path, series=series,
+                                                            watermark_path=watermark_path),
+                             rows=lambda r: len(log), quiet=quiet)
+        results.append(metrics)
+    finally:
+        client.close()
+        shutil.rmtree(work, ignore_errors=True)
+
+    for m in results:
+        m["scenario"] = name
+
+    return results
+
+
+# ===========================
+# 4. BASELINES
+# ===========================
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    baseline = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "cpus": os.cpu_count()
+        },
+        "results": results.to_dict(orient="records")
+    }
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(baseline, f, indent=4)
+    os.replace(tmp, path)
+
+
+def compare_baseline(results, baseline, tolerance):
+    # Flag the metrics that moved the wrong way by more than the tolerance
+    base = pd.DataFrame(baseline["results"]).set_index(["scenario", "stage"])
+    regressions = []
+    for r in results.to_dict(orient="records"):
+        key = (r["scenario"], r["stage"])
+        if key not in base.index:
+            continue
+        for metric, higher_is_better in checks.items():
+            old = base.at[key, metric]
+            new = r[metric]
+            if old is None or new is None or pd.isna(old) or pd.isna(new) or old == 0:
+                continue
+            if metric == "rows_per_sec" and base.at[key, "seconds"] < min_seconds:
+                continue
+            change = (new - old) / old
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append({
+                    "scenario": r["scenario"],
+                    "stage": r["stage"],
+                    "metric": metric,
+                    "baseline": old,
+                    "current": new,
+                    "change_pct": round(100 * change, 1)
+                })
+
+    return pd.DataFrame(regressions, columns=["scenario", "stage", "metric", "baseline", "current", "change_pct"])
+
+
+# ===========================
+# 5. RUN
+# ===========================
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the EIA pipeline against a local fake API")
+    parser.add_argument("--scenarios", default=",".join(scenarios), help="Comma separated scenarios to run")
+    parser.add_argument("--quick", action="store_true", help="Run the 1 year scenarios only")
+    parser.add_argument("--workers", type=int, default=4, help="The number of concurrent requests")
+    parser.add_argument("--latency", type=float, default=0.0, help="A delay in seconds added by the fake API")
+    parser.add_argument("--baseline", default=baseline_path, help="The baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="Record the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="The relative change flagged as a regression")
+    parser.add_argument("--output", default=None, help="Save the results to a CSV file")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the pipeline functions")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # A child process runs a single scenario against the server of its parent
+    if args.child is not None:
+        results = run_scenario(args.child, base_url=args.base_url, workers=args.workers, quiet=not args.verbose)
+        print(json.dumps(results))
+        return 0
+
+    names = args.scenarios.split(",")
+    if args.quick:
+        names = [n for n in names if scenarios[n][1] == 1]
+    unknown = [n for n in names if n not in scenarios]
+    if unknown:
+        print("Error: Unknown scenarios " + str(unknown) + ", must be in " + str(list(scenarios)))
+        return 2
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = root + os.pathsep + env.get("PYTHONPATH", "")
+    results = []
+    with fake_eia(universe=universe, start=data_start, end=data_end, latency=args.latency) as server:
+        for name in names:
+            print("Running scenario " + name)
+            cmd = [sys.executable, os.path.abspath(__file__), "--child", name, "--base-url", server.base_url,
+                   "--workers", str(args.workers)]
+            if args.verbose:
+                cmd.append("--verbose")
+            run = subprocess.run(cmd, cwd=root, env=env, capture_output=True, text=True)
+            if run.returncode != 0:
+                print(run.stdout)
+                print(run.stderr)
+                print("Error: The scenario " + name + " failed")
+                return 1
+            if args.verbose:
+                print(run.stdout)
+            results = results + json.loads(run.stdout.strip().splitlines()[-1])
+
+    results = pd.DataFrame(results)
+    results = results[["scenario"] + [c for c in results.columns if c != "scenario"]]
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(results.to_string(index=False))
+
+    if args.output is not None:
+        results.to_csv(args.output, index=False)
+
+    if args.save_baseline:
+        print("Saving the baseline to " + args.baseline)
+        save_baseline(args.baseline, results)
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        print("No baseline found at " + args.baseline + ", run with --save-baseline to record one")
+        return 0
+
+    regressions = compare_baseline(results, baseline, args.tolerance)
+    if len(regressions) > 0:
+        print("Regressions against the baseline of " + baseline["created"] + ":")
+        print(regressions.to_string(index=False))
+        return 1
+
+    print("No regressions against the baseline of " + baseline["created"])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+################################################
+# EIA API - FAKE V2 SERVER
+################################################
+
+# A local HTTP server mimicking the parts of the EIA API v2 used by the pipeline, so the
+# benchmarks run offline, at a known data volume and without spending the hourly quota:
+# - GET /v2/<route>/data/ returns the hourly rows of the selected facets, sorted by period,
+#   parent and subba, with the total row count and the offset/length pagination capped at 5000 rows
+# - GET /v2/<route>/ returns the route metadata, including the startPeriod and endPeriod
+# - GET /v2/<route>/facet/<facet>/ returns the values of a facet
+# Rows are computed from their position rather than stored, so any history length is served in
+# constant memory: row k of a query is hour k // n of the query window for its series k % n.
+
+import gzip
+import json
+import math
+import time
+import datetime
+import threading
+import urllib.parse
+import http.server
+
+
+def make_universe(parents=10, subbas=4):
+    """
+    Builds a synthetic set of series, with the subbas numbered within their parent.
+
+    Parameters:
+    parents (int): The number of parent balancing authorities. Defaults to 10.
+    subbas (int): The number of subbas per parent. Defaults to 4.
+
+    Returns:
+    list: A list of (parent, subba) tuples in sort order.
+    """
+    universe = []
+    for p in range(1, parents + 1):
+        for s in range(1, subbas + 1):
+            universe.append(("P" + str(p).zfill(2), "P" + str(p).zfill(2) + "S" + str(s)))
+
+    return universe
+
+
+class fake_eia:
+    """
+    A fake EIA API v2 served from a background thread.
+
+    Parameters:
+    universe (list): The (parent, subba) series served. Defaults to make_universe().
+    start (datetime.datetime): The first hour of the data. Defaults to 2014-01-01T00.
+    end (datetime.datetime): The last hour of the data, reported as endPeriod. Defaults to 2024-01-01T00.
+    latency (float): A delay in seconds added to each data request. Defaults to 0.
+    missing (int): One value in every `missing` is null, to exercise the gap filling. Defaults to 1000.
+    port (int): The port to listen to. Defaults to 0 (any free port).
+    """
+
+    max_length = 5000
+
+    def __init__(self, universe=None, start=datetime.datetime(2014, 1, 1, 0), end=datetime.datetime(2024, 1, 1, 0),
+                 latency=0.0, missing=1000, port=0):
+        if universe is None:
+            universe = make_universe()
+        self.universe = sorted(universe)
+        self.start = start
+        self.end = end
+        self.latency = latency
+        self.missing = missing
+        self.requests = 0
+        self.lock = threading.Lock()
+
+        fake = self
+
+        class handler(http.server.BaseHTTPRequestHandler):
+            # HTTP/1.1 keeps the connections alive, like the API behind its CDN
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                status, body = fake.route(self.path)
+                body = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body, compresslevel=1)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:" + str(self.server.server_address[1]) + "/v2/"
+
+    def start_server(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop_server(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start_server()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop_server()
+
+    def route(self, path):
+        with self.lock:
+            self.requests += 1
+
+        url = urllib.parse.urlparse(path)
+        query = urllib.parse.parse_qs(url.query)
+        parts = [p for p in url.path.split("/") if p != ""]
+
+        if len(parts) < 1 or parts[0] != "v2":
+            return 404, {"error": "Not found"}
+        if "api_key" not in query:
+            return 403, {"error": {"code": "API_KEY_MISSING"}}
+
+        if parts[-1] == "data":
+            if self.latency > 0:
+                time.sleep(self.latency)
+            return 200, self.data(query)
+        if len(parts) >= 2 and parts[-2] == "facet":
+            return 200, self.facet(parts[-1])
+
+        return 200, self.metadata("/".join(parts[1:]))
+
+    def metadata(self, route):
+        return {
+            "response": {
+                "id": route.split("/")[-1] if route else "v2",
+                "name": "Fake EIA API",
+                "frequency": [{"id": "hourly", "format": "YYYY-MM-DD\"T\"HH24"}],
+                "facets": [{"id": "parent"}, {"id": "subba"}],
+                "data": {"value": {"units": "megawatthours"}},
+                "startPeriod": self.start.strftime("%Y-%m-%dT%H"),
+                "endPeriod": self.end.strftime("%Y-%m-%dT%H")
+            }
+        }
+
+    def facet(self, facet):
+        if facet == "parent":
+            values = sorted(set(p for p, s in self.universe))
+        elif facet == "subba":
+            values = sorted(set(s for p, s in self.universe))
+        else:
+            return {"response": {"totalFacets": 0, "facets": []}}
+
+        return {
+            "response": {
+                "totalFacets": len(values),
+                "facets": [{"id": v, "name": v + " name"} for v in values]
+            }
+        }
+
+    def period(self, query, key, default):
+        if key not in query:
+            return default
+        value = query[key][0]
+        if "T" in value:
+            return datetime.datetime.strptime(value, "%Y-%m-%dT%H")
+        return datetime.datetime.strptime(value, "%Y-%m-%d")
+
+    def data(self, query):
+        # Select the series matching the facets, in the parent/subba sort order
+        parents = query.get("facets[parent][]")
+        subbas = query.get("facets[subba][]")
+        series = [(p, s, u) for u, (p, s) in enumerate(self.universe)
+                  if (parents is None or p in parents) and (subbas is None or s in subbas)]
+
+        # Clip the query window to the available hours
+        start = max(self.period(query, "start", self.start), self.start)
+        end = min(self.period(query, "end", self.end), self.end)
+        hours = max(0, int((end - start).total_seconds() // 3600) + 1)
+        total = hours * len(series)
+
+        # Walk the requested page, the API silently caps the length at 5000 rows
+        offset = int(query.get("offset", ["0"])[0])
+        length = min(int(query.get("length", [str(self.max_length)])[0]), self.max_length)
+        first_hour = int((start - self.start).total_seconds() // 3600)
+        rows = []
+        for k in range(offset, min(offset + length, total)):
+            h, j = divmod(k, len(series))
+            p, s, u = series[j]
+            t = start + datetime.timedelta(hours=h)
+            n = first_hour + h
+            if self.missing and (n * 2654435761 + u) % self.missing == 0:
+                value = None
+            else:
+                value = str(round(1000 * (1 + u % 4) + 300 * math.sin(2 * math.pi * (n % 24) / 24)))
+            rows.append({
+                "period": t.strftime("%Y-%m-%dT%H"),
+                "subba": s,
+                "subba-name": s + " name",
+                "parent": p,
+                "parent-name": p + " name",
+                "value": value,
+                "value-units": "megawatthours"
+            })
+
+        return {
+            "response": {
+                "total": str(total),
+                "dateFormat": "YYYY-MM-DD\"T\"HH24",
+                "frequency": "hourly",
+                "data": rows
+            }
+        }
+
+
+if __name__ == "__main__":
+    with fake_eia() as server:
+        print("Serving the fake EIA API at " + server.base_url)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
@@ -2,6 +2,460 @@
 import pandas as pd  # For data manipulation and analysis
 import datetime  # For working with date and time
 import requests  # For making HTTP requests
+import requests.adapters  # For configuring the connection pool
+import concurrent.futures  # For fetching chunks in parallel
+import math  # For computing the number of pages
+import json  # For serializing cached responses and checkpoint manifests
+import hashlib  # For naming the checkpoint folders
+import os  # For creating the cache folder
+import sqlite3  # For the on-disk response cache
+import threading  # For serializing access to the cache
+import time  # For the cache expiration and LRU timestamps
+import urllib.parse  # For normalizing the cache keys
+import zlib  # For compressing cached responses
+import random  # For jittering the retry delays
+import email.utils  # For parsing Retry-After dates
+import re  # For redacting the api_key from the logged URLs
+import logging  # For the progress and error messages
+import numpy as np  # For building typed columns
+import src.eia_metrics as eia_metrics  # For the request, cache and parsing metrics
+
+# orjson is optional, it decodes the API responses faster than the standard json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def redact(url):
+    """
+    Masks the api_key of a request URL, so the URL can be logged.
+    """
+    return re.sub(r"api_key=[^&]*", "api_key=***", url)
+
+
+class token_bucket:
+    """
+    A thread-safe token-bucket rate limiter.
+
+    Parameters:
+    rate (float): The number of tokens added per hour.
+    burst (int): The maximum number of tokens the bucket holds.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate / 3600.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes one token, sleeping until a token is available.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens = self.tokens - 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class eia_client:
+    """
+    A reusable HTTP client for the EIA API that owns a pooled, keep-alive requests.Session,
+    so consecutive requests reuse the same TCP/TLS connections to api.eia.gov.
+    Requests are throttled by a token bucket, and failed requests (connection errors, timeouts,
+    429/5xx responses and truncated bodies) are retried with jittered exponential backoff,
+    honoring the Retry-After header.
+
+    Parameters:
+    pool_size (int): The maximum number of connections kept alive to the API host. Defaults to 10.
+    timeout (float or tuple): The (connect, read) timeout in seconds for each request. Defaults to (5, 60).
+    gzip (bool): Whether to negotiate gzip-compressed responses. Defaults to True.
+    retries (int): The maximum number of retries per request. Defaults to 5.
+    backoff (float): The base delay in seconds of the exponential backoff. Defaults to 1.
+    max_backoff (float): The maximum delay in seconds between two attempts. Defaults to 60.
+    rate (float): The maximum number of requests per hour, the EIA hourly quota. Defaults to 5000.
+    burst (int): The number of requests that can be sent at once before throttling. Defaults to 50.
+    budget (int, optional): The maximum number of requests for the lifetime of the client. Defaults to None.
+    base_url (str): The root URL of the API. Defaults to "https://api.eia.gov/v2/".
+    """
+
+    retry_status = [429, 500, 502, 503, 504]
+
+    def __init__(self, pool_size=10, timeout=(5, 60), gzip=True, retries=5, backoff=1.0, max_backoff=60.0,
+                 rate=5000, burst=50, budget=None, base_url="https://api.eia.gov/v2/"):
+        if base_url[-1] != "/":
+            base_url = base_url + "/"
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.gzip = gzip
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget
+        self.limiter = token_bucket(rate=rate, burst=burst)
+        self.requests = 0
+        self.retried = 0
+        self.lock = threading.Lock()
+
+        # Mount an adapter with a connection pool sized for concurrent chunk fetching
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # Negotiate the response encoding
+        if gzip:
+            self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+        else:
+            self.session.headers.update({"Accept-Encoding": "identity"})
+
+    def retry_after(self, r):
+        """
+        Returns the delay in seconds requested by the Retry-After header of a response, or None.
+        """
+        value = r.headers.get("Retry-After")
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                date = email.utils.parsedate_to_datetime(value)
+                return max(0.0, (date - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                return None
+
+    def send(self, url):
+        # Send one attempt, counting it against the request budget
+        with self.lock:
+            if self.budget is not None and self.requests >= self.budget:
+                raise RuntimeError("The request budget of " + str(self.budget) + " requests is exhausted")
+            self.requests += 1
+        self.limiter.acquire()
+        return self.session.get(url, timeout=self.timeout)
+
+    def request(self, url, parse):
+        # Run one request, retrying failed attempts with jittered exponential backoff
+        for attempt in range(self.retries + 1):
+            wait = None
+            try:
+                t = time.perf_counter()
+                r = self.send(url)
+                latency = time.perf_counter() - t
+                size = int(r.headers.get("Content-Length", len(r.content)))
+                eia_metrics.registry.inc("http_requests")
+                eia_metrics.registry.inc("http_bytes", size)
+                eia_metrics.registry.observe("http_request", latency)
+                logger.debug("GET %s: %d in %.3f seconds, %d bytes", redact(url), r.status_code, latency, size)
+                if r.status_code in self.retry_status:
+                    error = requests.HTTPError(str(r.status_code) + " error for the request", response=r)
+                    wait = self.retry_after(r)
+                else:
+                    r.raise_for_status()
+                    return parse(r)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.ContentDecodingError, ValueError) as e:
+                error = e
+
+            if attempt == self.retries:
+                break
+
+            if wait is None:
+                wait = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            with self.lock:
+                self.retried += 1
+            eia_metrics.registry.inc("http_retries")
+            logger.warning("Request failed (%s), retrying in %.1f seconds", error, wait)
+            time.sleep(wait)
+
+        raise error
+
+    def get(self, url):
+        """
+        Sends a GET request through the pooled session, with throttling and retries.
+
+        Parameters:
+        url (str): The full request URL, including the api_key.
+
+        Returns:
+        requests.Response: The raw HTTP response.
+        """
+        return self.request(url, parse=lambda r: r)
+
+    def get_json(self, url):
+        """
+        Sends a GET request and parses the JSON body, retrying truncated or malformed bodies.
+
+        Parameters:
+        url (str): The full request URL, including the api_key.
+
+        Returns:
+        dict: The parsed JSON response.
+        """
+        def parse(r):
+            with eia_metrics.registry.timer("json_decode"):
+                if orjson is not None:
+                    return orjson.loads(r.content)
+                return r.json()
+
+        return self.request(url, parse=parse)
+
+    def close(self):
+        """
+        Closes the session and releases the pooled connections.
+        """
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Client shared by all calls that do not pass their own, so connections are reused across calls
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_default_client():
+    """
+    Returns the module-level eia_client, creating it on first use.
+
+    Returns:
+    eia_client: The shared client instance.
+    """
+    global _default_client
+    # The first concurrent callers must share one session and token bucket
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = eia_client()
+    return _default_client
+
+
+class eia_cache:
+    """
+    A persistent, size-bounded response cache for eia_get, stored in a SQLite file and keyed by the
+    normalized request URL without the api_key. Responses for windows that ended more than
+    immutable_days ago are cached forever, more recent (or open-ended) windows expire after ttl seconds.
+    When the cache grows above max_size bytes, the least recently used entries are evicted.
+
+    Parameters:
+    path (str): The path of the SQLite file.
+    ttl (int): The lifetime in seconds of the responses for recent windows. Defaults to 3600.
+    immutable_days (int): The age in days after which a window is considered final. Defaults to 30.
+    max_size (int): The maximum size in bytes of the cached responses. Defaults to 1 GB.
+    """
+
+    def __init__(self, path, ttl=3600, immutable_days=30, max_size=1024 ** 3):
+        self.path = path
+        self.ttl = ttl
+        self.immutable_days = immutable_days
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        folder = os.path.dirname(path)
+        if folder != "":
+            os.makedirs(folder, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses ("
+                          "key TEXT PRIMARY KEY, body BLOB, size INTEGER, expires REAL, accessed REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.conn.commit()
+
+    @staticmethod
+    def key(url):
+        """
+        Normalizes a request URL into a cache key, dropping the api_key and sorting the query parameters.
+
+        Parameters:
+        url (str): The request URL.
+
+        Returns:
+        str: The cache key.
+        """
+        parts = urllib.parse.urlsplit(url)
+        query = [q for q in urllib.parse.parse_qsl(parts.query, keep_blank_values=True) if q[0] != "api_key"]
+        return parts.path.rstrip("/") + "?" + urllib.parse.urlencode(sorted(query))
+
+    def get(self, url):
+        """
+        Returns the cached JSON response of a request, or None on a miss or an expired entry.
+
+        Parameters:
+        url (str): The request URL.
+
+        Returns:
+        dict: The parsed JSON response, or None.
+        """
+        key = self.key(url)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT body, expires FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                self.misses += 1
+                eia_metrics.registry.inc("cache_misses")
+                return None
+            self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+        eia_metrics.registry.inc("cache_hits")
+
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, url, d, end=None):
+        """
+        Stores the JSON response of a request, then evicts the least recently used entries if needed.
+
+        Parameters:
+        url (str): The request URL.
+        d (dict): The parsed JSON response.
+        end (datetime, optional): The end of the requested window, used for the expiration rule.
+        """
+        now = time.time()
+        if end is not None and not isinstance(end, datetime.datetime):
+            end = datetime.datetime(end.year, end.month, end.day)
+        if end is not None and end < datetime.datetime.now() - datetime.timedelta(days=self.immutable_days):
+            expires = None
+        else:
+            expires = now + self.ttl
+
+        body = zlib.compress(json.dumps(d).encode("utf-8"))
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                              (self.key(url), body, len(body), expires, now))
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_size:
+                rows = self.conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+                evict = []
+                for key, size in rows:
+                    if total <= self.max_size:
+                        break
+                    evict.append((key,))
+                    total = total - size
+                self.conn.executemany("DELETE FROM responses WHERE key = ?", evict)
+            self.conn.commit()
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and the current size of the cache.
+
+        Returns:
+        dict: The number of hits, misses, entries and cached bytes.
+        """
+        with self.lock:
+            entries, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "size": size}
+
+    def close(self):
+        """
+        Closes the SQLite connection.
+        """
+        self.conn.close()
+
+
+class eia_checkpoint:
+    """
+    A checkpoint manifest for a multi-request pull, stored under <folder>/<hash of the request>/.
+    Each completed chunk is saved as a pickle file and recorded in manifest.json with its row count,
+    so that a restarted pull only fetches the missing or failed chunks.
+
+    Parameters:
+    folder (str): The root folder of the checkpoints.
+    api_path (str): The path to the specific API endpoint.
+    facets (dict): The filtering options of the request.
+    start (datetime): The start date of the request.
+    end (datetime): The end date of the request.
+    mode (str): The chunking of the request (e.g., "offset=2250"), part of the checkpoint identity.
+    """
+
+    def __init__(self, folder, api_path, facets, start, end, mode):
+        request = {
+            "api_path": api_path,
+            "facets": facets,
+            "start": str(start),
+            "end": str(end),
+            "mode": mode
+        }
+        request_id = hashlib.sha1(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        self.folder = os.path.join(folder, request_id)
+        self.manifest_path = os.path.join(self.folder, "manifest.json")
+        self.lock = threading.Lock()
+        os.makedirs(self.folder, exist_ok=True)
+
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+            logger.info("Resuming from checkpoint %s: %d chunks completed", self.folder, len(self.manifest["chunks"]))
+        else:
+            self.manifest = {"request": request, "chunks": {}}
+
+    def load(self, chunk):
+        """
+        Returns the saved data of a completed chunk, or None if the chunk still has to be fetched.
+
+        Parameters:
+        chunk (str): The chunk identifier.
+
+        Returns:
+        DataFrame: The saved data, or None.
+        """
+        with self.lock:
+            entry = self.manifest["chunks"].get(chunk)
+        if entry is None:
+            return None
+        path = os.path.join(self.folder, entry["file"])
+        if not os.path.exists(path):
+            return None
+        return pd.read_pickle(path)
+
+    def completed(self):
+        """
+        Returns the identifiers of the completed chunks.
+
+        Returns:
+        list: The chunk identifiers recorded in the manifest.
+        """
+        with self.lock:
+            return list(self.manifest["chunks"].keys())
+
+    def save(self, chunk, data):
+        """
+        Saves the data of a completed chunk and records it in the manifest.
+
+        Parameters:
+        chunk (str): The chunk identifier.
+        data (DataFrame): The data of the chunk.
+        """
+        file = "chunk-" + hashlib.sha1(chunk.encode("utf-8")).hexdigest()[:16] + ".pkl"
+        path = os.path.join(self.folder, file)
+        data.to_pickle(path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+        with self.lock:
+            self.manifest["chunks"][chunk] = {
+                "rows": len(data),
+                "file": file,
+                "time": datetime.datetime.now(datetime.timezone.utc).isoformat()
+            }
+            with open(self.manifest_path + ".tmp", "w") as f:
+                json.dump(self.manifest, f, indent=4)
+            os.replace(self.manifest_path + ".tmp", self.manifest_path)
+
 
 def day_offset(start, end, offset):
     """
@@ -15,18 +469,16 @@ def day_offset(start, end, offset):
     Returns:
     list: A list of dates from start to end, incremented by the specified offset.
     """
-    # Initialize a list with the starting date
-    current = [start]
+    if start >= end:
+        return [start]
 
-    # Loop until the last date in the current list is less than the end date
-    while max(current) < end:
-        # Check if adding the offset to the last date will not exceed the end date
-        if (max(current) + datetime.timedelta(days=offset) < end):
-            # If it doesn't exceed, append the new date to the list
-            current.append(max(current) + datetime.timedelta(days=offset))
-        else:
-            # If it exceeds, append the end date to the list
-            current.append(end)
+    # Build all the steps before the end date at once, then close the list with the end date. The steps
+    # keep the type of the start argument, datetime inputs give datetimes and date inputs dates
+    steps = pd.date_range(start=start, end=end, freq=pd.Timedelta(days=offset))
+    steps = steps[steps < pd.Timestamp(end)].to_pydatetime()
+    if not isinstance(start, datetime.datetime):
+        steps = [t.date() for t in steps]
+    current = list(steps) + [end]
 
     # Return the list of dates
     return current
@@ -44,23 +496,127 @@ def hour_offset(start, end, offset):
     Returns:
     list: A list of datetime objects from start to end, incremented by the specified offset.
     """
-    # Initialize a list with the starting datetime
-    current = [start]
+    if start >= end:
+        return [start]
 
-    # Loop until the last datetime in the current list is less than the end datetime
-    while max(current) < end:
-        # Check if adding the offset to the last datetime will not exceed the end datetime
-        if (max(current) + datetime.timedelta(hours=offset) < end):
-            # If it doesn't exceed, append the new datetime to the list
-            current.append(max(current) + datetime.timedelta(hours=offset))
-        else:
-            # If it exceeds, append the end datetime to the list
-            current.append(end)
+    # Build all the steps before the end datetime at once, then close the list with the end datetime
+    steps = pd.date_range(start=start, end=end, freq=pd.Timedelta(hours=offset))
+    current = list(steps[steps < pd.Timestamp(end)].to_pydatetime()) + [end]
 
     # Return the list of datetime objects
     return current
 
 
+def facet_count(facets):
+    """
+    Returns the number of series selected by the facets, the product of the number of values of the
+    list-valued facets (a facet given as a single string selects one value).
+
+    Parameters:
+    facets (dict): The facets of the request, or None.
+
+    Returns:
+    int: The number of series per period.
+    """
+    n = 1
+    if facets is not None:
+        for v in facets.values():
+            if type(v) is list:
+                n = n * max(len(v), 1)
+    return n
+
+
+class chunk_planner:
+    """
+    Sizes the hourly windows of a query so each one fits in a single request of at most 5000 rows.
+    The expected number of rows per hour starts from the number of series and follows the row counts
+    actually returned, so sparse histories get larger windows and denser ones smaller.
+
+    Parameters:
+    n_series (int): The number of series selected by the facets.
+    rows (int): The target number of rows per request, capped at the API limit of 5000. Defaults to 5000.
+    rows_per_hour (float, optional): The expected number of rows per hour. Defaults to n_series.
+    """
+
+    def __init__(self, n_series, rows=5000, rows_per_hour=None):
+        self.rows = min(rows, 5000)
+        self.rows_per_hour = float(rows_per_hour if rows_per_hour is not None else max(n_series, 1))
+
+    def hours(self):
+        """
+        Returns the number of hours of the next window.
+        """
+        return max(1, int(self.rows // self.rows_per_hour))
+
+    def next_window(self, start, end):
+        """
+        Returns the next (window_start, window_end) window starting at start, or None past the end.
+        """
+        if start > end:
+            return None
+        return start, min(start + datetime.timedelta(hours=self.hours() - 1), end)
+
+    def update(self, window, total):
+        """
+        Updates the estimate with the total number of rows the API reported for a window. The windows
+        must be passed in period order, so the boundaries of a query do not depend on the fetch timing.
+        """
+        hours = (window[1] - window[0]).total_seconds() / 3600 + 1
+        if total > 0:
+            self.rows_per_hour = total / hours
+        else:
+            # An empty window doubles the size of the next ones
+            self.rows_per_hour = self.rows_per_hour / 2
+
+
+@eia_metrics.timed("parse")
+def parse_data(records):
+    """
+    Parses the records of an API response straight into typed columns: the period as datetime64[ns],
+    the value as float64 and the repeated string columns (subba, parent, names, units) as categoricals.
+
+    Parameters:
+    records (list): The list of records in response.data.
+
+    Returns:
+    DataFrame: The typed data.
+    """
+    columns = {}
+    for k in records[0].keys():
+        col = [r.get(k) for r in records]
+        if k == "period":
+            # Hourly ("2024-02-18T01"), daily and monthly periods are ISO 8601 and parse natively
+            try:
+                columns[k] = np.array(col, dtype="datetime64[h]").astype("datetime64[ns]")
+            except ValueError:
+                columns[k] = pd.to_datetime(pd.Series(col)).to_numpy()
+        elif k == "value":
+            columns[k] = pd.to_numeric(np.array(col, dtype=object), errors="coerce").astype("float64")
+        else:
+            columns[k] = pd.Categorical(col)
+    eia_metrics.registry.inc("rows_parsed", len(records))
+
+    return pd.DataFrame(columns)
+
+
+def categorize(df):
+    """
+    Converts the string columns of a DataFrame to categoricals, e.g. after concatenating pages
+    whose categories differ.
+
+    Parameters:
+    df (DataFrame): The data.
+
+    Returns:
+    DataFrame: The data with categorical string columns.
+    """
+    for c in df.columns:
+        if c not in ["period", "value"] and (df[c].dtype == object or isinstance(df[c].dtype, pd.CategoricalDtype)):
+            df[c] = df[c].astype("category")
+
+    return df
+
+
 def eia_get(api_key,
             api_path,
             data="value",
@@ -69,7 +625,10 @@ def eia_get(api_key,
             end=None,
             length=None,
             offset=None,
-            frequency=None):
+            frequency=None,
+            sort=None,
+            client=None,
+            cache=None):
     """
     Fetches data from the EIA API based on specified parameters.
 
@@ -83,24 +642,29 @@ def eia_get(api_key,
     length (int): The number of data points to return.
     offset (int): The number of data points to skip.
     frequency (str): The frequency of the data (e.g., daily, monthly).
+    sort (str or list): The column(s) to sort the results by on the server side, in ascending order.
+    client (eia_client, optional): The HTTP client to send the request with. Defaults to the shared client.
+    cache (eia_cache, optional): The response cache to read from and write to. Defaults to None (no caching).
 
     Returns:
-    response: An object containing the fetched data, URL used, and parameters.
+    response: An object containing the fetched data, URL used, parameters and the total number of rows
+    the API reports for the query (across all pages).
     """
 
     # Inner class to structure the response from the API
     class response:
-        def __init__(output, data, url, parameters):
+        def __init__(output, data, url, parameters, total):
             output.data = data
             output.url = url
             output.parameters = parameters
+            output.total = total
 
     # Validate the API key
     if type(api_key) is not str:
-        print("Error: The api_key argument is not a valid string")
+        logger.error("The api_key argument is not a valid string")
         return
     elif len(api_key) != 40:
-        print("Error: The length of the api_key is not valid, must be 40 characters")
+        logger.error("The length of the api_key is not valid, must be 40 characters")
         return
 
     # Ensure the API path ends with a "/"
@@ -112,12 +676,12 @@ def eia_get(api_key,
         fc = ""
     else:
         fc = ""
-    for i in facets.keys():
-        if type(facets[i]) is list:
-            for n in facets[i]:
-                fc = fc + "&facets[" + i + "][]=" + n
-        elif type(facets[i]) is str:
-            fc = fc + "&facets[" + i + "][]=" + facets[i]
+        for i in facets.keys():
+            if type(facets[i]) is list:
+                for n in facets[i]:
+                    fc = fc + "&facets[" + i + "][]=" + n
+            elif type(facets[i]) is str:
+                fc = fc + "&facets[" + i + "][]=" + facets[i]
 
     # Build the start date part of the URL if provided
     if start is None:
@@ -128,7 +692,7 @@ def eia_get(api_key,
         elif type(start) is datetime.datetime:
             s = "&start=" + start.strftime("%Y-%m-%dT%H")
         else:
-            print("Error: The start argument is not a valid date or time object")
+            logger.error("The start argument is not a valid date or time object")
             return
 
     # Build the end date part of the URL if provided
@@ -140,7 +704,7 @@ def eia_get(api_key,
         elif type(end) is datetime.datetime:
             e = "&end=" + end.strftime("%Y-%m-%dT%H")
         else:
-            print("Error: The end argument is not a valid date or time object")
+            logger.error("The end argument is not a valid date or time object")
             return
 
     # Build the length part of the URL if provided
@@ -161,36 +725,58 @@ def eia_get(api_key,
     else:
         fr = "&frequency=" + str(frequency)
 
+    # Build the sort part of the URL if provided
+    if sort is None:
+        so = ""
+    else:
+        if type(sort) is str:
+            sort = [sort]
+        so = ""
+        for n in range(len(sort)):
+            so = so + "&sort[" + str(n) + "][column]=" + sort[n] + "&sort[" + str(n) + "][direction]=asc"
+
+    # Use the shared client when none is provided
+    if client is None:
+        client = get_default_client()
+
     # Construct the full API URL
-    url = "https://api.eia.gov/v2/" + api_path + "?data[]=value" + fc + s + e + l + o + fr
+    url = client.base_url + api_path + "?data[]=value" + fc + s + e + l + o + fr + so
+
+    # Look up the response in the cache before sending the request
+    d = None
+    if cache is not None:
+        d = cache.get(url)
 
     # Send the GET request to the API and parse the JSON response
-    d = requests.get(url + "&api_key=" + api_key).json()
+    if d is None:
+        d = client.get_json(url + "&api_key=" + api_key)
+        cached = False
+    else:
+        cached = True
 
     # Check the API response for validity
     if 'response' not in d or 'data' not in d['response'] or not d['response']['data']:
-        print("Error: No valid data returned from API")
-        return response(data=pd.DataFrame(), url=url + "&api_key=", parameters={})
+        logger.error("No valid data returned from API: %s", redact(url))
+        return response(data=pd.DataFrame(), url=url + "&api_key=", parameters={}, total=0)
 
-    # Create a DataFrame from the response data
-    df = pd.DataFrame(d['response']['data'])
+    # Only valid responses are cached
+    if cache is not None and not cached:
+        cache.put(url, d, end=end)
 
-    # Print the columns of the DataFrame for verification
-    print("DataFrame Columns:", df.columns)
+    # The total number of rows matching the query, regardless of length/offset
+    total = int(d['response'].get('total', len(d['response']['data'])))
 
-    # Reformat the output DataFrame
-    if 'period' in df.columns:
-        df["period"] = pd.to_datetime(df["period"])
-    else:
-        print("Warning: 'period' column not found in DataFrame")
+    # Parse the response data straight into typed columns
+    df = parse_data(d['response']['data'])
 
-    if 'value' in df.columns:
-        df["value"] = pd.to_numeric(df["value"], errors='coerce')
-    else:
-        print("Warning: 'value' column not found in DataFrame")
+    if 'period' not in df.columns:
+        logger.warning("'period' column not found in DataFrame")
+    if 'value' not in df.columns:
+        logger.warning("'value' column not found in DataFrame")
 
     # Sort the DataFrame by the 'period' column
-    df = df.sort_values(by=["period"])
+    if 'period' in df.columns:
+        df = df.sort_values(by=["period"], kind="stable", ignore_index=True)
 
     # Prepare the parameters for the response object
     parameters = {
@@ -201,134 +787,188 @@ def eia_get(api_key,
         "end": end,
         "length": length,
         "offset": offset,
-        "frequency": frequency
+        "frequency": frequency,
+        "sort": sort
     }
 
     # Create a response object to return
-    output = response(data=df, url=url + "&api_key=", parameters=parameters)
+    output = response(data=df, url=url + "&api_key=", parameters=parameters, total=total)
     return output
 
 
-def eia_backfill(start, end, offset, api_key, api_path, facets):
+def eia_backfill(start, end, offset, api_key, api_path, facets, workers=None, client=None, cache=None,
+                 checkpoint=None):
     """
     Fetches backfilled data from the EIA API for specified date ranges.
 
     Parameters:
     start (datetime): The start date for the data request.
     end (datetime): The end date for the data request.
-    offset (int): The number of days or hours to increment for each request.
+    offset (int): The number of days or hours to increment for each request. With None, hourly windows are
+    sized to the 5000 rows cap from the number of series selected by the facets.
     api_key (str): The API key for authentication.
     api_path (str): The path to the specific API endpoint.
     facets (dict): Additional filtering options for the API request.
+    workers (int, optional): The number of chunks to fetch concurrently. Defaults to None (serial mode).
+    client (eia_client, optional): The HTTP client shared by all chunk requests. Defaults to the shared client.
+    cache (eia_cache, optional): The response cache shared by all chunk requests. Defaults to None.
+    checkpoint (str, optional): The folder where completed windows are checkpointed, so that a restarted
+    backfill only fetches the missing or failed windows. Defaults to None.
 
     Returns:
-    response: An object containing the fetched data and parameters.
+    response: An object containing the fetched data, parameters and the windows that failed.
     """
 
     # Inner class to structure the response from the API
     class response:
-        def __init__(output, data, parameters):
+        def __init__(output, data, parameters, failed):
             output.data = data
             output.parameters = parameters
+            output.failed = failed
 
-    print("eia_backfill function started.")
+    logger.debug("eia_backfill function started.")
 
     # Validate the API key
     if type(api_key) is not str:
-        print("Error: The api_key argument is not a valid string")
+        logger.error("The api_key argument is not a valid string")
         return
     elif len(api_key) != 40:
-        print("Error: The length of the api_key is not valid, must be 40 characters")
+        logger.error("The length of the api_key is not valid, must be 40 characters")
+        return
+
+    # Validate the number of workers
+    if workers is not None and (type(workers) is not int or workers < 1):
+        logger.error("The workers argument must be a positive integer")
         return
 
     # Ensure the API path ends with a "/"
     if api_path[-1] != "/":
         api_path = api_path + "/"
 
+    # Use the shared client when none is provided, so all chunks reuse its connection pool
+    if client is None:
+        client = get_default_client()
+
     # Check the start date type and format it for the API request
-    if isinstance(start, datetime.date):
-        s = "&start=" + start.strftime("%Y-%m-%d")
-    elif isinstance(start, datetime.datetime):
+    # (datetime.datetime is a subclass of datetime.date, so it has to be checked first)
+    if isinstance(start, datetime.datetime):
         s = "&start=" + start.strftime("%Y-%m-%dT%H")
+    elif isinstance(start, datetime.date):
+        s = "&start=" + start.strftime("%Y-%m-%d")
     else:
-        print("Error: The start argument is not a valid date or time object")
+        logger.error("The start argument is not a valid date or time object")
         return
 
     # Check the end date type and format it for the API request
-    if isinstance(end, datetime.date):
-        e = "&end=" + end.strftime("%Y-%m-%d")
-    elif isinstance(end, datetime.datetime):
+    if isinstance(end, datetime.datetime):
         e = "&end=" + end.strftime("%Y-%m-%dT%H")
+    elif isinstance(end, datetime.date):
+        e = "&end=" + end.strftime("%Y-%m-%d")
     else:
-        print("Error: The end argument is not a valid date or time object")
+        logger.error("The end argument is not a valid date or time object")
         return
 
     # Create a time series based on the start and end dates
     try:
-        if isinstance(start, datetime.date):
-            time_vec_seq = day_offset(start=start, end=end, offset=offset)
+        if offset is None and isinstance(start, datetime.datetime):
+            # The last window of hour_offset can be one hour longer than the offset
+            hours = max(1, chunk_planner(n_series=facet_count(facets)).hours() - 1)
+            time_vec_seq = hour_offset(start=start, end=end, offset=hours)
         elif isinstance(start, datetime.datetime):
             time_vec_seq = hour_offset(start=start, end=end, offset=offset)
+        elif isinstance(start, datetime.date):
+            time_vec_seq = day_offset(start=start, end=end, offset=offset)
 
-        print(f"Time series created: {time_vec_seq}")
+        logger.info("Time series created: %d windows from %s to %s", len(time_vec_seq) - 1, start, end)
+        logger.debug("Window boundaries: %s", time_vec_seq)
     except Exception as e:
-        print(f"Error occurred while creating the time series: {e}")
+        logger.error("Error occurred while creating the time series: %s", e)
         return
 
-    # Loop through each time interval to fetch data
-    dfs = []  # Initialize an empty list to hold DataFrames
+    # Build the list of (start, end) windows to request
+    windows = []
     for i in range(len(time_vec_seq[:-1])):
-        start = time_vec_seq[i]  # Set the current start date
+        window_start = time_vec_seq[i]  # Set the current start date
         if i < len(time_vec_seq[:-1]) - 1:
-            end = time_vec_seq[i + 1] - datetime.timedelta(hours=1)  # End is the next start minus one hour
+            window_end = time_vec_seq[i + 1] - datetime.timedelta(hours=1)  # End is the next start minus one hour
         elif i == len(time_vec_seq[:-1]) - 1:
-            end = time_vec_seq[i + 1]  # Last end date
-
-        print(f"Fetching data: start: {start}, end: {end}")
+            window_end = time_vec_seq[i + 1]  # Last end date
+        windows.append((window_start, window_end))
+
+    # Load the manifest of the windows completed by a previous run
+    if checkpoint is not None:
+        chunks = eia_checkpoint(folder=checkpoint,
+                                api_path=api_path,
+                                facets=facets,
+                                start=start,
+                                end=end,
+                                mode="offset=" + str(offset))
+
+    # Fetch a single window, returning None when the chunk failed or is empty
+    def fetch_window(window):
+        window_start, window_end = window
+
+        # Reuse the window if it was completed by a previous run
+        if checkpoint is not None:
+            chunk = window_start.isoformat() + "|" + window_end.isoformat()
+            saved = chunks.load(chunk)
+            if saved is not None:
+                logger.debug("Loaded from checkpoint: start: %s, end: %s", window_start, window_end)
+                return saved
+
+        logger.debug("Fetching data: start: %s, end: %s", window_start, window_end)
 
         # Fetch data from the API
         try:
             temp = eia_get(api_key=api_key,
                            api_path=api_path,
                            facets=facets,
-                           start=start,
+                           start=window_start,
                            data="value",
-                           end=end)
+                           end=window_end,
+                           client=client,
+                           cache=cache)
 
             # Check if the returned DataFrame is empty
             if temp.data.empty:
-                print(f"No data returned for start: {start}, end: {end}")
-                continue  # Skip to the next iteration
+                logger.warning("No data returned for start: %s, end: %s", window_start, window_end)
+                return None
 
             # Check for the presence of 'period' and 'value' columns
             if 'period' not in temp.data.columns or 'value' not in temp.data.columns:
-                print("Warning: 'period' or 'value' columns not found!")
-                continue
+                logger.warning("'period' or 'value' columns not found!")
+                return None
 
-            # Attempt to convert the 'value' column to numeric
-            try:
-                temp.data["value"] = pd.to_numeric(temp.data["value"])
-            except Exception as e:
-                print(f"Error converting 'value' to numeric: {e}")
-                continue
+            # Record the completed window
+            if checkpoint is not None:
+                chunks.save(chunk, temp.data)
 
-            # Append the DataFrame to the list
-            dfs.append(temp.data)  # Store the results in the list
-
-            # Print a sample of the returned data
-            # print("Sample of returned data:\n", temp.data.head())  # Show the first few rows of data
+            return temp.data
 
         except Exception as e:
-            print(f"Error occurred while fetching data from API: {e}")
-            continue  # Skip to the next iteration
+            logger.error("Error occurred while fetching data from API: %s", e)
+            return None
+
+    # Loop through each time interval to fetch data, either serially or with a bounded worker pool.
+    # executor.map returns the results in the order of the windows, so the output is in period order.
+    if workers is not None and workers > 1 and len(windows) > 1:
+        logger.info("Fetching %d chunks with %d workers", len(windows), workers)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(fetch_window, windows))
+    else:
+        results = [fetch_window(w) for w in windows]
+
+    dfs = [r for r in results if r is not None]  # Keep only the chunks that returned data
+    failed = [windows[n] for n in range(len(windows)) if results[n] is None]
+    if failed:
+        logger.warning("%d windows failed or returned no data: %s", len(failed), failed)
 
     # Concatenate all DataFrames into one
     if dfs:
-        df = pd.concat(dfs, ignore_index=True)
-        # print("Error occurred while concatenating data. Sample of concatenated data:\n", df.head())
+        df = categorize(pd.concat(dfs, ignore_index=True))
     else:
         df = pd.DataFrame()  # Create an empty DataFrame if no DataFrames are available
-        print("No DataFrames to concatenate, returning empty DataFrame.")
+        logger.warning("No DataFrames to concatenate, returning empty DataFrame.")
 
     # Prepare the parameters for the response object
     parameters = {
@@ -339,22 +979,407 @@ def eia_backfill(start, end, offset, api_key, api_path, facets):
         "end": end,
         "length": None,
         "offset": offset,
-        "frequency": None
+        "frequency": None,
+        "workers": workers
+    }
+
+    logger.info("Data fetching completed. Number of records fetched: %d", len(df))
+    output = response(data=df, parameters=parameters, failed=failed)
+    logger.debug("eia_backfill function completed.")
+
+    return output
+
+def eia_paginate(start, end, api_key, api_path, facets, length=5000, frequency=None, workers=None, client=None,
+                 cache=None, checkpoint=None):
+    """
+    Fetches all the data of a query from the EIA API by walking the offset/length pagination.
+    The first page returns the total number of rows, which sets the number of remaining pages.
+
+    Parameters:
+    start (datetime): The start date for the data request.
+    end (datetime): The end date for the data request.
+    api_key (str): The API key for authentication.
+    api_path (str): The path to the specific API endpoint.
+    facets (dict): Additional filtering options for the API request.
+    length (int): The number of rows per page, capped at the API limit of 5000. Defaults to 5000.
+    frequency (str, optional): The frequency of the data (e.g., hourly). Defaults to None.
+    workers (int, optional): The number of pages to fetch concurrently. Defaults to None (serial mode).
+    client (eia_client, optional): The HTTP client shared by all page requests. Defaults to the shared client.
+    cache (eia_cache, optional): The response cache shared by all page requests. Defaults to None.
+    checkpoint (str, optional): The folder where completed pages are checkpointed, so that a restarted
+    pull only fetches the missing or failed pages. Defaults to None.
+
+    Returns:
+    response: An object containing the fetched data, parameters, the reported total and any failed offsets.
+    """
+
+    # Inner class to structure the response from the API
+    class response:
+        def __init__(output, data, parameters, total, failed):
+            output.data = data
+            output.parameters = parameters
+            output.total = total
+            output.failed = failed
+
+    # Validate the API key
+    if type(api_key) is not str:
+        logger.error("The api_key argument is not a valid string")
+        return
+    elif len(api_key) != 40:
+        logger.error("The length of the api_key is not valid, must be 40 characters")
+        return
+
+    # Validate the page length and the number of workers
+    if type(length) is not int or length < 1:
+        logger.error("The length argument must be a positive integer")
+        return
+    if workers is not None and (type(workers) is not int or workers < 1):
+        logger.error("The workers argument must be a positive integer")
+        return
+
+    # The API does not return more than 5000 rows per request
+    length = min(length, 5000)
+
+    # Use the shared client when none is provided, so all pages reuse its connection pool
+    if client is None:
+        client = get_default_client()
+
+    # Sort on the server side so that the offsets are stable between pages
+    sort = ["period"]
+    if facets is not None:
+        sort = sort + [k for k in facets.keys() if k != "period"]
+
+    # Fetch a single page, returning None when it failed
+    def fetch_page(page_offset):
+        try:
+            temp = eia_get(api_key=api_key,
+                           api_path=api_path,
+                           facets=facets,
+                           start=start,
+                           end=end,
+                           length=length,
+                           offset=page_offset,
+                           frequency=frequency,
+                           sort=sort,
+                           client=client,
+                           cache=cache)
+            return temp
+        except Exception as e:
+            logger.error("Error occurred while fetching the page at offset %d: %s", page_offset, e)
+            return None
+
+    # The first page tells how many rows the query returns in total
+    first = fetch_page(0)
+    if first is None:
+        logger.error("The first page could not be fetched")
+        return
+    total = first.total
+    pages = math.ceil(total / length)
+    logger.info("Total rows reported by the API: %d, pages: %d", total, pages)
+
+    # Load the manifest of the pages completed by a previous run
+    if checkpoint is not None:
+        chunks = eia_checkpoint(folder=checkpoint,
+                                api_path=api_path,
+                                facets=facets,
+                                start=start,
+                                end=end,
+                                mode="length=" + str(length))
+
+    # Fetch one of the remaining pages, reusing it if it was completed by a previous run.
+    # The total is part of the page identity, as the offsets shift when the total changes.
+    def fetch_remaining(page_offset):
+        chunk = "offset=" + str(page_offset) + "|total=" + str(total)
+        if checkpoint is not None:
+            saved = chunks.load(chunk)
+            if saved is not None:
+                logger.debug("Loaded from checkpoint: offset: %d", page_offset)
+                return saved
+
+        temp = fetch_page(page_offset)
+        if temp is None or temp.data.empty:
+            return None
+
+        if checkpoint is not None:
+            chunks.save(chunk, temp.data)
+
+        return temp.data
+
+    # Fetch the remaining pages, either serially or with a bounded worker pool
+    offsets = [length * n for n in range(1, pages)]
+    if workers is not None and workers > 1 and len(offsets) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(fetch_remaining, offsets))
+    else:
+        results = [fetch_remaining(n) for n in offsets]
+
+    # Keep the pages that returned data and record the ones that failed
+    dfs = [first.data] if not first.data.empty else []
+    failed = []
+    for n in range(len(offsets)):
+        if results[n] is None:
+            failed.append(offsets[n])
+        else:
+            dfs.append(results[n])
+
+    if failed:
+        logger.warning("%d pages failed, offsets: %s", len(failed), failed)
+
+    # Concatenate all pages into one DataFrame, in period order
+    if dfs:
+        df = categorize(pd.concat(dfs, ignore_index=True))
+        df = df.sort_values(by=[c for c in sort if c in df.columns], kind="stable", ignore_index=True)
+    else:
+        df = pd.DataFrame()
+        logger.warning("No data was returned, returning empty DataFrame.")
+
+    # Prepare the parameters for the response object
+    parameters = {
+        "api_path": api_path,
+        "data": "value",
+        "facets": facets,
+        "start": start,
+        "end": end,
+        "length": length,
+        "offset": None,
+        "frequency": frequency,
+        "workers": workers
     }
 
-    print("Data fetching completed. Number of records fetched:", len(df))
-    output = response(data=df, parameters=parameters)
-    print("eia_backfill function completed.")
+    logger.info("Data fetching completed. Number of records fetched: %d", len(df))
+    output = response(data=df, parameters=parameters, total=total, failed=failed)
 
     return output
 
-def eia_metadata(api_key, api_path=None):
+
+def eia_get_series(start, end, api_key, api_path, parent, subba, length=5000, frequency=None, workers=None,
+                   client=None, cache=None, checkpoint=None):
+    """
+    Fetches several subba series of the same parent in a single paginated stream, using list-valued
+    facets, and splits the result by subba locally.
+
+    Parameters:
+    start (datetime): The start date for the data request.
+    end (datetime): The end date for the data request.
+    api_key (str): The API key for authentication.
+    api_path (str): The path to the specific API endpoint.
+    parent (str): The parent balancing authority id (e.g., CISO).
+    subba (str or list): The subba id(s) to fetch (e.g., ["PGAE", "SCE"]).
+    length (int): The number of rows per page, capped at the API limit of 5000. Defaults to 5000.
+    frequency (str, optional): The frequency of the data (e.g., hourly). Defaults to None.
+    workers (int, optional): The number of pages to fetch concurrently. Defaults to None (serial mode).
+    client (eia_client, optional): The HTTP client shared by all page requests. Defaults to the shared client.
+    cache (eia_cache, optional): The response cache shared by all page requests. Defaults to None.
+    checkpoint (str, optional): The folder where completed pages are checkpointed. Defaults to None.
+
+    Returns:
+    response: An object containing the combined data, a dictionary of DataFrames by subba, parameters,
+    the reported total and any failed offsets.
+    """
+
+    # Inner class to structure the response from the API
+    class response:
+        def __init__(output, data, series, parameters, total, failed):
+            output.data = data
+            output.series = series
+            output.parameters = parameters
+            output.total = total
+            output.failed = failed
+
+    if type(subba) is str:
+        subba = [subba]
+
+    facets = {
+        "parent": parent,
+        "subba": list(subba)
+    }
+
+    # Pull all the series in one paginated stream
+    temp = eia_paginate(start=start,
+                        end=end,
+                        api_key=api_key,
+                        api_path=api_path,
+                        facets=facets,
+                        length=length,
+                        frequency=frequency,
+                        workers=workers,
+                        client=client,
+                        cache=cache,
+                        checkpoint=checkpoint)
+    if temp is None:
+        return
+
+    # Split the result by subba, keeping an empty frame for the series that returned no data
+    if not temp.data.empty and "subba" in temp.data.columns:
+        grouped = dict(tuple(temp.data.groupby("subba", sort=False, observed=True)))
+        empty = temp.data.iloc[0:0]
+    else:
+        grouped = {}
+        empty = pd.DataFrame({"period": pd.Series(dtype="datetime64[ns]"),
+                              "value": pd.Series(dtype="float64")})
+
+    series = {}
+    for s in subba:
+        if s in grouped:
+            series[s] = grouped[s].reset_index(drop=True)
+        else:
+            logger.warning("No data returned for subba: %s", s)
+            series[s] = empty
+
+    output = response(data=temp.data,
+                      series=series,
+                      parameters=temp.parameters,
+                      total=temp.total,
+                      failed=temp.failed)
+
+    return output
+
+
+def eia_stream(start, end, api_key, api_path, facets, rows=5000, frequency=None, workers=None, client=None,
+               cache=None, checkpoint=None):
+    """
+    Streams the data of a query from the EIA API as consecutive hourly windows, so the history is never
+    held in memory at once. Each window is sized by a chunk_planner to fit in one request, from the number
+    of series and then from the row counts returned, and at most `workers` windows are fetched ahead of
+    the one being consumed.
+
+    Parameters:
+    start (datetime.datetime): The start hour for the data request.
+    end (datetime.datetime): The end hour for the data request.
+    api_key (str): The API key for authentication.
+    api_path (str): The path to the specific API endpoint.
+    facets (dict): Additional filtering options for the API request, the list-valued facets set the
+    number of series per hour.
+    rows (int): The target number of rows per window, capped at the API limit of 5000. Defaults to 5000.
+    frequency (str, optional): The frequency of the data (e.g., hourly). Defaults to None.
+    workers (int, optional): The number of windows fetched ahead. Defaults to None (serial mode).
+    client (eia_client, optional): The HTTP client shared by all window requests. Defaults to the shared client.
+    cache (eia_cache, optional): The response cache shared by all window requests. Defaults to None.
+    checkpoint (str, optional): The folder where completed windows are checkpointed, so that a restarted
+    stream yields them again from disk, with the same boundaries, and only fetches the missing ones.
+    Defaults to None.
+
+    Yields:
+    tuple: The (window_start, window_end, data) of each window in period order, data is None when the
+    window could not be fetched.
+    """
+    # Validate the API key
+    if type(api_key) is not str:
+        logger.error("The api_key argument is not a valid string")
+        return
+    elif len(api_key) != 40:
+        logger.error("The length of the api_key is not valid, must be 40 characters")
+        return
+
+    if not isinstance(start, datetime.datetime) or not isinstance(end, datetime.datetime):
+        logger.error("The start and end arguments must be datetime objects")
+        return
+    if workers is not None and (type(workers) is not int or workers < 1):
+        logger.error("The workers argument must be a positive integer")
+        return
+
+    # Size the windows from the number of series per hour, then from the row counts returned
+    planner = chunk_planner(n_series=facet_count(facets), rows=rows)
+    logger.info("Streaming windows of %d hours from %s to %s", planner.hours(), start, end)
+
+    # Load the manifest of the windows completed by a previous run, keyed by their start
+    saved = {}
+    if checkpoint is not None:
+        chunks = eia_checkpoint(folder=checkpoint,
+                                api_path=api_path,
+                                facets=facets,
+                                start=start,
+                                end=end,
+                                mode="stream rows=" + str(planner.rows))
+        for chunk in chunks.completed():
+            window_start, window_end = chunk.split("|")
+            saved[window_start] = datetime.datetime.fromisoformat(window_end)
+
+    # A window completed by a previous run keeps its boundaries, the other ones are sized by the planner
+    def next_window(window_start):
+        if window_start > end:
+            return None
+        if window_start.isoformat() in saved:
+            return window_start, saved[window_start.isoformat()]
+        return planner.next_window(window_start, end)
+
+    def windows():
+        window = next_window(start)
+        while window is not None:
+            yield window
+            window = next_window(window[1] + datetime.timedelta(hours=1))
+
+    # Use the shared client when none is provided, so all windows reuse its connection pool
+    if client is None:
+        client = get_default_client()
+
+    def fetch_window(window):
+        # Reuse the window if it was completed by a previous run
+        if checkpoint is not None:
+            chunk = window[0].isoformat() + "|" + window[1].isoformat()
+            data = chunks.load(chunk)
+            if data is not None:
+                logger.debug("Loaded from checkpoint: start: %s, end: %s", window[0], window[1])
+                return data, len(data)
+
+        temp = eia_paginate(start=window[0],
+                            end=window[1],
+                            api_key=api_key,
+                            api_path=api_path,
+                            facets=facets,
+                            length=5000,
+                            frequency=frequency,
+                            client=client,
+                            cache=cache)
+        if temp is None or temp.failed:
+            logger.error("The window from %s to %s could not be fetched", window[0], window[1])
+            return None, None
+
+        # Record the completed window
+        if checkpoint is not None:
+            chunks.save(chunk, temp.data)
+
+        return temp.data, temp.total
+
+    # Update the estimate with the windows in period order, as they are yielded, so the window boundaries
+    # of a query are the same on every run whatever the fetch timing (and the response cache keeps hitting)
+    def consume(window, result):
+        data, total = result
+        if total is not None:
+            planner.update(window, total)
+        return window[0], window[1], data
+
+    if workers is None or workers == 1:
+        for w in windows():
+            yield consume(w, fetch_window(w))
+        return
+
+    # Keep a bounded number of windows in flight and yield them in period order, each new window
+    # is planned with the row counts of the windows yielded so far
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        planned = windows()
+        pending = []
+        done = False
+        while not done or pending:
+            while not done and len(pending) < workers:
+                w = next(planned, None)
+                if w is None:
+                    done = True
+                else:
+                    pending.append((w, executor.submit(fetch_window, w)))
+            if pending:
+                w, future = pending.pop(0)
+                yield consume(w, future.result())
+
+
+def eia_metadata(api_key, api_path=None, client=None):
     """
     Retrieves metadata from the EIA API.
 
     Parameters:
     api_key (str): The API key for authentication.
     api_path (str, optional): The specific API endpoint path. Defaults to None.
+    client (eia_client, optional): The HTTP client to send the request with. Defaults to the shared client.
 
     Returns:
     response: An object containing metadata, the URL used for the request, and parameters.
@@ -369,22 +1394,26 @@ def eia_metadata(api_key, api_path=None):
 
     # Validate the API key
     if type(api_key) is not str:
-        print("Error: The api_key argument is not a valid string")
+        logger.error("The api_key argument is not a valid string")
         return
     elif len(api_key) != 40:
-        print("Error: The length of the api_key is not valid, must be 40 characters")
+        logger.error("The length of the api_key is not valid, must be 40 characters")
         return
 
+    # Use the shared client when none is provided
+    if client is None:
+        client = get_default_client()
+
     # Construct the base URL based on the provided api_path
     if api_path is None:
-        url = "https://api.eia.gov/v2/" + "?api_key="  # Base URL when no api_path is provided
+        url = client.base_url + "?api_key="  # Base URL when no api_path is provided
     else:
         if api_path[-1] != "/":
             api_path = api_path + "/"  # Ensure the api_path ends with a "/"
-        url = "https://api.eia.gov/v2/" + api_path + "?api_key="  # Full URL with api_path
+        url = client.base_url + api_path + "?api_key="  # Full URL with api_path
 
     # Send a GET request to the constructed URL and parse the JSON response
-    d = requests.get(url + api_key).json()
+    d = client.get_json(url + api_key)
 
     # Prepare the parameters for the response object
     parameters = {
@@ -395,3 +1424,56 @@ def eia_metadata(api_key, api_path=None):
     output = response(url=url, meta=d["response"], parameters=parameters)
 
     return output  # Return the structured response object
+
+
+def eia_facet(api_key, api_path, facet, client=None):
+    """
+    Retrieves the values of a facet (e.g., all the parents or all the subbas of a route) from the EIA API.
+
+    Parameters:
+    api_key (str): The API key for authentication.
+    api_path (str): The path of the route (e.g., electricity/rto/region-sub-ba-data/).
+    facet (str): The facet id (e.g., parent).
+    client (eia_client, optional): The HTTP client to send the request with. Defaults to the shared client.
+
+    Returns:
+    response: An object containing the facet values (id, name), the URL used for the request, and parameters.
+    """
+
+    # Inner class to structure the response from the API
+    class response:
+        def __init__(output, data, url, parameters):
+            output.data = data  # The facet values
+            output.url = url  # The URL that was requested
+            output.parameters = parameters  # Parameters used for the request
+
+    # Validate the API key
+    if type(api_key) is not str:
+        logger.error("The api_key argument is not a valid string")
+        return
+    elif len(api_key) != 40:
+        logger.error("The length of the api_key is not valid, must be 40 characters")
+        return
+
+    # Use the shared client when none is provided
+    if client is None:
+        client = get_default_client()
+
+    # The facet values are listed under <route>/facet/<facet>/
+    if api_path[-1] != "/":
+        api_path = api_path + "/"
+    url = client.base_url + api_path + "facet/" + facet + "/?api_key="
+
+    d = client.get_json(url + api_key)
+    facets = d["response"].get("facets", [])
+    data = pd.DataFrame({"id": [str(f.get("id")) for f in facets],
+                         "name": [f.get("name") for f in facets]})
+
+    parameters = {
+        "api_path": api_path,
+        "facet": facet
+    }
+
+    output = response(data=data, url=url, parameters=parameters)
+
+    return output
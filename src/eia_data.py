@@ -1,9 +1,35 @@
+import os
+import json
+import uuid
+import shutil
+import fnmatch
+import sqlite3
+import logging
 import datetime
+import numpy as np
 import pandas as pd
 import src.eia_api as api
+import src.eia_metrics as eia_metrics
 
+# pyarrow is only required by the Parquet storage backend
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
 
-def create_metadata(data, start, end, type):
+logger = logging.getLogger(__name__)
+
+# Column layout of the hourly series returned by the API
+data_columns = ["period", "subba", "subba-name", "parent", "parent-name", "value", "value-units"]
+
+# Column layout of the series dimension table, and of the fact table referencing it
+dimension_columns = ["series_id", "parent", "parent-name", "subba", "subba-name", "value-units"]
+fact_columns = ["period", "series_id", "value"]
+
+
+def create_metadata(data, start, end, type, gaps=None, qc=None):
     meta = {
         "index": None,
         "parent": None,
@@ -30,8 +56,11 @@ def create_metadata(data, start, end, type):
         meta["start_match"] = start == data["period"].min()
         meta["end_act"] = data["period"].max()
         meta["end_match"] = end == data["period"].max()
-        meta["n_obs"] = len(data)
-        meta["na"] = data["value"].isna().sum()
+        meta["n_obs"] = gaps["n_obs"] if gaps is not None else len(data)
+        if gaps is not None:
+            meta["na"] = gaps["na"]
+        else:
+            meta["na"] = data["value"].isna().sum()
         if meta["start_match"] and meta["end_match"] and type == "refresh" and meta["na"] == 0:
             meta["success"] = True
         else:
@@ -43,98 +72,363 @@ def create_metadata(data, start, end, type):
             meta["comments"] = meta["comments"] + "The end argument does not match the actual; "
         elif meta["na"] != 0:
             meta["comments"] = meta["comments"] + "Missing values were found; "
+            if gaps is not None:
+                meta["comments"] = meta["comments"] + str(gaps["gaps"]) + " gaps, the longest is " + \
+                                   str(gaps["longest_gap"]) + " hours; "
     else:
         meta["comments"] = meta["comments"] + "No new data is available; "
 
+    # A series failing a blocking quality check is not appended, the warnings are only reported
+    if qc is not None:
+        if not qc["passed"]:
+            meta["success"] = False
+        if qc["issues"] != "":
+            meta["comments"] = meta["comments"] + "QC: " + qc["issues"] + "; "
+
     return meta
 
 
-def append_metadata(meta_path, meta, save=False, init=False):
+@eia_metrics.timed("gap_fill")
+def reindex_hourly(data, start, end, keys=None):
+    class reindexed:
+        def __init__(output, data, gaps):
+            output.data = data
+            output.gaps = gaps
+
+    # The (parent, subba) series to place on the grid
+    if keys is None:
+        keys = list(data[["parent", "subba"]].dropna().drop_duplicates().itertuples(index=False, name=None))
+    periods = pd.date_range(start=start, end=end, freq="h")
+    n = len(periods)
+    parents = np.repeat([k[0] for k in keys], n)
+    subbas = np.repeat([k[1] for k in keys], n)
+    grid_index = pd.MultiIndex.from_arrays([parents, subbas, np.tile(periods, len(keys))],
+                                           names=["parent", "subba", "period"])
+
+    # Align the fetched rows on the complete hourly grid of every series
+    if data is None or len(data) == 0 or "subba" not in data.columns:
+        grid = pd.DataFrame({"value": np.nan}, index=grid_index)
+    else:
+        data = data.copy()
+        data["period"] = pd.to_datetime(data["period"])
+        data = data.drop_duplicates(subset=["parent", "subba", "period"], keep="last")
+        grid = data.set_index(["parent", "subba", "period"]).reindex(grid_index)
+    grid = grid.reset_index()
+
+    # Carry the series descriptors over to the gap rows
+    for c in ["subba-name", "parent-name", "value-units"]:
+        if c in grid.columns:
+            grid[c] = grid.groupby(["parent", "subba"], sort=False)[c].transform("first")
+
+    grid = grid[[c for c in data_columns if c in grid.columns] + [c for c in grid.columns if c not in data_columns]]
+
+    # Label the runs of consecutive missing values, a run never crosses a series boundary
+    na = grid["value"].isna().to_numpy()
+    series_start = np.arange(len(grid)) % max(n, 1) == 0
+    run_start = na & (series_start | ~np.roll(na, 1))
+    run_id = np.cumsum(run_start)
+    runs = pd.DataFrame({"parent": grid["parent"].to_numpy()[na],
+                         "subba": grid["subba"].to_numpy()[na],
+                         "run": run_id[na]})
+    run_lengths = runs.groupby(["parent", "subba", "run"], sort=False).size()
+
+    gaps = pd.DataFrame(index=pd.MultiIndex.from_tuples(keys, names=["parent", "subba"]))
+    gaps["n_obs"] = n
+    gaps["na"] = pd.Series(na, index=grid_index).groupby(level=["parent", "subba"], sort=False).sum()
+    gaps["gaps"] = run_lengths.groupby(level=["parent", "subba"], sort=False).size()
+    gaps["longest_gap"] = run_lengths.groupby(level=["parent", "subba"], sort=False).max()
+    gaps["gap_lengths"] = run_lengths.groupby(level=["parent", "subba"], sort=False).agg(list)
+    gaps[["na", "gaps", "longest_gap"]] = gaps[["na", "gaps", "longest_gap"]].fillna(0).astype(int)
+    gaps["gap_lengths"] = [g if isinstance(g, list) else [] for g in gaps["gap_lengths"]]
+
+    output = reindexed(data=grid, gaps=gaps)
+
+    return output
+
+
+def init_gaps(keys):
+    # Running gap statistics of series reindexed window by window
+    return {k: {"n_obs": 0, "na": 0, "gap_lengths": [], "trailing": False} for k in keys}
+
+
+def update_gaps(stats, grid, keys):
+    # Add the missing values of a reindexed window, the grid holds one block of consecutive hours per key.
+    # A run of missing values continuing from the previous window extends the last gap of the series.
+    na = grid["value"].isna().to_numpy().reshape(len(keys), -1)
+    for n, k in enumerate(keys):
+        s = stats[k]
+        x = na[n]
+        if len(x) == 0:
+            continue
+        edges = np.diff(np.concatenate([[0], x.astype(np.int8), [0]]))
+        runs = [int(r) for r in np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)]
+        if runs and x[0] and s["trailing"]:
+            s["gap_lengths"][-1] = s["gap_lengths"][-1] + runs.pop(0)
+        s["gap_lengths"] = s["gap_lengths"] + runs
+        s["n_obs"] = s["n_obs"] + len(x)
+        s["na"] = s["na"] + int(x.sum())
+        s["trailing"] = bool(x[-1])
+
+    return stats
+
+
+def summarize_gaps(stats):
+    # The running statistics in the layout of the gaps returned by reindex_hourly
+    keys = list(stats)
+    gaps = pd.DataFrame(index=pd.MultiIndex.from_tuples(keys, names=["parent", "subba"]))
+    gaps["n_obs"] = [stats[k]["n_obs"] for k in keys]
+    gaps["na"] = [stats[k]["na"] for k in keys]
+    gaps["gaps"] = [len(stats[k]["gap_lengths"]) for k in keys]
+    gaps["longest_gap"] = [max(stats[k]["gap_lengths"], default=0) for k in keys]
+    gaps["gap_lengths"] = [stats[k]["gap_lengths"] for k in keys]
+
+    return gaps
+
+
+def append_metadata(meta_path, meta, save=False, init=False, watermark_path=None):
+    if type(meta) is dict:
+        meta = pd.DataFrame([meta])
+
     if not init:
-        meta_archive = pd.read_csv(meta_path)
-        meta_archive["time"] = pd.to_datetime(meta_archive["time"])
-        meta_archive["end"] = pd.to_datetime(meta_archive["end"])
-        meta_archive["start"] = pd.to_datetime(meta_archive["start"])
-        meta_archive["end_act"] = pd.to_datetime(meta_archive["end_act"])
-        meta_archive["start_act"] = pd.to_datetime(meta_archive["start_act"])
-        meta["index"] = meta_archive["index"].max() + 1
-        meta_new = meta_archive._append(meta)
+        # Only the index column is needed to number the new log entries
+        recover_csv(meta_path)
+        meta_index = pd.read_csv(meta_path, usecols=["index"])
+        meta["index"] = meta_index["index"].max() + 1
+        if watermark_path is not None:
+            watermarks = load_watermarks(path=watermark_path, meta_path=meta_path)
     else:
-        meta_new = meta
-        meta_new["index"] = 1
+        meta["index"] = 1
+        watermarks = {"log_size": 0, "last_index": 0, "series": {}}
 
     if save:
-        meta_new.to_csv(meta_path, index=False)
+        meta = append_csv(path=meta_path, data=meta, init=init)
+        if watermark_path is not None:
+            update_watermarks(path=watermark_path, meta_path=meta_path, watermarks=watermarks, meta=meta)
+
+    return meta
+
 
-    return meta_new
+def append_run_log(path, index, type, values=None, init=False):
+    # One row per run with its metrics, joined to the series log on the index
+    if values is None:
+        values = eia_metrics.registry.snapshot()
+    run = {"index": index, "time": datetime.datetime.now(datetime.timezone.utc), "type": type}
+    run.update(values)
+    run = pd.DataFrame([run])
+
+    # Metrics added after the file was created are left out, so the columns stay aligned
+    init = init or not os.path.exists(path)
+    if not init:
+        recover_csv(path)
+        header = list(pd.read_csv(path, nrows=0).columns)
+        run = run.reindex(columns=header)
+
+    return append_csv(path=path, data=run, init=init)
+
+
+def get_watermarks(meta):
+    # The watermark of a series is the latest end_act of its last stored log entry: the successful ones, and
+    # the backfills stored despite failed windows or blocking QC findings
+    success = meta[(meta["success"] == True) | (meta["update"] == True)].copy()
+    success["end_act"] = pd.to_datetime(success["end_act"])
+    last = success[success["index"] == success.groupby(["parent", "subba"])["index"].transform("max")]
+    last = last.groupby(["parent", "subba"]).agg(end_act=("end_act", "max"), index=("index", "max")).reset_index()
+
+    series = {}
+    for p, s, end_act, index in last[["parent", "subba", "end_act", "index"]].itertuples(index=False, name=None):
+        series[p + "." + s] = {
+            "parent": p,
+            "subba": s,
+            "end_act": str(end_act),
+            "index": int(index)
+        }
+
+    return series
+
+
+def write_watermarks(path, watermarks):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(watermarks, f, indent=4)
+    os.replace(tmp, path)
+
+
+def build_watermarks(path, meta_path):
+    # Rebuild the watermark store from a full scan of the log
+    logger.info("Building the watermarks from %s", meta_path)
+    recover_csv(meta_path)
+    meta = pd.read_csv(meta_path)
+    watermarks = {
+        "log_size": os.path.getsize(meta_path),
+        "last_index": int(meta["index"].max()) if len(meta) > 0 else 0,
+        "series": get_watermarks(meta)
+    }
+    write_watermarks(path, watermarks)
+
+    return watermarks
+
+
+def load_watermarks(path, meta_path):
+    # The store records the size of the log it reflects, so a log written without
+    # updating the store (e.g. a crash in between) triggers a rebuild
+    recover_csv(meta_path)
+    if os.path.exists(path):
+        with open(path) as f:
+            watermarks = json.load(f)
+        if watermarks["log_size"] == os.path.getsize(meta_path):
+            return watermarks
+
+    return build_watermarks(path=path, meta_path=meta_path)
 
 
-def load_metadata(path, series):
+def update_watermarks(path, meta_path, watermarks, meta):
+    # Move the watermarks forward with the successful entries just appended to the log
+    for key, w in get_watermarks(meta).items():
+        current = watermarks["series"].get(key)
+        if current is None or pd.Timestamp(w["end_act"]) > pd.Timestamp(current["end_act"]):
+            watermarks["series"][key] = w
+        else:
+            current["index"] = w["index"]
+    watermarks["last_index"] = max(watermarks["last_index"], int(meta["index"].max()))
+    watermarks["log_size"] = os.path.getsize(meta_path)
+    write_watermarks(path, watermarks)
+
+    return watermarks
+
+
+def load_metadata(path, series, watermark_path=None):
     class metadata:
         def __init__(output, metadata, last_index, request_meta):
             output.metadata = metadata
             output.last_index = last_index
             output.request_meta = request_meta
 
-    meta = pd.read_csv(path)
-    meta["time"] = pd.to_datetime(meta["time"])
-    meta["start"] = pd.to_datetime(meta["start"])
-    meta["start_act"] = pd.to_datetime(meta["start_act"])
-    meta["end"] = pd.to_datetime(meta["end"])
-    meta["end_act"] = pd.to_datetime(meta["end_act"])
-
-    log_temp = {
-        "index": None,
-        "parent": None,
-        "subba": None,
-        "end_act": None,
-        "request_start": None
-    }
-
-    meta_success = meta[meta["success"] == True]
-    for i in series.index:
-        p = series.at[i, "parent_id"]
-        s = series.at[i, "subba_id"]
-        l = meta_success[(meta_success["parent"] == p) & (meta_success["subba"] == s)]
-        l = l[l["index"] == l["index"].max()]
-        log = log_temp
-        log["parent"] = p
-        log["subba"] = s
-        log["end_act"] = l["end_act"].max()
-        log["request_start"] = l["end_act"].max() + datetime.timedelta(hours=1)
-        log["index"] = i
-        if i == series.index.start:
-            request_meta = pd.DataFrame([log])
-        else:
-            request_meta = request_meta._append(pd.DataFrame([log]))
+    if watermark_path is not None:
+        # The watermark store gives the last successful end_act of each series without reading the log
+        watermarks = load_watermarks(path=watermark_path, meta_path=path)
+        meta = None
+        last_index = watermarks["last_index"]
+        wm = watermarks["series"]
+    else:
+        meta = pd.read_csv(path)
+        meta["time"] = pd.to_datetime(meta["time"])
+        meta["start"] = pd.to_datetime(meta["start"])
+        meta["start_act"] = pd.to_datetime(meta["start_act"])
+        meta["end"] = pd.to_datetime(meta["end"])
+        meta["end_act"] = pd.to_datetime(meta["end_act"])
+        last_index = meta["index"].max()
+        wm = get_watermarks(meta)
 
+    keys = series["parent_id"] + "." + series["subba_id"]
+    request_meta = pd.DataFrame({
+        "index": series.index,
+        "parent": series["parent_id"],
+        "subba": series["subba_id"],
+        "end_act": pd.to_datetime([wm[k]["end_act"] if k in wm else None for k in keys])
+    })
+    request_meta["request_start"] = request_meta["end_act"] + datetime.timedelta(hours=1)
     request_meta = request_meta.set_index("index")
 
     output = metadata(metadata=meta,
-                      last_index=meta["index"].max(),
+                      last_index=last_index,
                       request_meta=request_meta)
 
     return output
 
 
 def append_data(data_path, new_data, init=False, save=False):
-    if not init:
-        data = pd.read_csv(data_path)
-        updated_data = data._append(new_data)
-    else:
-        print("Initial data pull")
-        updated_data = new_data
+    if init:
+        logger.info("Initial data pull")
 
     if save:
-        print("Save the data to CSV file")
-        updated_data.to_csv(data_path, index=False)
+        logger.info("Append the data to CSV file")
+        new_data = append_csv(path=data_path, data=new_data, init=init)
 
-    return updated_data
+    return new_data
 
 
-def get_metadata(api_key, api_path, meta_path, series):
-    meta = load_metadata(path=meta_path, series=series)
-    api_metadata = api.eia_metadata(api_key=api_key, api_path=api_path)
+def apply_journal(path):
+    # Truncate the file to its size before the append and write the journaled rows
+    journal = path + ".journal"
+    with open(journal, "rb") as f:
+        size = int(f.readline())
+        rows = f.read()
+
+    with open(path, "rb+") as f:
+        f.truncate(size)
+        f.seek(size)
+        f.write(rows)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.remove(journal)
+
+
+def recover_csv(path):
+    # Replay an append that was interrupted after its journal was committed
+    if not os.path.exists(path + ".journal"):
+        return False
+
+    logger.warning("Recovering an interrupted append to %s", path)
+    apply_journal(path)
+
+    return True
+
+
+def format_csv(data):
+    # Write naive timestamps with a fixed format, so that rows appended in separate batches
+    # (e.g. a batch where every timestamp is at midnight) parse back consistently
+    data = data.copy()
+    for c in data.columns:
+        if pd.api.types.is_datetime64_dtype(data[c]) and getattr(data[c].dt, "tz", None) is None:
+            data[c] = data[c].dt.strftime("%Y-%m-%d %H:%M:%S")
+
+    return data
+
+
+@eia_metrics.timed("csv_write")
+def append_csv(path, data, init=False):
+    recover_csv(path)
+
+    # A new file is written to a temporary file and renamed into place
+    if init or not os.path.exists(path):
+        tmp = path + ".tmp"
+        rows = format_csv(data).to_csv(index=False).encode("utf-8")
+        eia_metrics.registry.inc("bytes_written", len(rows))
+        with open(tmp, "wb") as f:
+            f.write(rows)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return data
+
+    # Validate the new rows against the header of the existing file
+    header = list(pd.read_csv(path, nrows=0).columns)
+    if sorted(header) != sorted(data.columns):
+        raise ValueError("The columns of the new data " + str(list(data.columns)) +
+                         " do not match the header of " + path + " " + str(header))
+    data = data[header]
+    rows = format_csv(data).to_csv(index=False, header=False).encode("utf-8")
+    eia_metrics.registry.inc("bytes_written", len(rows))
+
+    # Commit the rows and the current file size to a journal before touching the file,
+    # so a crash mid-write is rolled forward by recover_csv on the next run
+    journal = path + ".journal"
+    with open(journal + ".tmp", "wb") as f:
+        f.write((str(os.path.getsize(path)) + "\n").encode("utf-8"))
+        f.write(rows)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(journal + ".tmp", journal)
+
+    apply_journal(path)
+
+    return data
+
+
+def get_metadata(api_key, api_path, meta_path, series, client=None, watermark_path=None):
+    meta = load_metadata(path=meta_path, series=series, watermark_path=watermark_path)
+    api_metadata = api.eia_metadata(api_key=api_key, api_path=api_path, client=client)
     end = pd.to_datetime(api_metadata.meta["endPeriod"])
     meta.request_meta["end"] = end
     meta.request_meta["updates_available"] = meta.request_meta["end"] > meta.request_meta["request_start"]
@@ -142,3 +436,807 @@ def get_metadata(api_key, api_path, meta_path, series):
     return meta
 
 
+def build_catalog(api_key, api_path, client=None, sample_hours=168):
+    # Enumerate the parents and subbas of the route through its facet endpoints
+    parents = api.eia_facet(api_key=api_key, api_path=api_path, facet="parent", client=client).data
+    subbas = api.eia_facet(api_key=api_key, api_path=api_path, facet="subba", client=client).data
+
+    # The facet endpoints do not tell the parent of a subba, the pairs are read from the last hours of data.
+    # The sample is not filtered by facets, a filter listing every known id would match all the series anyway
+    # and grow the URL with the number of series
+    api_metadata = api.eia_metadata(api_key=api_key, api_path=api_path, client=client)
+    end = pd.to_datetime(api_metadata.meta["endPeriod"]).to_pydatetime()
+    sample = api.eia_paginate(start=end - datetime.timedelta(hours=sample_hours - 1),
+                              end=end,
+                              api_key=api_key,
+                              api_path=api_path + "data",
+                              facets=None,
+                              client=client)
+    pairs = sample.data[["parent", "parent-name", "subba", "subba-name"]].astype(str).drop_duplicates(["parent", "subba"])
+
+    catalog = pd.DataFrame({"parent_id": pairs["parent"], "subba_id": pairs["subba"]})
+    parent_names = dict(zip(parents["id"], parents["name"]))
+    subba_names = dict(zip(subbas["id"], subbas["name"]))
+    catalog["parent_name"] = [parent_names.get(p) or n for p, n in zip(pairs["parent"], pairs["parent-name"])]
+    catalog["subba_name"] = [subba_names.get(s) or n for s, n in zip(pairs["subba"], pairs["subba-name"])]
+    catalog = catalog[["parent_id", "parent_name", "subba_id", "subba_name"]]
+    catalog = catalog.sort_values(["parent_id", "subba_id"]).reset_index(drop=True)
+
+    unmapped = sorted(set(subbas["id"]) - set(catalog["subba_id"]))
+    if unmapped:
+        logger.warning("%d subbas have no data in the last %d hours and were left out: %s",
+                       len(unmapped), sample_hours, unmapped)
+
+    return catalog
+
+
+def load_catalog(api_key, api_path, path, ttl=7 * 24 * 3600, client=None, refresh=False):
+    # The catalog is enumerated from the API at most once per ttl seconds, and read from path in between
+    catalog = None
+    if os.path.exists(path):
+        with open(path) as f:
+            catalog = json.load(f)
+        age = (datetime.datetime.now(datetime.timezone.utc) -
+               datetime.datetime.fromisoformat(catalog["created"])).total_seconds()
+        if not refresh and catalog["api_path"] == api_path and age < ttl:
+            return pd.DataFrame(catalog["series"])
+
+    logger.info("Refreshing the catalog of %s", api_path)
+    try:
+        series = build_catalog(api_key=api_key, api_path=api_path, client=client)
+    except Exception as e:
+        # A stale catalog is better than no run at all
+        if catalog is not None and catalog["api_path"] == api_path:
+            logger.warning("The catalog refresh failed (%s), using the catalog of %s", e, catalog["created"])
+            return pd.DataFrame(catalog["series"])
+        raise
+
+    catalog = {
+        "api_path": api_path,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "series": series.to_dict(orient="records")
+    }
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(catalog, f, indent=4)
+    os.replace(tmp, path)
+
+    return series
+
+
+def select_series(catalog, parent=None, subba=None):
+    # Keep the series matching any of the patterns, e.g. parent="CISO" for all the subbas of CISO
+    mask = pd.Series(True, index=catalog.index)
+    for column, patterns in [("parent_id", parent), ("subba_id", subba)]:
+        if patterns is None:
+            continue
+        if type(patterns) is str:
+            patterns = [patterns]
+        mask = mask & catalog[column].map(lambda x: any(fnmatch.fnmatchcase(str(x), p) for p in patterns))
+
+    return catalog[mask].reset_index(drop=True)
+
+
+def get_series(config, api_key=None, client=None):
+    # The series of a run, either listed in series.json ("series") or selected from the catalog ("select")
+    if "select" not in config:
+        return pd.DataFrame(config["series"])
+
+    catalog = load_catalog(api_key=api_key,
+                           api_path=config["api_path"],
+                           path=config.get("catalog_path", "metadata/catalog.json"),
+                           ttl=config.get("catalog_ttl", 7 * 24 * 3600),
+                           client=client)
+
+    return select_series(catalog, parent=config["select"].get("parent"), subba=config["select"].get("subba"))
+
+
+def filter_data(data, parent=None, subba=None, start=None, end=None, columns=None):
+    if parent is not None:
+        if type(parent) is str:
+            parent = [parent]
+        data = data[data["parent"].isin(parent)]
+    if subba is not None:
+        if type(subba) is str:
+            subba = [subba]
+        data = data[data["subba"].isin(subba)]
+    if start is not None:
+        data = data[data["period"] >= pd.Timestamp(start)]
+    if end is not None:
+        data = data[data["period"] <= pd.Timestamp(end)]
+    if columns is not None:
+        data = data[columns]
+
+    return data.reset_index(drop=True)
+
+
+def get_series_id(parent, subba):
+    return parent.astype(str) + "." + subba.astype(str)
+
+
+def series_dimension(series):
+    # Build the dimension table from the series listed in metadata/series.json
+    dim = pd.DataFrame({"parent": series["parent_id"],
+                        "parent-name": series["parent_name"],
+                        "subba": series["subba_id"],
+                        "subba-name": series["subba_name"],
+                        "value-units": None})
+    dim["series_id"] = get_series_id(dim["parent"], dim["subba"])
+
+    return dim[dimension_columns]
+
+
+def read_dimension(path):
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=dimension_columns)
+
+    return pd.read_csv(path, dtype=str)
+
+
+def update_dimension(path, dim):
+    # The new attributes take precedence, the existing ones fill in what the new rows miss
+    existing = read_dimension(path)
+    dim = dim[dimension_columns].astype(object)
+    updated = pd.concat([dim, existing], ignore_index=True).groupby("series_id", sort=True).first().reset_index()
+    updated = updated[dimension_columns]
+
+    # The table holds one row per series, so it is rewritten as a whole
+    tmp = path + ".tmp"
+    updated.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+    return updated
+
+
+def split_dimension(data):
+    # Split a frame in the API layout into the fact rows and the series dimension rows
+    data = data.copy()
+    data["series_id"] = get_series_id(data["parent"], data["subba"])
+    dim = data[[c for c in dimension_columns if c in data.columns]].drop_duplicates("series_id")
+    for c in dimension_columns:
+        if c not in dim.columns:
+            dim[c] = None
+    fact = data[fact_columns]
+
+    return fact, dim
+
+
+@eia_metrics.timed("merge")
+def join_dimension(data, dim):
+    # Attach the series attributes to fact rows (by series_id) or to partitioned rows (by parent/subba)
+    if "series_id" in data.columns:
+        data = data.merge(dim, on="series_id", how="left")
+    else:
+        attributes = [c for c in dimension_columns if c not in data.columns or c in ["parent", "subba"]]
+        data = data.merge(dim[attributes], on=["parent", "subba"], how="left")
+    for c in dimension_columns:
+        data[c] = data[c].astype("category")
+
+    return data[[c for c in data_columns if c in data.columns] + [c for c in data.columns if c not in data_columns]]
+
+
+@eia_metrics.timed("merge")
+def merge_rows(current, new, key):
+    # Overwrite the current rows with the new ones on the key, and add the new keys
+    current = current.set_index(key)
+    new = new.set_index(key)[current.columns]
+    existing = new.index.isin(current.index)
+    current.loc[new.index[existing], :] = new[existing]
+
+    return pd.concat([current, new[~existing]]).reset_index()
+
+
+def csv_layout(path):
+    # The layout of an existing CSV history: "fact" (period, series_id, value) or "wide" (the API columns)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    header = pd.read_csv(path, nrows=0).columns
+
+    return "fact" if "series_id" in header else "wide"
+
+
+def drop_revised(data):
+    # Keep the last row of each series and period of a CSV history, the revised values are appended after the originals
+    key = ["series_id", "period"] if "series_id" in data.columns else ["parent", "subba", "period"]
+
+    return data.drop_duplicates(key, keep="last")
+
+
+def convert_csv(path, dimension_path):
+    # One-off conversion of a CSV history in the wide layout to the fact layout and the dimension table
+    recover_csv(path)
+    if csv_layout(path) != "wide":
+        return None
+
+    data = pd.read_csv(path, dtype={"parent": str, "subba": str})
+    data["period"] = pd.to_datetime(data["period"])
+    fact, dim = split_dimension(drop_revised(data))
+    update_dimension(dimension_path, dim)
+    append_csv(path=path, data=fact, init=True)
+    logger.info("%s converted to the fact layout, %d rows of %d series", path, len(fact), len(dim))
+
+    return fact
+
+
+class csv_storage:
+    """
+    Storage backend keeping the full history of all the series in a single CSV file. With a
+    dimension_path, the file only keeps the period, series_id and value columns, and the series
+    attributes are stored once per series in the dimension table. An existing file in the wide layout
+    (the API columns) keeps being appended in that layout until it is converted with convert_csv.
+    With a cache_path, the queries of the readers (charts, rollup rebuilds) are served from the
+    memory-mapped series cache of load_series instead of a scan of the file. The reads of the write
+    path always scan the file, so the appends of a run never rebuild the cache.
+    """
+
+    def __init__(self, path, dimension_path=None, cache_path=None):
+        self.path = path
+        self.dimension_path = dimension_path
+        self.cache_path = cache_path
+
+    def append(self, data, init=False):
+        eia_metrics.registry.inc("rows_written", len(data))
+        if self.dimension_path is None:
+            return append_data(data_path=self.path, new_data=data, init=init, save=True)
+
+        fact, dim = split_dimension(data)
+        update_dimension(self.dimension_path, dim)
+        if not init and csv_layout(self.path) == "wide":
+            append_data(data_path=self.path, new_data=data, save=True)
+        else:
+            append_data(data_path=self.path, new_data=fact, init=init, save=True)
+
+        return data
+
+    def upsert(self, data):
+        # The revised rows are appended like new ones and the reads keep the last row of each series and
+        # period, so a revision never rewrites the history (the old values are kept in the revision log)
+        if data is None or len(data) == 0:
+            return data
+
+        return self.append(data)
+
+    def read(self, parent=None, subba=None, start=None, end=None, columns=None):
+        data = pd.read_csv(self.path, dtype={"series_id": "category"})
+        data["period"] = pd.to_datetime(data["period"])
+        data = drop_revised(data)
+        if "series_id" in data.columns:
+            data = join_dimension(data, read_dimension(self.dimension_path))
+        return filter_data(data, parent=parent, subba=subba, start=start, end=end, columns=columns)
+
+    def query(self, parent=None, subba=None, start=None, end=None, columns=None):
+        if self.cache_path is not None and pa is not None:
+            return load_series(self.path, subba=subba, parent=parent, start=start, end=end, columns=columns,
+                               dimension_path=self.dimension_path, cache_path=self.cache_path)
+        return self.read(parent=parent, subba=subba, start=start, end=end, columns=columns)
+
+
+class parquet_storage:
+    """
+    Storage backend keeping the history as a Parquet dataset partitioned by parent, subba and month
+    (<path>/parent=<parent>/subba=<subba>/month=<YYYY-MM>/part-*.parquet). An append only writes new
+    part files, and reads push the parent/subba/period filters down to the partitions and row groups.
+    """
+
+    partition_cols = ["parent", "subba", "month"]
+
+    def __init__(self, path, dimension_path=None):
+        if pa is None:
+            raise ImportError("The parquet storage backend requires the pyarrow package")
+        self.path = path
+        self.dimension_path = dimension_path
+        self.partitioning = ds.partitioning(pa.schema([("parent", pa.string()),
+                                                       ("subba", pa.string()),
+                                                       ("month", pa.string())]),
+                                            flavor="hive")
+
+    def append(self, data, init=False):
+        # Initializing clears the partitions of a previous run, like the DELETE of the SQLite backend
+        if init and os.path.isdir(self.path):
+            for folder in os.listdir(self.path):
+                if folder.startswith("parent="):
+                    shutil.rmtree(os.path.join(self.path, folder))
+
+        if data is None or len(data) == 0:
+            return data
+
+        if data["parent"].isna().any() or data["subba"].isna().any():
+            raise ValueError("The parent and subba columns are required to partition the data")
+
+        data = data.copy()
+        data["period"] = pd.to_datetime(data["period"])
+        data["month"] = data["period"].dt.strftime("%Y-%m")
+
+        # With a dimension table, the part files only keep the period and value columns
+        if self.dimension_path is not None:
+            fact, dim = split_dimension(data)
+            update_dimension(self.dimension_path, dim)
+            data = data[["period", "value"] + self.partition_cols]
+
+        # Write each new partition chunk into its own part file
+        eia_metrics.registry.inc("rows_written", len(data))
+        batch = uuid.uuid4().hex
+        for (p, s, m), group in data.groupby(self.partition_cols, sort=True, observed=True):
+            folder = os.path.join(self.path, "parent=" + p, "subba=" + s, "month=" + m)
+            os.makedirs(folder, exist_ok=True)
+            table = pa.Table.from_pandas(group.drop(columns=self.partition_cols).sort_values("period"),
+                                         preserve_index=False)
+            pq.write_table(table, os.path.join(folder, "part-" + batch + ".parquet"))
+
+        return data.drop(columns=["month"])
+
+    def upsert(self, data):
+        # Rewrite only the month partitions touched by the new rows
+        if data is None or len(data) == 0:
+            return data
+
+        data = data.copy()
+        data["period"] = pd.to_datetime(data["period"])
+        data["month"] = data["period"].dt.strftime("%Y-%m")
+        if self.dimension_path is not None:
+            fact, dim = split_dimension(data)
+            update_dimension(self.dimension_path, dim)
+            data = data[["period", "value"] + self.partition_cols]
+
+        eia_metrics.registry.inc("rows_written", len(data))
+        batch = uuid.uuid4().hex
+        for (p, s, m), group in data.groupby(self.partition_cols, sort=True, observed=True):
+            folder = os.path.join(self.path, "parent=" + p, "subba=" + s, "month=" + m)
+            os.makedirs(folder, exist_ok=True)
+            new = group.drop(columns=self.partition_cols)
+            old_files = [os.path.join(folder, f) for f in os.listdir(folder) if f.endswith(".parquet")]
+            if old_files:
+                current = pd.concat([pq.read_table(f).to_pandas() for f in old_files], ignore_index=True)
+                new = merge_rows(current, new, ["period"])
+            table = pa.Table.from_pandas(new.sort_values("period"), preserve_index=False)
+            pq.write_table(table, os.path.join(folder, "part-" + batch + ".parquet"))
+            for f in old_files:
+                os.remove(f)
+
+        return data
+
+    def read(self, parent=None, subba=None, start=None, end=None, columns=None):
+        if not os.path.isdir(self.path):
+            return pd.DataFrame()
+
+        dataset = ds.dataset(self.path, format="parquet", partitioning=self.partitioning)
+
+        # Build the filter expression, pruning the month partitions before the period rows
+        expr = None
+        conditions = []
+        if parent is not None:
+            conditions.append(ds.field("parent").isin([parent] if type(parent) is str else list(parent)))
+        if subba is not None:
+            conditions.append(ds.field("subba").isin([subba] if type(subba) is str else list(subba)))
+        if start is not None:
+            start = pd.Timestamp(start)
+            conditions.append(ds.field("month") >= start.strftime("%Y-%m"))
+            conditions.append(ds.field("period") >= start.to_pydatetime())
+        if end is not None:
+            end = pd.Timestamp(end)
+            conditions.append(ds.field("month") <= end.strftime("%Y-%m"))
+            conditions.append(ds.field("period") <= end.to_pydatetime())
+        for c in conditions:
+            expr = c if expr is None else expr & c
+
+        if columns is not None:
+            read_columns = list(dict.fromkeys(list(columns) + ["period", "parent", "subba"]))
+        else:
+            read_columns = [c for c in dataset.schema.names if c != "month"]
+
+        if self.dimension_path is not None:
+            read_columns = [c for c in read_columns if c in dataset.schema.names]
+        data = dataset.to_table(columns=read_columns, filter=expr).to_pandas()
+        if self.dimension_path is not None:
+            data = join_dimension(data, read_dimension(self.dimension_path))
+        data = data.sort_values(["subba", "period"]).reset_index(drop=True)
+        if columns is not None:
+            data = data[columns]
+        else:
+            data = data[[c for c in data_columns if c in data.columns] +
+                        [c for c in data.columns if c not in data_columns]]
+
+        return data
+
+    def query(self, parent=None, subba=None, start=None, end=None, columns=None):
+        # The reads are already partition-pruned, the readers query the dataset directly
+        return self.read(parent=parent, subba=subba, start=start, end=end, columns=columns)
+
+
+class sqlite_storage:
+    """
+    Storage backend keeping the history in a SQLite database. The hourly table has a
+    (parent, subba, period) primary key and an index on period, appends upsert on that key so that
+    revised values overwrite the stored ones, and reads are index lookups. The series attributes
+    are stored once per series in the series table.
+    """
+
+    def __init__(self, path, dimension_path=None):
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder != "":
+            os.makedirs(folder, exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS series ("
+                         "series_id TEXT PRIMARY KEY, parent TEXT, parent_name TEXT, "
+                         "subba TEXT, subba_name TEXT, value_units TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS hourly ("
+                         "parent TEXT NOT NULL, subba TEXT NOT NULL, period TEXT NOT NULL, value REAL, "
+                         "PRIMARY KEY (parent, subba, period)) WITHOUT ROWID")
+            conn.execute("CREATE INDEX IF NOT EXISTS hourly_period ON hourly (period)")
+
+    def connect(self):
+        return sqlite3.connect(self.path)
+
+    def append(self, data, init=False):
+        if data is None or len(data) == 0:
+            return data
+
+        if data["parent"].isna().any() or data["subba"].isna().any():
+            raise ValueError("The parent and subba columns are required to store the data")
+
+        fact, dim = split_dimension(data)
+        dim = dim.astype(object).where(dim.notna(), None)
+        rows = pd.DataFrame({"parent": data["parent"].astype(str),
+                             "subba": data["subba"].astype(str),
+                             "period": pd.to_datetime(data["period"]).dt.strftime("%Y-%m-%d %H:%M:%S"),
+                             "value": data["value"].astype("float64")})
+        rows = rows.astype(object).where(rows.notna(), None)
+        eia_metrics.registry.inc("rows_written", len(rows))
+
+        with self.connect() as conn:
+            if init:
+                conn.execute("DELETE FROM hourly")
+            # Keep the known attributes of a series when the new rows miss them
+            conn.executemany("INSERT INTO series VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (series_id) DO UPDATE SET "
+                             "parent_name = COALESCE(excluded.parent_name, parent_name), "
+                             "subba_name = COALESCE(excluded.subba_name, subba_name), "
+                             "value_units = COALESCE(excluded.value_units, value_units)",
+                             dim[dimension_columns].itertuples(index=False, name=None))
+            # Revised values overwrite the stored ones, missing values never erase them
+            conn.executemany("INSERT INTO hourly VALUES (?, ?, ?, ?) ON CONFLICT (parent, subba, period) DO UPDATE SET "
+                             "value = COALESCE(excluded.value, value)",
+                             rows.itertuples(index=False, name=None))
+
+        return data
+
+    def upsert(self, data):
+        # Appends already upsert on the primary key
+        return self.append(data)
+
+    def read(self, parent=None, subba=None, start=None, end=None, columns=None):
+        query = ("SELECT h.period AS period, h.subba AS subba, s.subba_name AS \"subba-name\", "
+                 "h.parent AS parent, s.parent_name AS \"parent-name\", h.value AS value, "
+                 "s.value_units AS \"value-units\" "
+                 "FROM hourly h LEFT JOIN series s ON s.parent = h.parent AND s.subba = h.subba")
+        conditions = []
+        params = []
+        if parent is not None:
+            parent = [parent] if type(parent) is str else list(parent)
+            conditions.append("h.parent IN (" + ", ".join("?" * len(parent)) + ")")
+            params = params + parent
+        if subba is not None:
+            subba = [subba] if type(subba) is str else list(subba)
+            conditions.append("h.subba IN (" + ", ".join("?" * len(subba)) + ")")
+            params = params + subba
+        if start is not None:
+            conditions.append("h.period >= ?")
+            params.append(pd.Timestamp(start).strftime("%Y-%m-%d %H:%M:%S"))
+        if end is not None:
+            conditions.append("h.period <= ?")
+            params.append(pd.Timestamp(end).strftime("%Y-%m-%d %H:%M:%S"))
+        if conditions:
+            query = query + " WHERE " + " AND ".join(conditions)
+        query = query + " ORDER BY h.subba, h.period"
+
+        with self.connect() as conn:
+            data = pd.read_sql_query(query, conn, params=params)
+        data["period"] = pd.to_datetime(data["period"])
+        data["value"] = data["value"].astype("float64")
+        for c in ["subba", "subba-name", "parent", "parent-name", "value-units"]:
+            data[c] = data[c].astype("category")
+        if columns is not None:
+            data = data[columns]
+
+        return data
+
+    def query(self, parent=None, subba=None, start=None, end=None, columns=None):
+        # The reads are already index lookups, the readers query the database directly
+        return self.read(parent=parent, subba=subba, start=start, end=end, columns=columns)
+
+
+def get_revisions(stored, new_data):
+    # Compare the re-fetched values with the stored ones, a value filling a stored gap counts as a revision
+    keys = ["parent", "subba", "period"]
+    new = pd.DataFrame({"parent": new_data["parent"].astype(str),
+                        "subba": new_data["subba"].astype(str),
+                        "period": pd.to_datetime(new_data["period"]),
+                        "value": new_data["value"].astype("float64")})
+    old = pd.DataFrame({"parent": stored["parent"].astype(str),
+                        "subba": stored["subba"].astype(str),
+                        "period": pd.to_datetime(stored["period"]),
+                        "value": stored["value"].astype("float64")})
+    merged = new.merge(old.drop_duplicates(keys, keep="last"), on=keys, how="left", suffixes=("", "_stored"))
+    changed = merged["value"].notna() & (merged["value_stored"].isna() | (merged["value"] != merged["value_stored"]))
+
+    revisions = merged[changed].rename(columns={"value_stored": "old_value", "value": "new_value"})
+    revisions.insert(0, "time", datetime.datetime.now(datetime.timezone.utc))
+
+    return revisions[["time", "parent", "subba", "period", "old_value", "new_value"]].reset_index(drop=True)
+
+
+def revise_data(storage, new_data, revision_path=None, stored=None):
+    class revised:
+        def __init__(output, data, revisions):
+            output.data = data
+            output.revisions = revisions
+
+    if new_data is None or len(new_data) == 0:
+        return revised(data=new_data, revisions=None)
+
+    # Load the stored values of the re-fetched window only, filtering the window read once per run when given
+    parent = [str(p) for p in new_data["parent"].dropna().unique()]
+    subba = [str(s) for s in new_data["subba"].dropna().unique()]
+    if stored is not None:
+        stored = filter_data(stored, parent=parent, subba=subba, start=new_data["period"].min(),
+                             end=new_data["period"].max())
+    else:
+        stored = storage.read(parent=parent, subba=subba, start=new_data["period"].min(), end=new_data["period"].max())
+    if len(stored) == 0:
+        stored = pd.DataFrame({"parent": [], "subba": [], "period": [], "value": []})
+    revisions = get_revisions(stored=stored, new_data=new_data)
+    logger.info("%d revised values were found", len(revisions))
+
+    # Write only the changed rows, and log the old and new values
+    changed = new_data.iloc[0:0]
+    if len(revisions) > 0:
+        keys = pd.DataFrame({"parent": new_data["parent"].astype(str),
+                             "subba": new_data["subba"].astype(str),
+                             "period": pd.to_datetime(new_data["period"])})
+        mask = keys.merge(revisions[["parent", "subba", "period"]], how="left", indicator=True)["_merge"] == "both"
+        changed = new_data[mask.to_numpy()]
+        storage.upsert(changed)
+        if revision_path is not None:
+            append_csv(path=revision_path, data=revisions)
+
+    output = revised(data=changed, revisions=revisions)
+
+    return output
+
+
+def get_storage(path, dimension_path=None, cache_path=None):
+    if path.endswith(".csv"):
+        return csv_storage(path, dimension_path=dimension_path, cache_path=cache_path)
+    elif path.endswith(".db") or path.endswith(".sqlite"):
+        return sqlite_storage(path)
+    else:
+        return parquet_storage(path, dimension_path=dimension_path)
+
+
+def series_cache_source(data_path, dimension_path=None):
+    # The size and modification time of the files the series cache is built from
+    source = {}
+    for path in [data_path, dimension_path]:
+        if path is not None and os.path.exists(path):
+            stat = os.stat(path)
+            source[path] = [stat.st_size, stat.st_mtime_ns]
+
+    return source
+
+
+def read_series_index(cache_path):
+    # The series index is kept in the schema metadata, reading it does not touch the data pages
+    if not os.path.exists(cache_path):
+        return None
+    with pa.memory_map(cache_path, "r") as f:
+        metadata = pa.ipc.open_file(f).schema.metadata or {}
+    if b"eia_series" not in metadata:
+        return None
+
+    return json.loads(metadata[b"eia_series"])
+
+
+def build_series_cache(data_path, cache_path=None, dimension_path=None):
+    if cache_path is None:
+        cache_path = data_path + ".arrow"
+    source = series_cache_source(data_path, dimension_path)
+
+    # Sort the history by series and period, so each series is a contiguous range of rows
+    data = get_storage(data_path, dimension_path=dimension_path).read()
+    data = data.sort_values(["parent", "subba", "period"], kind="stable").reset_index(drop=True)
+    for c in ["subba", "subba-name", "parent", "parent-name", "value-units"]:
+        if c in data.columns:
+            data[c] = data[c].astype("category")
+    parent = data["parent"].astype(str).to_numpy()
+    subba = data["subba"].astype(str).to_numpy()
+    first = np.flatnonzero(np.concatenate([[True], (parent[1:] != parent[:-1]) | (subba[1:] != subba[:-1])]))
+    n = np.diff(np.concatenate([first, [len(data)]]))
+    index = {
+        "source": source,
+        "series": [[parent[i], subba[i], int(i), int(k)] for i, k in zip(first, n)]
+    }
+
+    # An uncompressed Arrow IPC (Feather v2) file in a single record batch is memory-mapped without copies
+    table = pa.Table.from_pandas(data, preserve_index=False).combine_chunks()
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"eia_series"] = json.dumps(index).encode("utf-8")
+    table = table.replace_schema_metadata(metadata)
+    folder = os.path.dirname(cache_path)
+    if folder != "":
+        os.makedirs(folder, exist_ok=True)
+    tmp = cache_path + ".tmp"
+    with pa.OSFile(tmp, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=max(1, len(data)))
+    os.replace(tmp, cache_path)
+    logger.info("Series cache %s built with %d rows of %d series", cache_path, len(data), len(first))
+
+    return index
+
+
+def load_series(data_path, subba=None, parent=None, start=None, end=None, columns=None, dimension_path=None,
+                cache_path=None):
+    # The Parquet and SQLite backends push the filters down already, the CSV history is served from
+    # a memory-mapped Arrow copy (rebuilt when the CSV file or the dimension table changed)
+    if pa is None or not data_path.endswith(".csv"):
+        return get_storage(data_path, dimension_path=dimension_path).read(parent=parent, subba=subba, start=start,
+                                                                          end=end, columns=columns)
+    if cache_path is None:
+        cache_path = data_path + ".arrow"
+    index = read_series_index(cache_path)
+    if index is None or index["source"] != series_cache_source(data_path, dimension_path):
+        build_series_cache(data_path, cache_path=cache_path, dimension_path=dimension_path)
+
+    if type(parent) is str:
+        parent = [parent]
+    if type(subba) is str:
+        subba = [subba]
+
+    with pa.memory_map(cache_path, "r") as f:
+        table = pa.ipc.open_file(f).read_all()
+        index = json.loads(table.schema.metadata[b"eia_series"])
+
+        # Slice the rows of each requested series, and binary search the period range within it
+        slices = []
+        for p, s, first, n in index["series"]:
+            if (parent is not None and p not in parent) or (subba is not None and s not in subba):
+                continue
+            lo, hi = 0, n
+            if start is not None or end is not None:
+                period = table.column("period").slice(first, n).to_numpy()
+                if start is not None:
+                    lo = int(np.searchsorted(period, pd.Timestamp(start).to_datetime64(), side="left"))
+                if end is not None:
+                    hi = int(np.searchsorted(period, pd.Timestamp(end).to_datetime64(), side="right"))
+            if hi > lo:
+                slices.append(table.slice(first + lo, hi - lo))
+
+        if columns is not None:
+            table = table.select(columns)
+            slices = [t.select(columns) for t in slices]
+        if slices:
+            data = pa.concat_tables(slices).to_pandas()
+        else:
+            data = table.slice(0, 0).to_pandas()
+
+    return data
+
+
+# Rollup tables maintained from the hourly history, with their key columns and period
+rollup_levels = {
+    "daily": (["parent", "subba"], "D"),
+    "monthly": (["parent", "subba"], "M"),
+    "parent_daily": (["parent"], "D"),
+    "parent_monthly": (["parent"], "M")
+}
+
+
+def rollup_hourly(data):
+    # Sum the hourly values of each series by day, counting the observed and the missing hours
+    hourly = pd.DataFrame({"parent": data["parent"].astype(str).to_numpy(),
+                           "subba": data["subba"].astype(str).to_numpy(),
+                           "period": pd.to_datetime(data["period"]).dt.floor("D").to_numpy(),
+                           "value": data["value"].astype("float64").to_numpy()})
+    daily = hourly.groupby(["parent", "subba", "period"], sort=True)["value"].agg(["sum", "count", "size"])
+    daily = daily.reset_index().rename(columns={"sum": "value", "count": "n_obs"})
+    daily["na"] = daily["size"] - daily["n_obs"]
+
+    return daily[["parent", "subba", "period", "value", "n_obs", "na"]]
+
+
+def rollup_daily(daily, level):
+    # Roll the daily rows of the series up to the keys and the period of a level
+    keys, freq = rollup_levels[level]
+    data = daily.copy()
+    if freq == "M":
+        data["period"] = data["period"].dt.to_period("M").dt.to_timestamp()
+    rollup = data.groupby(keys + ["period"], sort=True)[["value", "n_obs", "na"]].sum().reset_index()
+
+    return rollup[keys + ["period", "value", "n_obs", "na"]]
+
+
+def read_rollup(path, level):
+    rollup_path = os.path.join(path, level + ".csv")
+    keys, freq = rollup_levels[level]
+    if not os.path.exists(rollup_path):
+        return pd.DataFrame({c: pd.Series(dtype=object) for c in keys} |
+                            {"period": pd.Series(dtype="datetime64[ns]"), "value": pd.Series(dtype="float64"),
+                             "n_obs": pd.Series(dtype="int64"), "na": pd.Series(dtype="int64")})
+
+    rollup = pd.read_csv(rollup_path, dtype={c: str for c in keys})
+    rollup["period"] = pd.to_datetime(rollup["period"])
+
+    return rollup
+
+
+def write_rollup(path, level, rows, replace=False):
+    # Upsert the recomputed buckets into a rollup table, the table is small and rewritten as a whole
+    keys, freq = rollup_levels[level]
+    os.makedirs(path, exist_ok=True)
+    current = read_rollup(path, level)
+    if not replace and len(current) > 0:
+        rows = merge_rows(current, rows, keys + ["period"])
+    rows = rows.sort_values(keys + ["period"]).reset_index(drop=True)
+    append_csv(path=os.path.join(path, level + ".csv"), data=rows, init=True)
+
+    return rows
+
+
+@eia_metrics.timed("rollup")
+def update_rollups(path, new_data, storage, hourly=None):
+    # Recompute the days touched by the new rows (appends and revisions) from the stored hourly values,
+    # then the months and the parent totals of those days from the daily table. The hourly values of the
+    # touched days are read from the storage unless the caller already holds them
+    if new_data is None or len(new_data) == 0:
+        return {level: read_rollup(path, level) for level in rollup_levels}
+
+    touched = pd.DataFrame({"parent": new_data["parent"].astype(str).to_numpy(),
+                            "subba": new_data["subba"].astype(str).to_numpy(),
+                            "period": pd.to_datetime(new_data["period"]).dt.floor("D").to_numpy()}).drop_duplicates()
+    if hourly is None:
+        hourly = storage.read(parent=list(touched["parent"].unique()),
+                              subba=list(touched["subba"].unique()),
+                              start=touched["period"].min(),
+                              end=touched["period"].max() + datetime.timedelta(hours=23))
+    daily = rollup_hourly(hourly).merge(touched, on=["parent", "subba", "period"])
+
+    tables = {"daily": write_rollup(path, "daily", daily)}
+    touched_month = daily.assign(month=daily["period"].dt.to_period("M"))
+    for level in ["monthly", "parent_daily", "parent_monthly"]:
+        keys, freq = rollup_levels[level]
+        bucket = "month" if freq == "M" else "period"
+        rows = tables["daily"].assign(month=tables["daily"]["period"].dt.to_period("M"))
+        rows = rows.merge(touched_month[keys + [bucket]].drop_duplicates(), on=keys + [bucket])
+        tables[level] = write_rollup(path, level, rollup_daily(rows.drop(columns=["month"]), level))
+
+    return tables
+
+
+def fold_daily(daily):
+    # Sum the partial daily rows of the same series and day, e.g. from the windows of a backfill splitting a day
+    daily = daily.groupby(["parent", "subba", "period"], sort=True)[["value", "n_obs", "na"]].sum().reset_index()
+
+    return daily[["parent", "subba", "period", "value", "n_obs", "na"]]
+
+
+def write_rollups(path, daily):
+    # Replace all the tables with the daily rows of the full history and their rollups
+    tables = {"daily": write_rollup(path, "daily", daily, replace=True)}
+    for level in ["monthly", "parent_daily", "parent_monthly"]:
+        tables[level] = write_rollup(path, level, rollup_daily(daily, level), replace=True)
+
+    return tables
+
+
+@eia_metrics.timed("rollup")
+def build_rollups(path, storage, parents):
+    # Rebuild all the tables from the stored history one parent at a time, the backfill folds them
+    # from its windows instead
+    daily = []
+    for p in parents:
+        hourly = storage.query(parent=str(p), columns=["period", "parent", "subba", "value"])
+        if len(hourly) > 0:
+            daily.append(rollup_hourly(hourly))
+    daily = pd.concat(daily, ignore_index=True) if daily else read_rollup(path, "daily").iloc[0:0]
+
+    return write_rollups(path, daily)
@@ -1,6 +1,14 @@
-import pandas as pd
+import time
+import logging
 import datetime
-import eia_api
+import concurrent.futures
+import pandas as pd
+import src.eia_api as eia_api
+import src.eia_data as eia_data
+import src.eia_metrics as eia_metrics
+import src.eia_qc as eia_qc
+
+logger = logging.getLogger(__name__)
 
 
 def load_log(path):
@@ -59,7 +67,7 @@ def eia_data_refresh(start, end, api_key, api_path, facets):
     df = None
 
     if (start < end):
-        print("Updates are available")
+        logger.info("Updates are available")
 
         df = eia_api.eia_get(api_key=api_key,
                              api_path=api_path,
@@ -74,13 +82,13 @@ def eia_data_refresh(start, end, api_key, api_path, facets):
             n_obs = len(df.data)
             na = df.data["value"].isna().sum()
             if start_match_flag and end_match_flag and na == 0 and n_obs > 0:
-                print("Refresh successed")
+                logger.info("Refresh successed")
                 success_flag = True
             else:
                 success_flag = False
-                print("Refresh failed")
+                logger.warning("Refresh failed")
         else:
-            print("Refresh failed")
+            logger.warning("Refresh failed")
             success_flag = False
             start_match_flag = None
             end_match_flag = None
@@ -89,7 +97,7 @@ def eia_data_refresh(start, end, api_key, api_path, facets):
             n_obs = None
             na = None
     else:
-        print("No updates are available...")
+        logger.info("No updates are available...")
         success_flag = False
         start_match_flag = None
         end_match_flag = None
@@ -138,8 +146,8 @@ def append_new_data(data_path, log_path, new_data, save=False):
     new_data.log["update"] = False
 
     if new_data.status:
-        print("Appending the new data to the series")
-        print("Adding " + str(len(new_data.data)) + " new rows")
+        logger.info("Appending the new data to the series")
+        logger.info("Adding %d new rows", len(new_data.data))
         pre_data = pd.read_csv(data_path)
         pre_data["period"] = pd.to_datetime(pre_data["period"])
         pre_data["value"] = pd.to_numeric(pre_data["value"])
@@ -151,12 +159,12 @@ def append_new_data(data_path, log_path, new_data, save=False):
         new_log = log.log._append(log_file_new)
 
         if save:
-            print("Save the data into CSV file")
+            logger.info("Save the data into CSV file")
             data.to_csv(data_path, index=False)
-            print("Save the metadata into CSV file")
+            logger.info("Save the metadata into CSV file")
             new_log.to_csv(log_path, index=False)
     else:
-        print("No new data is available or the data refresh failed, please check the log file")
+        logger.warning("No new data is available or the data refresh failed, please check the log file")
 
         data = pd.read_csv(data_path)
         data["period"] = pd.to_datetime(data["period"])
@@ -165,9 +173,360 @@ def append_new_data(data_path, log_path, new_data, save=False):
         log_file_new = pd.DataFrame([new_data.log])
         new_log = log.log._append(log_file_new)
         if save:
-            print("Save the metadata into CSV file")
+            logger.info("Save the metadata into CSV file")
             new_log.to_csv(log_path, index=False)
 
     output = appended_data(data=data, data_update=new_data.log["update"], log=new_log)
 
-    return output
\ No newline at end of file
+    return output
+
+
+def refresh_pipeline(api_key, api_path, request_meta, storage, meta_path, watermark_path=None, revision_path=None,
+                     lookback=0, workers=4, client=None, save=True, run_log_path=None, metrics_path=None,
+                     qc_path=None, qc_options=None, rollup_path=None):
+    class pipeline_run:
+        def __init__(output, data, meta, timings, qc):
+            output.data = data
+            output.meta = meta
+            output.timings = timings
+            output.qc = qc
+
+    m = request_meta
+    if api_path[-1] != "/":
+        api_path = api_path + "/"
+    timings = []
+    # The rows written by the run (appends and revisions), to update the rollups of the days they touch
+    written = []
+
+    def timed(task, stage, func, *args):
+        t = time.perf_counter()
+        result = func(*args)
+        seconds = time.perf_counter() - t
+        timings.append({"parent": task[0], "subba": task[1], "stage": stage, "seconds": seconds})
+        eia_metrics.registry.observe(stage, seconds)
+        return result
+
+    # Fetch: all the subbas of a parent in one paginated stream, from the start of the lookback window
+    def fetch(p, group):
+        return eia_api.eia_get_series(api_key=api_key,
+                                      api_path=api_path + "data",
+                                      parent=p,
+                                      subba=list(group["subba"]),
+                                      start=(group["request_start"].min() -
+                                             datetime.timedelta(hours=lookback)).to_pydatetime(),
+                                      end=group["end"].max().to_pydatetime(),
+                                      client=client)
+
+    # QC: check all the subbas of a parent at once. The new rows of each series decide its success and the
+    # lookback rows whether their revisions are applied, each set gives the rolling checks of the other history
+    def check(pull, group):
+        if pull is None:
+            return None, None
+        request_start = pull.data["subba"].astype(str).map(dict(zip(group["subba"].astype(str),
+                                                                    group["request_start"])))
+        new = pd.to_datetime(pull.data["period"]) >= pd.to_datetime(request_start)
+        data = pull.data.assign(qc_new=new.to_numpy(), qc_lookback=~new.to_numpy())
+        return (eia_qc.qc_report(data, counted="qc_new", **(qc_options or {})),
+                eia_qc.qc_report(data, counted="qc_lookback", **(qc_options or {})))
+
+    def fetch_check(p, group):
+        pull = timed((p, None), "fetch", fetch, p, group)
+        return (pull,) + timed((p, None), "qc", check, pull, group)
+
+    # Validate: place the new rows of a series on the hourly grid and build its log entry
+    def validate(i, pull, report, lookback_report):
+        start = m.at[i, "request_start"]
+        end = m.at[i, "end"]
+        temp = pull.series[m.at[i, "subba"]] if pull is not None else None
+        ts_obj = None
+        gaps = None
+        if temp is not None and m.at[i, "updates_available"]:
+            new = temp[(temp["period"] >= start) & (temp["period"] <= end)]
+            grid = eia_data.reindex_hourly(data=new, start=start, end=end,
+                                           keys=[(m.at[i, "parent"], m.at[i, "subba"])])
+            ts_obj = grid.data
+            gaps = grid.gaps.iloc[0]
+
+        qc = None
+        if ts_obj is not None and report is not None:
+            qc = report.get((str(m.at[i, "parent"]), str(m.at[i, "subba"])))
+        meta = eia_data.create_metadata(data=ts_obj, start=start, end=end, type="refresh", gaps=gaps, qc=qc)
+        if ts_obj is None:
+            meta["parent"] = m.at[i, "parent"]
+            meta["subba"] = m.at[i, "subba"]
+            if pull is None:
+                meta["comments"] = meta["comments"] + "The data pull failed; "
+
+        if temp is not None and lookback > 0:
+            revision = temp[(temp["period"] >= start - datetime.timedelta(hours=lookback)) & (temp["period"] < start)]
+        else:
+            revision = None
+
+        # Revisions failing the blocking checks are not written over the stored values
+        lookback_qc = None
+        if revision is not None and len(revision) > 0 and lookback_report is not None:
+            lookback_qc = lookback_report.get((str(m.at[i, "parent"]), str(m.at[i, "subba"])))
+        if lookback_qc is not None and not lookback_qc["passed"]:
+            meta["comments"] = meta["comments"] + "The lookback revisions were not applied, QC: " + \
+                               lookback_qc["issues"] + "; "
+            revision = None
+
+        return ts_obj, meta, revision
+
+    # Append: run by a single writer, so the storage and the revision log are never written concurrently
+    def append(ts_obj, meta, revision):
+        if save and revision is not None:
+            revised = eia_data.revise_data(storage=storage, new_data=revision, revision_path=revision_path,
+                                           stored=stored)
+            if revised.revisions is not None and len(revised.revisions) > 0:
+                meta["comments"] = meta["comments"] + str(len(revised.revisions)) + " values were revised; "
+                written.append(revised.data)
+
+        if meta["success"]:
+            if save:
+                # Hours already stored (e.g. a backfill window that could not be fetched and was stored as
+                # missing values) are revised in place, only the hours past the stored ones are appended
+                new_rows = ts_obj
+                if stored is not None and len(stored) > 0:
+                    done = eia_data.filter_data(stored, parent=str(meta["parent"]), subba=str(meta["subba"]),
+                                                start=ts_obj["period"].min())
+                    seen = ts_obj["period"].isin(done["period"]).to_numpy()
+                    if seen.any():
+                        revised = eia_data.revise_data(storage=storage, new_data=ts_obj[seen],
+                                                       revision_path=revision_path, stored=stored)
+                        if revised.revisions is not None and len(revised.revisions) > 0:
+                            meta["comments"] = meta["comments"] + str(len(revised.revisions)) + \
+                                               " stored values were filled or revised; "
+                        new_rows = ts_obj[~seen]
+                storage.append(new_rows)
+                written.append(ts_obj)
+            meta["update"] = True
+        else:
+            meta["update"] = False
+            meta["comments"] = meta["comments"] + "The data refresh failed, please check the log; "
+
+        return meta
+
+    t_start = time.perf_counter()
+
+    # Read the stored window of the run once, from the start of the day of the lookback window: the revision
+    # check of each series filters it in memory, the new rows already stored are revised instead of appended,
+    # and the rollups recompute the touched days from it
+    stored = None
+    if save and m["request_start"].notna().any():
+        stored = storage.read(parent=[str(p) for p in m["parent"].unique()],
+                              subba=[str(s) for s in m["subba"].unique()],
+                              start=(m["request_start"].min() -
+                                     datetime.timedelta(hours=lookback)).floor("D").to_pydatetime())
+
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=1) as writer:
+        groups = {p: group for p, group in m.groupby("parent", sort=False)}
+        fetches = {pool.submit(fetch_check, p, group): p for p, group in groups.items()}
+
+        # Validate the series of each parent as soon as its pull completes
+        validations = {}
+        reports = []
+        for f in concurrent.futures.as_completed(fetches):
+            p = fetches[f]
+            try:
+                pull, report, lookback_report = f.result()
+            except Exception as e:
+                logger.error("Error occurred while fetching the data of %s: %s", p, e)
+                pull, report, lookback_report = None, None, None
+            if report is not None:
+                reports.append(report)
+                # Plain dictionaries of the report rows, a DataFrame lookup is not thread-safe
+                report = {(r["parent"], r["subba"]): r for r in report.to_dict(orient="records")}
+                lookback_report = {(r["parent"], r["subba"]): r for r in lookback_report.to_dict(orient="records")}
+            for i in groups[p].index:
+                task = (m.at[i, "parent"], m.at[i, "subba"])
+                validations[pool.submit(timed, task, "validate", validate, i, pull, report, lookback_report)] = i
+
+        # Hand each validated series to the single writer
+        appends = {}
+        for v in concurrent.futures.as_completed(validations):
+            i = validations[v]
+            ts_obj, meta, revision = v.result()
+            task = (m.at[i, "parent"], m.at[i, "subba"])
+            appends[writer.submit(timed, task, "append", append, ts_obj, meta, revision)] = (i, ts_obj)
+
+        for a in appends:
+            i, ts_obj = appends[a]
+            results[i] = (ts_obj, a.result())
+
+    # Log the run in the series order
+    order = [i for i in m.index if i in results]
+    meta_new = pd.DataFrame([results[i][1] for i in order])
+    new_data = [results[i][0] for i in order if results[i][0] is not None]
+    data = pd.concat(new_data, ignore_index=True) if new_data else None
+    if save:
+        meta_new = eia_data.append_metadata(meta_path=meta_path,
+                                            meta=meta_new,
+                                            save=True,
+                                            init=False,
+                                            watermark_path=watermark_path)
+
+    # Recompute the daily, monthly and parent totals of the days touched by the run
+    if save and rollup_path is not None and written:
+        columns = ["parent", "subba", "period", "value"]
+        new_rows = pd.concat([w[columns].astype({"parent": str, "subba": str}) for w in written], ignore_index=True)
+        # The hourly values of the touched days are the stored window updated with the rows written by the run
+        hourly = None
+        if stored is not None:
+            hourly = new_rows
+            if len(stored) > 0:
+                hourly = pd.concat([stored[columns].astype({"parent": str, "subba": str}), new_rows],
+                                   ignore_index=True)
+            hourly = hourly.drop_duplicates(["parent", "subba", "period"], keep="last")
+        eia_data.update_rollups(path=rollup_path, new_data=new_rows, storage=storage, hourly=hourly)
+
+    # Keep the QC report of the run next to the series log
+    qc = pd.concat(reports, ignore_index=True) if reports else None
+    if qc is not None:
+        failed = qc[~qc["passed"]]
+        for row in failed.itertuples(index=False):
+            logger.warning("QC failed for %s/%s: %s", row.parent, row.subba, row.issues)
+        if save and qc_path is not None:
+            eia_qc.append_report(path=qc_path, report=qc, index=int(meta_new["index"].max()), type="refresh")
+
+    timings = pd.DataFrame(timings, columns=["parent", "subba", "stage", "seconds"])
+    logger.info("Refresh completed in %.2f seconds", time.perf_counter() - t_start)
+    eia_metrics.log_summary()
+
+    # Record the metrics of the run next to the series log
+    if save and run_log_path is not None:
+        eia_data.append_run_log(path=run_log_path, index=int(meta_new["index"].max()), type="refresh")
+    if metrics_path is not None:
+        eia_metrics.registry.to_prometheus(path=metrics_path, labels={"job": "refresh"})
+
+    output = pipeline_run(data=data, meta=meta_new, timings=timings, qc=qc)
+
+    return output
+
+
+def backfill_pipeline(api_key, api_path, series, start, end, storage, meta_path, watermark_path=None, rows=5000,
+                      workers=4, client=None, cache=None, flush_rows=100000, save=True, run_log_path=None,
+                      qc_path=None, qc_options=None, rollup_path=None, checkpoint=None):
+    class pipeline_run:
+        def __init__(output, meta, gaps, failed, qc):
+            output.meta = meta
+            output.gaps = gaps
+            output.failed = failed
+            output.qc = qc
+
+    if api_path[-1] != "/":
+        api_path = api_path + "/"
+
+    keys = list(series[["parent_id", "subba_id"]].itertuples(index=False, name=None))
+    stats = eia_data.init_gaps(keys)
+    # The windows are checked one at a time as they arrive, so the workers option of qc_report is not used
+    thresholds, blocking, qc_workers = eia_qc.split_options(qc_options)
+    failed = []
+    reports = []
+    buffer = []
+    buffered = 0
+    flushed = 0
+    # The daily rows of the windows, folded into the rollups so the history is never read back
+    daily = []
+
+    # Write the buffered windows in one append, the first append initializes the storage. A restarted backfill
+    # with a checkpoint folder rebuilds the storage from the checkpointed windows and only fetches the missing ones
+    def flush():
+        nonlocal buffer, buffered, flushed, daily
+        if buffer and save:
+            with eia_metrics.registry.timer("append"):
+                storage.append(pd.concat(buffer, ignore_index=True), init=flushed == 0)
+            flushed = flushed + 1
+            if rollup_path is not None:
+                with eia_metrics.registry.timer("rollup"):
+                    daily = [eia_data.fold_daily(pd.concat(daily + [eia_data.rollup_hourly(w) for w in buffer],
+                                                           ignore_index=True))]
+        buffer = []
+        buffered = 0
+
+    t_start = time.perf_counter()
+    for p, group in series.groupby("parent_id", sort=False):
+        subba = list(group["subba_id"])
+        parent_keys = [(p, s) for s in subba]
+        stream = eia_api.eia_stream(start=start,
+                                    end=end,
+                                    api_key=api_key,
+                                    api_path=api_path + "data",
+                                    facets={"parent": p, "subba": subba},
+                                    rows=rows,
+                                    workers=workers,
+                                    client=client,
+                                    cache=cache,
+                                    checkpoint=checkpoint)
+
+        # Place each window on the hourly grid as it arrives and buffer it for the storage
+        for window_start, window_end, chunk in stream:
+            if chunk is None:
+                failed.append((p, window_start, window_end))
+            else:
+                # QC the raw rows of the window, before the grid drops the duplicates and sorts them
+                with eia_metrics.registry.timer("qc"):
+                    reports.append(eia_qc.qc_checks(chunk, **thresholds))
+            with eia_metrics.registry.timer("validate"):
+                grid = eia_data.reindex_hourly(data=chunk, start=window_start, end=window_end, keys=parent_keys)
+                eia_data.update_gaps(stats, grid.data, parent_keys)
+            window = grid.data.reindex(columns=eia_data.data_columns +
+                                       [c for c in grid.data.columns if c not in eia_data.data_columns])
+            buffer.append(window)
+            buffered = buffered + len(window)
+            if buffered >= flush_rows:
+                flush()
+    flush()
+
+    # Log each series from its running gap statistics, the grid spans the full start-end range
+    gaps = eia_data.summarize_gaps(stats)
+    qc = eia_qc.combine_reports(reports, blocking=blocking).set_index(["parent", "subba"])
+    meta = []
+    for p, s in keys:
+        edges = pd.DataFrame({"parent": [p, p], "subba": [s, s], "period": [start, end]})
+        qc_temp = qc.loc[(str(p), str(s))] if (str(p), str(s)) in qc.index else None
+        meta_temp = eia_data.create_metadata(data=edges, start=start, end=end, type="backfill", gaps=gaps.loc[(p, s)],
+                                             qc=qc_temp)
+        n_failed = len([f for f in failed if f[0] == p])
+        if n_failed > 0:
+            # Keep the watermark before the first failed window, so the refresh fetches its hours again
+            first_failed = min(f[1] for f in failed if f[0] == p)
+            meta_temp["end_act"] = first_failed - datetime.timedelta(hours=1)
+            meta_temp["comments"] = meta_temp["comments"] + str(n_failed) + \
+                                    " windows could not be fetched, their hours are stored as missing values " + \
+                                    "and the watermark is kept at " + str(meta_temp["end_act"]) + "; "
+        if n_failed > 0 or (qc_temp is not None and not qc_temp["passed"]):
+            logger.warning("The backfill of %s/%s has issues: %s", p, s, meta_temp["comments"])
+        # The blocking QC checks and the failed windows fail the series. Its history is stored anyway, so the
+        # entry is logged as an update and its watermark moves to the end of the backfill or the first failed window
+        meta_temp["success"] = n_failed == 0 and (qc_temp is None or bool(qc_temp["passed"]))
+        meta_temp["update"] = save
+        meta.append(meta_temp)
+    meta = pd.DataFrame(meta)
+    meta["index"] = 1
+
+    if save:
+        meta = eia_data.append_metadata(meta_path=meta_path,
+                                        meta=meta,
+                                        save=True,
+                                        init=True,
+                                        watermark_path=watermark_path)
+
+    # Write the rollups folded from the windows
+    if save and rollup_path is not None and daily:
+        with eia_metrics.registry.timer("rollup"):
+            eia_data.write_rollups(path=rollup_path, daily=daily[0])
+
+    logger.info("Backfill completed in %.2f seconds", time.perf_counter() - t_start)
+    eia_metrics.log_summary()
+    if save and run_log_path is not None:
+        eia_data.append_run_log(path=run_log_path, index=1, type="backfill", init=True)
+    qc = qc.reset_index()
+    if save and qc_path is not None:
+        eia_qc.append_report(path=qc_path, report=qc, index=1, type="backfill", init=True)
+
+    output = pipeline_run(meta=meta, gaps=gaps, failed=failed, qc=qc)
+
+    return output
@@ -0,0 +1,169 @@
+import os
+import time
+import logging
+import functools
+import threading
+import contextlib
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# The counters and timers recorded by the pipeline, in the column order of the run log
+counter_names = ["http_requests", "http_retries", "http_bytes", "cache_hits", "cache_misses",
+                 "rows_parsed", "rows_written", "bytes_written"]
+timer_names = ["http_request", "json_decode", "parse", "gap_fill", "merge", "csv_write",
+               "fetch", "qc", "validate", "append", "rollup", "render"]
+
+
+class metrics_registry:
+    """
+    A thread-safe registry of the counters and timers of a pipeline run.
+    Counters add up values (requests, bytes, rows), timers keep every observed duration in seconds,
+    so the run can report their count, total and percentiles.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+
+    def inc(self, name, value=1):
+        """
+        Adds a value to a counter.
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        """
+        Records a duration in seconds on a timer.
+        """
+        with self.lock:
+            self.timers.setdefault(name, []).append(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """
+        Times the enclosed block on a timer.
+        """
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t)
+
+    def reset(self):
+        """
+        Clears all the counters and timers, e.g. at the start of a run.
+        """
+        with self.lock:
+            self.counters = {}
+            self.timers = {}
+
+    def snapshot(self):
+        """
+        Returns the current values as a flat dictionary, with the count, total and p50/p99 of each timer.
+        The known counters and timers are always included, in the column order of the run log.
+
+        Returns:
+        dict: The metric values by column name.
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            timers = {k: list(v) for k, v in self.timers.items()}
+
+        values = {}
+        for name in counter_names + sorted(k for k in counters if k not in counter_names):
+            values[name] = counters.get(name, 0)
+        for name in timer_names + sorted(k for k in timers if k not in timer_names):
+            observed = np.array(timers.get(name, []))
+            values[name + "_count"] = len(observed)
+            values[name + "_seconds"] = round(float(observed.sum()), 6)
+            values[name + "_p50"] = round(float(np.percentile(observed, 50)), 6) if len(observed) > 0 else None
+            values[name + "_p99"] = round(float(np.percentile(observed, 99)), 6) if len(observed) > 0 else None
+
+        return values
+
+    def to_prometheus(self, path=None, labels=None):
+        """
+        Renders the metrics in the Prometheus text exposition format, e.g. for the node_exporter textfile collector.
+
+        Parameters:
+        path (str, optional): The file to write the metrics to, replaced atomically. Defaults to None.
+        labels (dict, optional): The labels added to every sample (e.g. {"job": "refresh"}). Defaults to None.
+
+        Returns:
+        str: The metrics text.
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            timers = {k: list(v) for k, v in self.timers.items()}
+
+        def label(extra=None):
+            items = dict(labels or {})
+            if extra is not None:
+                items.update(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(k + "=\"" + str(v) + "\"" for k, v in items.items()) + "}"
+
+        lines = []
+        for name in sorted(counters):
+            metric = "eia_" + name + "_total"
+            lines.append("# TYPE " + metric + " counter")
+            lines.append(metric + label() + " " + str(counters[name]))
+        for name in sorted(timers):
+            metric = "eia_" + name + "_seconds"
+            observed = np.array(timers[name])
+            lines.append("# TYPE " + metric + " summary")
+            for q in [0.5, 0.9, 0.99]:
+                lines.append(metric + label({"quantile": str(q)}) + " " + repr(float(np.quantile(observed, q))))
+            lines.append(metric + "_sum" + label() + " " + repr(float(observed.sum())))
+            lines.append(metric + "_count" + label() + " " + str(len(observed)))
+        text = "\n".join(lines) + "\n"
+
+        if path is not None:
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                f.write(text)
+            os.replace(tmp, path)
+
+        return text
+
+
+# The registry shared by the pipeline functions
+registry = metrics_registry()
+
+
+def timed(name):
+    """
+    Decorates a function so that each call is timed on the shared registry.
+
+    Parameters:
+    name (str): The timer name.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with registry.timer(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def log_summary():
+    """
+    Logs the totals of the shared registry, e.g. at the end of a run.
+    """
+    values = registry.snapshot()
+    logger.info("Requests: %d (%d retries), %.1f MB received, cache hits: %d, misses: %d",
+                values["http_requests"], values["http_retries"], values["http_bytes"] / 1024 ** 2,
+                values["cache_hits"], values["cache_misses"])
+    logger.info("Rows parsed: %d, rows written: %d", values["rows_parsed"], values["rows_written"])
+    for name in timer_names:
+        if values[name + "_count"] > 0:
+            logger.info("%s: %d calls, %.3f seconds (p50 %.3f, p99 %.3f)", name, values[name + "_count"],
+                        values[name + "_seconds"], values[name + "_p50"], values[name + "_p99"])
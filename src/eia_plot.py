@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import logging
+import datetime
+import concurrent.futures
+import numpy as np
+import pandas as pd
+import src.eia_data as eia_data
+import src.eia_metrics as eia_metrics
+# The figures are drawn on an Agg canvas directly, without pyplot, so rendering never needs a display
+# and does not touch the backend selected by the caller
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+logger = logging.getLogger(__name__)
+
+
+def lttb(x, y, points):
+    """
+    Downsamples a series with the Largest-Triangle-Three-Buckets algorithm, which keeps the points
+    shaping the line (peaks, troughs) rather than averaging them away.
+
+    Parameters:
+    x (array): The x values, sorted (datetime64 values are supported).
+    y (array): The y values, without missing values.
+    points (int): The number of points to keep.
+
+    Returns:
+    tuple: The downsampled x and y arrays.
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return x, y
+
+    xf = np.asarray(x).astype("int64").astype("float64") if np.issubdtype(np.asarray(x).dtype, np.datetime64) \
+        else np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+
+    # The first and last points are kept, the others are split into points - 2 buckets
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    keep = np.empty(points, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = xf[hi:next_hi].mean()
+        avg_y = y[hi:next_hi].mean()
+        # Keep the point of the bucket making the largest triangle with the last kept point and the next bucket mean
+        area = np.abs((xf[a] - avg_x) * (y[lo:hi] - y[a]) - (xf[a] - xf[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+
+    return np.asarray(x)[keep], y[keep]
+
+
+def minmax(x, y, points):
+    """
+    Downsamples a series to the minimum and maximum of each bucket, i.e. one bucket per pixel column
+    when points is twice the width of the chart in pixels.
+
+    Parameters:
+    x (array): The x values, sorted.
+    y (array): The y values, without missing values.
+    points (int): The maximum number of points to keep.
+
+    Returns:
+    tuple: The downsampled x and y arrays.
+    """
+    n = len(x)
+    if points >= n or points < 2:
+        return x, y
+
+    bucket = (np.arange(n) * (points // 2)) // n
+    values = pd.Series(np.asarray(y, dtype="float64"))
+    grouped = values.groupby(bucket)
+    keep = np.unique(np.concatenate([grouped.idxmin().to_numpy(), grouped.idxmax().to_numpy()]))
+
+    return np.asarray(x)[keep], values.to_numpy()[keep]
+
+
+def signature(rows):
+    # A hash of the rollup rows of a chart, changing whenever a value of the underlying series changes
+    if rows is None or len(rows) == 0:
+        return None
+
+    return str(int(pd.util.hash_pandas_object(rows.reset_index(drop=True), index=False).sum() % 2 ** 63))
+
+
+def render_chart(path, x, y, title, ylabel="Value", formats=("png",), width=12, height=4, dpi=100):
+    # Draw a line chart and write it in each format, replacing the previous files atomically
+    fig = Figure(figsize=(width, height), dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(x, y, linewidth=0.6)
+    ax.set_title(title)
+    ax.set_xlabel("Period")
+    ax.set_ylabel(ylabel)
+    ax.grid(alpha=0.3)
+    fig.autofmt_xdate()
+    fig.tight_layout()
+
+    files = []
+    for f in formats:
+        file = path + "." + f
+        tmp = path + ".tmp." + f
+        fig.savefig(tmp, format=f)
+        os.replace(tmp, file)
+        files.append(file)
+
+    return files
+
+
+def load_manifest(path):
+    manifest_path = os.path.join(path, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    manifest_path = os.path.join(path, "manifest.json")
+    tmp = manifest_path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp, manifest_path)
+
+
+@eia_metrics.timed("render")
+def render_report(storage, rollup_path, path, formats=("png",), method="lttb", width=12, height=4, dpi=100,
+                  force=False):
+    """
+    Renders one chart per subba from its hourly series downsampled to the chart width, and one chart per
+    parent from its daily totals. A chart is skipped when the daily rollup rows it is drawn from did not change
+    since the last render, as recorded in <path>/manifest.json.
+
+    Parameters:
+    storage (object): The storage backend of the hourly series.
+    rollup_path (str): The folder of the rollup tables.
+    path (str): The folder the charts are written to.
+    formats (list): The image formats (e.g., ["png", "svg"]). Defaults to ("png",).
+    method (str): The downsampling method, "lttb" or "minmax". Defaults to "lttb".
+    width (float): The chart width in inches. Defaults to 12.
+    height (float): The chart height in inches. Defaults to 4.
+    dpi (int): The resolution in dots per inch. Defaults to 100.
+    force (bool): Whether to render the unchanged charts too. Defaults to False.
+
+    Returns:
+    DataFrame: One row per chart, with whether it was rendered, the number of points drawn and the files.
+    """
+    os.makedirs(path, exist_ok=True)
+    manifest = load_manifest(path)
+    downsample = lttb if method == "lttb" else minmax
+    points = int(width * dpi) * (2 if method == "minmax" else 1)
+    daily = eia_data.read_rollup(rollup_path, "daily")
+    parent_daily = eia_data.read_rollup(rollup_path, "parent_daily")
+    charts = []
+
+    def up_to_date(key, sig):
+        entry = manifest.get(key)
+        return not force and entry is not None and entry["signature"] == sig and \
+            all(os.path.exists(f) for f in entry["files"]) and \
+            sorted(os.path.splitext(f)[1][1:] for f in entry["files"]) == sorted(formats)
+
+    # One chart per subba, from the hourly values read for that series only
+    for (p, s), rows in daily.groupby(["parent", "subba"], sort=True):
+        key = p + "/" + s
+        sig = signature(rows)
+        t = time.perf_counter()
+        if up_to_date(key, sig):
+            charts.append({"chart": key, "rendered": False, "points": manifest[key]["points"],
+                           "seconds": 0.0, "files": manifest[key]["files"]})
+            continue
+
+        hourly = storage.query(parent=p, subba=s, columns=["period", "value"])
+        hourly = hourly[hourly["value"].notna()].sort_values("period")
+        x, y = downsample(hourly["period"].to_numpy(), hourly["value"].to_numpy(), points)
+        files = render_chart(os.path.join(path, p + "_" + s), x, y, title=p + " - " + s + " hourly demand",
+                             formats=formats, width=width, height=height, dpi=dpi)
+        manifest[key] = {"signature": sig, "files": files, "points": len(x),
+                         "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")}
+        charts.append({"chart": key, "rendered": True, "points": len(x),
+                       "seconds": round(time.perf_counter() - t, 4), "files": files})
+
+    # One chart per parent, from the daily totals of its subbas
+    for p, rows in parent_daily.groupby("parent", sort=True):
+        key = p
+        sig = signature(rows)
+        t = time.perf_counter()
+        if up_to_date(key, sig):
+            charts.append({"chart": key, "rendered": False, "points": manifest[key]["points"],
+                           "seconds": 0.0, "files": manifest[key]["files"]})
+            continue
+
+        rows = rows.sort_values("period")
+        files = render_chart(os.path.join(path, p), rows["period"].to_numpy(), rows["value"].to_numpy(),
+                             title=p + " daily total demand", formats=formats, width=width, height=height, dpi=dpi)
+        manifest[key] = {"signature": sig, "files": files, "points": len(rows),
+                         "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")}
+        charts.append({"chart": key, "rendered": True, "points": len(rows),
+                       "seconds": round(time.perf_counter() - t, 4), "files": files})
+
+    save_manifest(path, manifest)
+    charts = pd.DataFrame(charts, columns=["chart", "rendered", "points", "seconds", "files"])
+    logger.info("%d charts rendered, %d unchanged", charts["rendered"].sum(), (~charts["rendered"]).sum())
+
+    return charts
+
+
+def start_report(**kwargs):
+    """
+    Starts render_report in a background thread, so the run carries on while the charts are drawn.
+
+    Parameters:
+    **kwargs: The arguments of render_report.
+
+    Returns:
+    Future: The pending report, .result() waits for the charts and returns the render_report output.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="eia_plot")
+    future = executor.submit(render_report, **kwargs)
+    executor.shutdown(wait=False)
+
+    return future
@@ -0,0 +1,259 @@
+import datetime
+import functools
+import concurrent.futures
+import numpy as np
+import pandas as pd
+import src.eia_data as eia_data
+
+# Columns of the per-series QC report
+report_columns = ["parent", "subba", "n_obs", "duplicates", "missing_hours", "na", "negative", "out_of_range",
+                  "flatlines", "longest_flatline", "spikes", "unit_changes"]
+
+# The checks failing a series, the other ones are reported as warnings
+blocking_checks = ["duplicates", "negative", "out_of_range", "unit_changes"]
+
+# Labels of the checks in the issues summary
+check_labels = {
+    "duplicates": "duplicate periods",
+    "missing_hours": "missing hours",
+    "na": "missing values",
+    "negative": "negative values",
+    "out_of_range": "out of range values",
+    "flatlines": "flatlines",
+    "spikes": "spikes",
+    "unit_changes": "unit changes"
+}
+
+
+def split_options(options=None):
+    """
+    Splits the QC options of a pipeline, the keyword arguments of qc_report, into the thresholds of
+    qc_checks and the options of the report, so that the same dictionary configures both pipelines.
+
+    Parameters:
+    options (dict, optional): The thresholds of qc_checks, plus the blocking checks and the number of
+    processes of qc_report. Defaults to None.
+
+    Returns:
+    tuple: The (thresholds, blocking, workers) of the options.
+    """
+    thresholds = dict(options or {})
+    blocking = thresholds.pop("blocking", None)
+    workers = thresholds.pop("workers", None)
+
+    return thresholds, blocking, workers
+
+
+def qc_checks(data, start=None, end=None, min_value=None, max_value=None, flatline_hours=24, z_window=168,
+              z_threshold=6.0, counted=None):
+    """
+    Runs the data quality checks on all the series of a frame at once, with vectorized operations
+    over the rows instead of a loop over the series.
+
+    Parameters:
+    data (DataFrame): The hourly rows in the API layout.
+    start (datetime, optional): The expected first hour, earlier hours count as missing. Defaults to None.
+    end (datetime, optional): The expected last hour, later hours count as missing. Defaults to None.
+    min_value (float, optional): The lowest valid value. Defaults to None.
+    max_value (float, optional): The highest valid value. Defaults to None.
+    flatline_hours (int): The number of identical consecutive values reported as a flatline. Defaults to 24.
+    z_window (int): The number of preceding hours of the rolling z-score. Defaults to 168.
+    z_threshold (float): The absolute rolling z-score reported as a spike. Defaults to 6.
+    counted (str, optional): A boolean column of data flagging the rows counted in the report, the other rows
+    only give the rolling checks their history (e.g. the lookback rows of a refresh). Defaults to None (all rows).
+
+    Returns:
+    DataFrame: The number of issues found by each check, one row per series.
+    """
+    if data is None or len(data) == 0 or "subba" not in data.columns:
+        return pd.DataFrame(columns=report_columns)
+
+    df = pd.DataFrame({"parent": data["parent"].astype(str).to_numpy(),
+                       "subba": data["subba"].astype(str).to_numpy(),
+                       "period": pd.to_datetime(data["period"]).to_numpy(),
+                       "value": pd.to_numeric(data["value"], errors="coerce").astype("float64").to_numpy()})
+    if "value-units" in data.columns:
+        df["units"] = data["value-units"].astype(object).to_numpy()
+    else:
+        df["units"] = None
+    if counted is not None:
+        df["counted"] = data[counted].astype(bool).to_numpy()
+    else:
+        df["counted"] = True
+    df["series"] = df.groupby(["parent", "subba"], sort=False).ngroup()
+
+    # Duplicate periods, before they are dropped
+    flags = pd.DataFrame({"series": df["series"]})
+    flags["n_obs"] = df["counted"].astype(int)
+    flags["duplicates"] = (df.duplicated(["series", "period"]) & df["counted"]).astype(int)
+    counts = flags.groupby("series").sum()
+
+    # The other checks run on the series sorted by period, without the duplicates
+    df = df.drop_duplicates(["series", "period"], keep="last").sort_values(["series", "period"], kind="stable")
+    series = df["series"].to_numpy()
+    period = df["period"].to_numpy()
+    value = df["value"].to_numpy()
+    keep = df["counted"].to_numpy()
+    same = np.concatenate([[False], series[1:] == series[:-1]])
+    step = np.concatenate([[0.0], np.diff(period).astype("timedelta64[s]").astype("float64") / 3600])
+    step = np.where(same, step, 0.0)
+
+    # Missing hours inside the series, and before the start or after the end when they are given
+    sorted_flags = pd.DataFrame({"series": series})
+    sorted_flags["missing_hours"] = np.clip(step - 1, 0, None)
+    sorted_flags["na"] = np.isnan(value).astype(int)
+    sorted_flags["negative"] = (value < 0).astype(int)
+    out_of_range = np.zeros(len(value), dtype=bool)
+    if min_value is not None:
+        out_of_range = out_of_range | (value < min_value)
+    if max_value is not None:
+        out_of_range = out_of_range | (value > max_value)
+    sorted_flags["out_of_range"] = out_of_range.astype(int)
+
+    # Flatlines: runs of identical values over consecutive hours
+    previous = np.concatenate([[np.nan], value[:-1]])
+    new_run = ~same | (step != 1) | (value != previous) | np.isnan(value)
+    run_id = np.cumsum(new_run)
+    run_length = np.bincount(run_id)[run_id]
+    flat_start = new_run & (run_length >= flatline_hours) & ~np.isnan(value)
+    sorted_flags["flatlines"] = flat_start.astype(int)
+    sorted_flags["longest_flatline"] = np.where(flat_start, run_length, 0)
+
+    # Spikes: values far from the mean of the preceding hours, in standard deviations
+    shifted = df.groupby("series", sort=False)["value"].shift()
+    rolling = shifted.groupby(df["series"], sort=False).rolling(z_window, min_periods=max(2, z_window // 4))
+    mean = rolling.mean().reset_index(level=0, drop=True).reindex(df.index).to_numpy()
+    std = rolling.std().reset_index(level=0, drop=True).reindex(df.index).to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.abs(value - mean) / std
+    sorted_flags["spikes"] = ((std > 0) & (z > z_threshold)).astype(int)
+
+    # Unit changes between consecutive rows of a series
+    units = df["units"].to_numpy()
+    previous_units = np.concatenate([[None], units[:-1]])
+    known = pd.notna(units) & pd.notna(previous_units)
+    sorted_flags["unit_changes"] = (same & known & (units != previous_units)).astype(int)
+
+    # Only the counted rows are reported
+    sorted_flags.loc[~keep, sorted_flags.columns[1:]] = 0
+    sums = sorted_flags.drop(columns=["longest_flatline"]).groupby("series").sum()
+    counts = counts.join(sums)
+    counts["longest_flatline"] = sorted_flags.groupby("series")["longest_flatline"].max()
+
+    # The hours expected before the first and after the last observation
+    if start is not None or end is not None:
+        bounds = df[keep].groupby("series")["period"].agg(["min", "max"])
+        if start is not None:
+            lead = (bounds["min"] - pd.Timestamp(start)).dt.total_seconds() / 3600
+            counts["missing_hours"] = counts["missing_hours"] + lead.clip(lower=0)
+        if end is not None:
+            trail = (pd.Timestamp(end) - bounds["max"]).dt.total_seconds() / 3600
+            counts["missing_hours"] = counts["missing_hours"] + trail.clip(lower=0)
+
+    keys = df.drop_duplicates("series").set_index("series")[["parent", "subba"]]
+    report = keys.join(counts).reset_index(drop=True)
+    report[report_columns[2:]] = report[report_columns[2:]].fillna(0).astype(int)
+
+    return report[report_columns]
+
+
+def qc_summary(report, blocking=None):
+    """
+    Adds the issues summary and the passed flag to a QC report.
+
+    Parameters:
+    report (DataFrame): The output of qc_checks.
+    blocking (list, optional): The checks failing a series. Defaults to blocking_checks.
+
+    Returns:
+    DataFrame: The report with the issues and passed columns.
+    """
+    if blocking is None:
+        blocking = blocking_checks
+
+    report = report.copy()
+    issues = []
+    for row in report.itertuples(index=False):
+        found = [str(getattr(row, c)) + " " + check_labels[c] for c in check_labels if getattr(row, c) > 0]
+        if row.flatlines > 0:
+            found.append("longest flatline " + str(row.longest_flatline) + " hours")
+        issues.append(", ".join(found))
+    report["issues"] = issues
+    report["passed"] = (report[blocking] == 0).all(axis=1) if len(report) > 0 else pd.Series(dtype=bool)
+
+    return report
+
+
+def combine_reports(reports, blocking=None):
+    """
+    Combines the QC reports of consecutive chunks of the same series (e.g. the windows of a streamed backfill).
+    Runs crossing a chunk boundary are counted in each chunk.
+
+    Parameters:
+    reports (list): The outputs of qc_checks.
+    blocking (list, optional): The checks failing a series. Defaults to blocking_checks.
+
+    Returns:
+    DataFrame: The combined report with the issues and passed columns.
+    """
+    reports = [r for r in reports if r is not None and len(r) > 0]
+    if not reports:
+        return qc_summary(pd.DataFrame(columns=report_columns), blocking=blocking)
+
+    report = pd.concat(reports, ignore_index=True)
+    aggregations = {c: "sum" for c in report_columns[2:]}
+    aggregations["longest_flatline"] = "max"
+    report = report.groupby(["parent", "subba"], sort=False).agg(aggregations).reset_index()
+
+    return qc_summary(report[report_columns], blocking=blocking)
+
+
+def qc_report(data, workers=None, blocking=None, **kwargs):
+    """
+    Runs the data quality checks of all the series and summarizes them, optionally splitting the series
+    across a process pool for large histories.
+
+    Parameters:
+    data (DataFrame): The hourly rows in the API layout.
+    workers (int, optional): The number of processes. Defaults to None (in-process).
+    blocking (list, optional): The checks failing a series. Defaults to blocking_checks.
+    **kwargs: The thresholds passed to qc_checks.
+
+    Returns:
+    DataFrame: The per-series report with the issues and passed columns.
+    """
+    if workers is None or workers < 2 or data is None or len(data) == 0:
+        return qc_summary(qc_checks(data, **kwargs), blocking=blocking)
+
+    # Split the series into one part per process, each series stays in a single part
+    part = data.groupby([data["parent"].astype(str), data["subba"].astype(str)], sort=False).ngroup() % workers
+    parts = [data[(part == n).to_numpy()] for n in range(workers)]
+    parts = [p for p in parts if len(p) > 0]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(parts)) as pool:
+        reports = list(pool.map(functools.partial(qc_checks, **kwargs), parts))
+
+    report = pd.concat(reports, ignore_index=True).sort_values(["parent", "subba"], ignore_index=True)
+
+    return qc_summary(report, blocking=blocking)
+
+
+def append_report(path, report, index, type, init=False):
+    """
+    Appends a QC report to the report file, one row per series and run.
+
+    Parameters:
+    path (str): The CSV file of the QC reports.
+    report (DataFrame): The output of qc_report or combine_reports.
+    index (int): The index of the run in the series log.
+    type (str): The run type (e.g., refresh).
+    init (bool): Whether to replace an existing file. Defaults to False.
+
+    Returns:
+    DataFrame: The rows appended.
+    """
+    rows = report.copy()
+    rows.insert(0, "time", datetime.datetime.now(datetime.timezone.utc))
+    rows.insert(0, "type", type)
+    rows.insert(0, "index", index)
+
+    return eia_data.append_csv(path=path, data=rows, init=init)
@@ -0,0 +1,42 @@
+import os
+import sys
+import datetime
+import pytest
+
+# The modules are imported as src.<module> from the repository root, the fake API from the benchmarks
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, "03_BENCHMARKS"))
+
+import fake_eia_server  # noqa: E402
+import src.eia_api as eia_api  # noqa: E402
+
+api_key = "k" * 40
+api_path = "electricity/rto/region-sub-ba-data/"
+
+
+class failing_eia(fake_eia_server.fake_eia):
+    """
+    A fake EIA API whose data requests fail after the first `limit` ones, to interrupt a pull.
+    """
+
+    limit = None
+
+    def data(self, query):
+        if self.limit is not None and self.requests > self.limit:
+            raise RuntimeError("The fake API is down")
+        return super().data(query)
+
+
+@pytest.fixture
+def fake_api():
+    with failing_eia(universe=fake_eia_server.make_universe(1, 3),
+                     start=datetime.datetime(2020, 1, 1),
+                     end=datetime.datetime(2020, 3, 1),
+                     missing=0) as server:
+        yield server
+
+
+@pytest.fixture
+def client(fake_api):
+    return eia_api.eia_client(base_url=fake_api.base_url, retries=0)
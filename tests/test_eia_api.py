@@ -0,0 +1,358 @@
+import json
+import datetime
+import threading
+import http.server
+import pytest
+import pandas as pd
+import src.eia_api as eia_api
+import src.eia_metrics as eia_metrics
+from conftest import api_key, api_path
+
+
+class truncating_server:
+    """
+    A server whose first `broken` responses announce a longer body than they send, a gzip body that is not gzip,
+    or a 429 status asking to retry right away. It counts the requests and the connections opened.
+    """
+
+    def __init__(self, broken, mode="short"):
+        self.calls = 0
+        self.connections = 0
+        server = self
+
+        class handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                server.connections += 1
+                super().setup()
+
+            def do_GET(self):
+                server.calls += 1
+                body = json.dumps({"response": {"total": "0", "data": []}}).encode("utf-8")
+                if server.calls <= broken and mode == "throttled":
+                    self.send_response(429)
+                    self.send_header("Retry-After", "0")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                if server.calls <= broken and mode == "short":
+                    self.send_header("Content-Length", str(len(body) + 100))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    self.close_connection = True
+                    return
+                if server.calls <= broken and mode == "gzip":
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:" + str(self.httpd.server_address[1]) + "/v2/data/?api_key=" + "k" * 40
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.mark.parametrize("mode", ["short", "gzip", "throttled"])
+def test_client_retries_truncated_undecodable_and_throttled_responses(mode):
+    server = truncating_server(broken=2, mode=mode)
+    client = eia_api.eia_client(base_url=server.url, retries=3, backoff=0.01)
+    retries = eia_metrics.registry.snapshot()["http_retries"]
+    try:
+        data = client.get_json(server.url)
+    finally:
+        server.close()
+
+    assert data["response"]["total"] == "0"
+    assert server.calls == 3
+    assert client.retried == 2
+    assert eia_metrics.registry.snapshot()["http_retries"] == retries + 2
+
+
+def test_default_client_is_shared_by_concurrent_callers(monkeypatch):
+    monkeypatch.setattr(eia_api, "_default_client", None)
+    created = []
+    init = eia_api.eia_client.__init__
+
+    # Slow down the creation so concurrent first callers overlap
+    def slow_init(self, *args, **kwargs):
+        created.append(self)
+        threading.Event().wait(0.05)
+        init(self, *args, **kwargs)
+
+    monkeypatch.setattr(eia_api.eia_client, "__init__", slow_init)
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(eia_api.get_default_client())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(created) == 1
+    assert all(c is clients[0] for c in clients)
+
+
+def loop_offset(start, end, step):
+    # The loop of the original day_offset and hour_offset, the reference of the vectorized versions
+    current = [start]
+    while max(current) < end:
+        if max(current) + step < end:
+            current.append(max(current) + step)
+        else:
+            current.append(end)
+    return current
+
+
+@pytest.mark.parametrize("start, end", [
+    (datetime.date(2020, 1, 1), datetime.date(2020, 3, 5)),
+    (datetime.date(2020, 1, 1), datetime.date(2020, 1, 31)),
+    (datetime.datetime(2020, 1, 1, 7), datetime.datetime(2020, 3, 5, 2)),
+    (datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 31)),
+    (datetime.datetime(2020, 1, 2), datetime.datetime(2020, 1, 1))
+])
+@pytest.mark.parametrize("offset", [1, 7, 30, 100])
+def test_day_offset_matches_the_loop(start, end, offset):
+    result = eia_api.day_offset(start, end, offset)
+    expected = loop_offset(start, end, datetime.timedelta(days=offset))
+    assert result == expected
+    assert [type(t) for t in result] == [type(t) for t in expected]
+
+
+@pytest.mark.parametrize("end", [datetime.datetime(2020, 1, 1, 23), datetime.datetime(2020, 2, 3, 5)])
+@pytest.mark.parametrize("offset", [1, 5, 24, 2250])
+def test_hour_offset_matches_the_loop(end, offset):
+    start = datetime.datetime(2020, 1, 1, 3)
+    result = eia_api.hour_offset(start, end, offset)
+    expected = loop_offset(start, end, datetime.timedelta(hours=offset))
+    assert result == expected
+    assert all(type(t) is datetime.datetime for t in result)
+
+
+def test_chunk_planner_sizes_windows_from_the_row_counts():
+    planner = eia_api.chunk_planner(n_series=4, rows=5000)
+    assert planner.hours() == 1250
+    start = datetime.datetime(2020, 1, 1)
+    window = planner.next_window(start, datetime.datetime(2030, 1, 1))
+    assert window == (start, start + datetime.timedelta(hours=1249))
+
+    # Sparse windows give larger ones, empty windows double the size, and the last window ends at the end
+    planner.update(window, 2500)
+    assert planner.hours() == 2500
+    planner.update(window, 0)
+    assert planner.hours() == 5000
+    assert planner.next_window(start, start + datetime.timedelta(hours=10))[1] == start + datetime.timedelta(hours=10)
+    assert planner.next_window(start + datetime.timedelta(hours=1), start) is None
+    assert eia_api.chunk_planner(n_series=1, rows=20000).hours() == 5000
+
+
+def test_stream_windows_do_not_depend_on_the_fetch_timing(fake_api, client):
+    # A latency per request and series starting late, so the row counts vary from window to window
+    fake_api.latency = 0.01
+    fake_api.start = datetime.datetime(2020, 1, 20)
+    facets = {"parent": "P01", "subba": ["P01S1", "P01S2", "P01S3"]}
+    runs = []
+    for workers in [1, 4, 4]:
+        stream = eia_api.eia_stream(start=datetime.datetime(2020, 1, 1), end=datetime.datetime(2020, 3, 1),
+                                    api_key=api_key, api_path=api_path + "data", facets=facets, rows=300,
+                                    workers=workers, client=client)
+        runs.append([(w[0], w[1], len(w[2])) for w in stream])
+
+    assert runs[1] == runs[2]
+    for run in runs:
+        # The windows follow each other and cover the query, the empty ones before the series start grow
+        assert run[0][0] == datetime.datetime(2020, 1, 1) and run[-1][1] == datetime.datetime(2020, 3, 1)
+        assert all(b[0] - a[1] == datetime.timedelta(hours=1) for a, b in zip(run[:-1], run[1:]))
+        assert max(w[1] - w[0] for w in run) > run[0][1] - run[0][0]
+        assert sum(w[2] for w in run) == 3 * (41 * 24 + 1)
+
+
+class clock:
+    """
+    A settable time.time for the cache expiration and recency tests.
+    """
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_keys_ignore_the_api_key_and_the_parameter_order():
+    a = eia_api.eia_cache.key("https://api.eia.gov/v2/x/data/?api_key=A&start=1&end=2")
+    b = eia_api.eia_cache.key("https://api.eia.gov/v2/x/data?end=2&start=1&api_key=B")
+    assert a == b and "api_key" not in a
+
+
+def test_cache_expires_recent_windows_and_keeps_old_ones(tmp_path, monkeypatch):
+    now = clock()
+    monkeypatch.setattr(eia_api.time, "time", now)
+    cache = eia_api.eia_cache(path=str(tmp_path / "cache.sqlite"), ttl=60, immutable_days=30)
+    recent = datetime.datetime.now()
+    old = recent - datetime.timedelta(days=31)
+    cache.put("https://h/v2/data/?end=recent", {"n": 1}, end=recent)
+    cache.put("https://h/v2/data/?end=old", {"n": 2}, end=old)
+    cache.put("https://h/v2/data/?end=day", {"n": 3}, end=old.date())
+
+    assert cache.get("https://h/v2/data/?end=recent") == {"n": 1}
+    now.now = now.now + 61
+    assert cache.get("https://h/v2/data/?end=recent") is None
+    assert cache.get("https://h/v2/data/?end=old") == {"n": 2}
+    assert cache.get("https://h/v2/data/?end=day") == {"n": 3}
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 1
+    cache.close()
+
+
+def test_cache_evicts_the_least_recently_used_entries(tmp_path, monkeypatch):
+    now = clock()
+    monkeypatch.setattr(eia_api.time, "time", now)
+    body = {"data": list(range(200))}
+    cache = eia_api.eia_cache(path=str(tmp_path / "cache.sqlite"))
+    cache.put("https://h/v2/data/?n=0", body)
+    size = cache.stats()["size"]
+    cache.max_size = 3 * size
+
+    for n in [1, 2]:
+        now.now = now.now + 1
+        cache.put("https://h/v2/data/?n=" + str(n), body)
+    # Reading the first entry makes the second one the least recently used
+    now.now = now.now + 1
+    assert cache.get("https://h/v2/data/?n=0") is not None
+    now.now = now.now + 1
+    cache.put("https://h/v2/data/?n=3", body)
+
+    assert cache.stats()["entries"] == 3 and cache.stats()["size"] <= cache.max_size
+    assert cache.get("https://h/v2/data/?n=1") is None
+    assert all(cache.get("https://h/v2/data/?n=" + str(n)) is not None for n in [0, 2, 3])
+    cache.close()
+
+
+def test_eia_get_serves_repeated_requests_from_the_cache(tmp_path, fake_api, client):
+    cache = eia_api.eia_cache(path=str(tmp_path / "cache.sqlite"))
+    kwargs = {"api_key": api_key, "api_path": api_path + "data", "facets": {"parent": "P01", "subba": "P01S1"},
+              "start": datetime.datetime(2020, 1, 1), "end": datetime.datetime(2020, 1, 2), "client": client,
+              "cache": cache}
+    first = eia_api.eia_get(**kwargs)
+    requests = fake_api.requests
+    second = eia_api.eia_get(**kwargs)
+
+    assert fake_api.requests == requests
+    pd.testing.assert_frame_equal(first.data, second.data)
+    assert cache.stats()["hits"] == 1
+    cache.close()
+
+
+def test_client_stops_at_the_request_budget():
+    server = truncating_server(broken=0)
+    client = eia_api.eia_client(base_url=server.url, retries=0, budget=2)
+    try:
+        client.get_json(server.url)
+        client.get_json(server.url)
+        with pytest.raises(RuntimeError):
+            client.get_json(server.url)
+    finally:
+        server.close()
+
+    assert server.calls == 2
+
+
+def test_backfill_workers_return_the_serial_data_in_period_order(fake_api, client):
+    kwargs = {"start": datetime.datetime(2020, 1, 1), "end": datetime.datetime(2020, 1, 10), "offset": 24,
+              "api_key": api_key, "api_path": api_path + "data", "facets": {"parent": "P01", "subba": "P01S1"},
+              "client": client}
+    serial = eia_api.eia_backfill(**kwargs)
+    concurrent = eia_api.eia_backfill(workers=4, **kwargs)
+
+    assert serial.failed == [] and concurrent.failed == []
+    assert len(serial.data) == 9 * 24 + 1
+    assert serial.data["period"].is_monotonic_increasing
+    pd.testing.assert_frame_equal(serial.data, concurrent.data)
+
+
+def test_client_reuses_its_connection_across_requests():
+    server = truncating_server(broken=0)
+    try:
+        with eia_api.eia_client(base_url=server.url, retries=0) as client:
+            for n in range(5):
+                client.get_json(server.url)
+            assert client.session.headers["Accept-Encoding"] == "gzip, deflate"
+    finally:
+        server.close()
+
+    assert server.calls == 5
+    assert server.connections == 1
+
+
+@pytest.mark.parametrize("workers", [None, 3])
+def test_paginate_fetches_each_page_once(fake_api, client, workers):
+    temp = eia_api.eia_paginate(start=datetime.datetime(2020, 1, 1), end=datetime.datetime(2020, 1, 6),
+                                api_key=api_key, api_path=api_path + "data", facets={"parent": "P01"},
+                                length=100, workers=workers, client=client)
+
+    assert temp.total == 121 * 3 and temp.failed == []
+    assert fake_api.requests == 4
+    assert len(temp.data) == temp.total
+    assert not temp.data.duplicated(["period", "subba"]).any()
+    assert temp.data["period"].is_monotonic_increasing
+
+
+def test_get_series_splits_one_stream_by_subba(fake_api, client):
+    temp = eia_api.eia_get_series(start=datetime.datetime(2020, 1, 1), end=datetime.datetime(2020, 1, 6),
+                                  api_key=api_key, api_path=api_path + "data", parent="P01",
+                                  subba=["P01S1", "P01S3", "P01S9"], length=5000, client=client)
+
+    assert fake_api.requests == 1
+    assert temp.total == 121 * 2
+    assert sorted(temp.series) == ["P01S1", "P01S3", "P01S9"]
+    assert len(temp.series["P01S1"]) == len(temp.series["P01S3"]) == 121
+    assert (temp.series["P01S3"]["subba"] == "P01S3").all()
+    assert temp.series["P01S9"].empty
+
+
+def test_parse_data_types_the_columns():
+    records = [{"period": "2020-01-01T00", "subba": "P01S1", "parent": "P01", "value": "12"},
+               {"period": "2020-01-01T01", "subba": "P01S1", "parent": "P01", "value": None},
+               {"period": "2020-01-01T02", "subba": "P01S2", "parent": "P01", "value": "x"}]
+    data = eia_api.parse_data(records)
+
+    assert data["period"].dtype == "datetime64[ns]"
+    assert list(data["period"]) == list(pd.date_range("2020-01-01", periods=3, freq="h"))
+    assert data["value"].dtype == "float64"
+    assert data["value"].iloc[0] == 12.0 and data["value"].iloc[1:].isna().all()
+    assert isinstance(data["subba"].dtype, pd.CategoricalDtype)
+
+
+def test_parse_data_reads_daily_periods():
+    data = eia_api.parse_data([{"period": "2020-01-02", "value": 1}, {"period": "2020-01-03", "value": 2}])
+
+    assert list(data["period"]) == [pd.Timestamp("2020-01-02"), pd.Timestamp("2020-01-03")]
+
+
+def test_backfill_checkpoint_only_fetches_the_failed_windows(tmp_path, fake_api, client):
+    kwargs = {"start": datetime.datetime(2020, 1, 1), "end": datetime.datetime(2020, 1, 10), "offset": 24,
+              "api_key": api_key, "api_path": api_path + "data", "facets": {"parent": "P01"}, "client": client,
+              "checkpoint": str(tmp_path / "checkpoints")}
+    fake_api.limit = 3
+    first = eia_api.eia_backfill(**kwargs)
+    assert len(first.failed) == 6
+
+    fake_api.limit = None
+    fake_api.requests = 0
+    second = eia_api.eia_backfill(**kwargs)
+    assert second.failed == [] and fake_api.requests == 6
+    assert len(second.data) == 3 * (9 * 24 + 1)
+
+    fake_api.requests = 0
+    third = eia_api.eia_backfill(**kwargs)
+    assert fake_api.requests == 0
+    pd.testing.assert_frame_equal(second.data, third.data)
@@ -0,0 +1,245 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import fake_eia_server
+import src.eia_data as eia_data
+from conftest import api_key, api_path
+
+
+def test_build_catalog_pairs_the_subbas_without_a_facet_filter(fake_api, client):
+    urls = []
+    send = client.send
+
+    def record(url):
+        urls.append(url)
+        return send(url)
+
+    client.send = record
+    fake_api.universe = fake_eia_server.make_universe(3, 2)
+    catalog = eia_data.build_catalog(api_key=api_key, api_path=api_path, client=client, sample_hours=24)
+
+    assert list(catalog["parent_id"]) == ["P01", "P01", "P02", "P02", "P03", "P03"]
+    assert list(catalog["subba_id"]) == ["P01S1", "P01S2", "P02S1", "P02S2", "P03S1", "P03S2"]
+    data_urls = [u for u in urls if "/data/" in u]
+    assert data_urls and not any("facets" in u for u in data_urls)
+
+
+def hourly(subba, values, start="2020-01-01"):
+    return pd.DataFrame({"period": pd.date_range(start, periods=len(values), freq="h"),
+                         "subba": subba, "parent": subba[:3], "value": np.asarray(values, dtype="float64")})
+
+
+def test_merge_rows_overwrites_the_matching_keys_and_adds_the_new_ones():
+    current = pd.DataFrame({"k": [1, 2, 3], "value": [1.0, 2.0, 3.0]})
+    new = pd.DataFrame({"value": [20.0, 40.0], "k": [2, 4]})
+    merged = eia_data.merge_rows(current, new, ["k"])
+
+    assert list(merged.columns) == ["k", "value"]
+    assert merged.set_index("k")["value"].to_dict() == {1: 1.0, 2: 20.0, 3: 3.0, 4: 40.0}
+
+
+def test_get_revisions_reports_the_changed_values_and_the_filled_gaps():
+    stored = hourly("P01S1", [1.0, np.nan, 3.0, 4.0])
+    new = hourly("P01S1", [1.0, 2.0, 30.0, np.nan])
+    revisions = eia_data.get_revisions(stored, new)
+
+    assert list(revisions.columns) == ["time", "parent", "subba", "period", "old_value", "new_value"]
+    assert list(revisions["period"]) == list(new["period"][1:3])
+    assert revisions["old_value"].isna().tolist() == [True, False]
+    assert list(revisions["new_value"]) == [2.0, 30.0]
+
+
+@pytest.mark.parametrize("data_path", ["data.csv", "parquet", "data.db"])
+def test_revise_data_writes_and_logs_only_the_changed_rows(tmp_path, data_path):
+    storage = eia_data.get_storage(str(tmp_path / data_path))
+    storage.append(pd.concat([hourly("P01S1", [1.0, 2.0, 3.0]), hourly("P01S2", [5.0, 6.0, 7.0])]), init=True)
+    revision_path = str(tmp_path / "revisions.csv")
+
+    new = pd.concat([hourly("P01S1", [1.0, 2.5, 3.0]), hourly("P01S2", [5.0, 6.0, 7.0])], ignore_index=True)
+    revised = eia_data.revise_data(storage, new, revision_path=revision_path)
+    assert len(revised.data) == 1 and revised.data["value"].iloc[0] == 2.5
+    assert len(pd.read_csv(revision_path)) == 1
+
+    data = storage.read().sort_values(["subba", "period"])
+    assert len(data) == 6
+    assert list(data["value"]) == [1.0, 2.5, 3.0, 5.0, 6.0, 7.0]
+
+    # Fetching the same values again finds no revision
+    again = eia_data.revise_data(storage, new, revision_path=revision_path)
+    assert len(again.revisions) == 0 and len(again.data) == 0
+
+
+def log_entry(subba, end_act, success=True, update=True):
+    meta = eia_data.create_metadata(data=None, start=None, end=None, type="refresh")
+    meta.update({"parent": subba[:3], "subba": subba, "end_act": pd.Timestamp(end_act), "success": success,
+                 "update": update})
+    return meta
+
+
+def test_watermarks_advance_with_the_stored_log_entries(tmp_path):
+    meta_path = str(tmp_path / "log.csv")
+    watermark_path = str(tmp_path / "watermarks.json")
+    series = pd.DataFrame({"parent_id": ["P01", "P01"], "subba_id": ["P01S1", "P01S2"]})
+    eia_data.append_metadata(meta_path, pd.DataFrame([log_entry("P01S1", "2020-01-01 23:00"),
+                                                      log_entry("P01S2", "2020-01-01 23:00")]),
+                             save=True, init=True, watermark_path=watermark_path)
+
+    # A later stored entry moves the watermark, an entry that was not stored does not
+    eia_data.append_metadata(meta_path, log_entry("P01S1", "2020-01-02 23:00"), save=True,
+                             watermark_path=watermark_path)
+    eia_data.append_metadata(meta_path, log_entry("P01S2", "2020-01-05 23:00", success=False, update=False),
+                             save=True, watermark_path=watermark_path)
+    meta = eia_data.load_metadata(meta_path, series, watermark_path=watermark_path)
+    assert meta.last_index == 3
+    assert list(meta.request_meta["request_start"]) == [pd.Timestamp("2020-01-03"), pd.Timestamp("2020-01-02")]
+
+    # The store matches a full scan of the log, and is rebuilt when the log was written without it
+    assert meta.request_meta.equals(eia_data.load_metadata(meta_path, series).request_meta)
+    eia_data.append_metadata(meta_path, log_entry("P01S2", "2020-01-03 23:00"), save=True)
+    meta = eia_data.load_metadata(meta_path, series, watermark_path=watermark_path)
+    assert meta.last_index == 4
+    assert meta.request_meta["request_start"].iloc[1] == pd.Timestamp("2020-01-04")
+
+
+@pytest.mark.parametrize("data_path", ["data.csv", "parquet", "data.db"])
+def test_update_rollups_matches_a_rebuild(tmp_path, data_path):
+    storage = eia_data.get_storage(str(tmp_path / data_path))
+    first = pd.concat([hourly("P01S1", np.arange(24 * 40)), hourly("P01S2", np.arange(24 * 40))], ignore_index=True)
+    storage.append(first, init=True)
+    rollup_path = str(tmp_path / "rollups")
+    eia_data.build_rollups(rollup_path, storage, ["P01"])
+
+    # An append crossing a month end and a revision of an old day, with a missing value
+    new = hourly("P01S1", [1.0, np.nan, 3.0] * 24, start="2020-02-10")
+    storage.append(new)
+    revised = hourly("P01S2", [-5.0], start="2020-01-03 04:00")
+    storage.upsert(revised)
+    eia_data.update_rollups(rollup_path, pd.concat([new, revised], ignore_index=True), storage)
+    incremental = {level: eia_data.read_rollup(rollup_path, level) for level in eia_data.rollup_levels}
+
+    rebuilt = eia_data.build_rollups(str(tmp_path / "rebuilt"), storage, ["P01"])
+    for level, rows in rebuilt.items():
+        pd.testing.assert_frame_equal(incremental[level], rows, check_dtype=False)
+    assert incremental["daily"]["na"].sum() == 24
+
+
+def test_csv_dimension_keeps_the_series_attributes_once(tmp_path):
+    storage = eia_data.get_storage(str(tmp_path / "data.csv"), dimension_path=str(tmp_path / "dim.csv"))
+    data = pd.concat([hourly("P01S1", [1.0, 2.0]), hourly("P01S2", [3.0, 4.0])], ignore_index=True)
+    data["subba-name"] = data["subba"] + " name"
+    data["parent-name"] = "P01 name"
+    data["value-units"] = "megawatthours"
+    storage.append(data, init=True)
+
+    assert list(pd.read_csv(tmp_path / "data.csv").columns) == ["period", "series_id", "value"]
+    assert len(eia_data.read_dimension(str(tmp_path / "dim.csv"))) == 2
+
+    stored = storage.read()
+    assert isinstance(stored["subba"].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(stored[data.columns].astype(str), data.astype(str))
+
+
+def test_parquet_reads_prune_the_partitions(tmp_path):
+    storage = eia_data.get_storage(str(tmp_path / "parquet"))
+    data = pd.concat([hourly(s, np.arange(24 * 60), start="2020-01-15") for s in ["P01S1", "P01S2", "P02S1"]],
+                     ignore_index=True)
+    storage.append(data, init=True)
+    assert sorted(os.listdir(tmp_path / "parquet" / "parent=P01" / "subba=P01S2")) == \
+        ["month=2020-01", "month=2020-02", "month=2020-03"]
+
+    # The filtered reads match the full read filtered in memory
+    full = storage.read()
+    assert len(full) == len(data)
+    window = {"start": pd.Timestamp("2020-01-31 20:00"), "end": pd.Timestamp("2020-02-01 03:00")}
+    for filters in [{"parent": "P01"}, {"subba": ["P01S2", "P02S1"]}, window, {"subba": "P01S1", **window}]:
+        expected = eia_data.filter_data(full, **filters).reset_index(drop=True)
+        pd.testing.assert_frame_equal(storage.read(**filters), expected, check_categorical=False)
+    assert len(storage.read(subba="P01S1", columns=["period", "value"], **window)) == 8
+
+
+def test_sqlite_appends_upsert_the_stored_hours(tmp_path):
+    storage = eia_data.get_storage(str(tmp_path / "data.db"))
+    storage.append(hourly("P01S1", [1.0, 2.0, 3.0]), init=True)
+    storage.append(hourly("P01S1", [20.0, 30.0, 40.0], start="2020-01-01 01:00"))
+
+    data = storage.read()
+    assert list(data["value"]) == [1.0, 20.0, 30.0, 40.0]
+    assert list(data["period"]) == list(pd.date_range("2020-01-01", periods=4, freq="h"))
+
+
+def test_reindex_hourly_fills_the_grid_and_measures_the_gaps():
+    data = pd.concat([hourly("P01S1", [1.0, np.nan, 3.0, 4.0, 5.0, 6.0]), hourly("P01S2", [1.0, 2.0])],
+                     ignore_index=True)
+    data = data.drop([2, 3]).sample(frac=1, random_state=1)
+    temp = eia_data.reindex_hourly(data, start=pd.Timestamp("2020-01-01"), end=pd.Timestamp("2020-01-01 05:00"),
+                                   keys=[("P01", "P01S1"), ("P01", "P01S2"), ("P01", "P01S3")])
+
+    assert len(temp.data) == 18
+    assert list(temp.data["period"][:6]) == list(pd.date_range("2020-01-01", periods=6, freq="h"))
+    assert temp.data["value"][:6].isna().tolist() == [False, True, True, True, False, False]
+    assert temp.gaps.loc[("P01", "P01S1"), "gap_lengths"] == [3]
+    assert temp.gaps["na"].tolist() == [3, 4, 6]
+    assert temp.gaps["longest_gap"].tolist() == [3, 4, 6]
+
+
+def test_select_series_matches_the_patterns():
+    catalog = pd.DataFrame({"parent_id": ["CISO", "CISO", "ERCO", "PJM"],
+                            "subba_id": ["PGAE", "SCE", "COAS", "AE"]})
+
+    assert list(eia_data.select_series(catalog, parent="CISO")["subba_id"]) == ["PGAE", "SCE"]
+    assert list(eia_data.select_series(catalog, parent=["CISO", "P*"], subba="*E")["subba_id"]) == \
+        ["PGAE", "SCE", "AE"]
+    assert len(eia_data.select_series(catalog)) == 4
+
+
+def test_load_series_matches_the_csv_reads_and_follows_the_appends(tmp_path):
+    data_path = str(tmp_path / "data.csv")
+    storage = eia_data.get_storage(data_path)
+    storage.append(pd.concat([hourly(s, np.arange(48.0)) for s in ["P01S1", "P01S2", "P02S1"]]), init=True)
+    columns = ["period", "parent", "subba", "value"]
+
+    window = {"start": pd.Timestamp("2020-01-01 10:00"), "end": pd.Timestamp("2020-01-02 02:00")}
+    for filters in [{"subba": "P01S2"}, {"parent": "P01", **window}, {"subba": ["P02S1", "P01S1"], **window}]:
+        cached = eia_data.load_series(data_path, columns=columns, **filters)
+        expected = storage.read(columns=columns, **filters)
+        pd.testing.assert_frame_equal(cached.sort_values(["subba", "period"]).reset_index(drop=True),
+                                      expected.sort_values(["subba", "period"]).reset_index(drop=True),
+                                      check_dtype=False, check_categorical=False)
+    index = eia_data.read_series_index(data_path + ".arrow")
+    assert [s[:2] for s in index["series"]] == [["P01", "P01S1"], ["P01", "P01S2"], ["P02", "P02S1"]]
+
+    # An append or a revision of the CSV file rebuilds the cache on the next load
+    storage.append(hourly("P01S2", [100.0], start="2020-01-03"))
+    storage.upsert(hourly("P01S2", [-1.0], start="2020-01-01 05:00"))
+    series = eia_data.load_series(data_path, subba="P01S2", columns=["period", "value"])
+    assert len(series) == 49
+    assert series["value"].iloc[5] == -1.0 and series["value"].iloc[-1] == 100.0
+
+
+def test_append_csv_recovers_an_interrupted_append(tmp_path):
+    path = str(tmp_path / "data.csv")
+    eia_data.append_csv(path, hourly("P01S1", [1.0, 2.0]), init=True)
+    eia_data.append_csv(path, hourly("P01S1", [3.0], start="2020-01-01 02:00"))
+    expected = open(path, "rb").read()
+
+    # A crash after the journal was committed, with half of the rows written
+    eia_data.append_csv(path, hourly("P01S1", [1.0, 2.0]), init=True)
+    rows = expected[os.path.getsize(path):]
+    with open(path + ".journal", "wb") as f:
+        f.write((str(os.path.getsize(path)) + "\n").encode("utf-8") + rows)
+    with open(path, "ab") as f:
+        f.write(rows[:len(rows) // 2])
+
+    assert eia_data.recover_csv(path)
+    assert open(path, "rb").read() == expected
+    assert not os.path.exists(path + ".journal")
+    assert not eia_data.recover_csv(path)
+
+
+def test_append_csv_rejects_mismatched_columns(tmp_path):
+    path = str(tmp_path / "data.csv")
+    eia_data.append_csv(path, hourly("P01S1", [1.0]), init=True)
+
+    with pytest.raises(ValueError):
+        eia_data.append_csv(path, hourly("P01S1", [2.0]).drop(columns=["parent"]))
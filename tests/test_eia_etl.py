@@ -0,0 +1,159 @@
+import os
+import datetime
+import pandas as pd
+import pytest
+import fake_eia_server
+import src.eia_data as eia_data
+import src.eia_etl as eia_etl
+from conftest import api_key, api_path
+
+series = pd.DataFrame({"parent_id": ["P01", "P01", "P01"], "subba_id": ["P01S1", "P01S2", "P01S3"]})
+start = datetime.datetime(2020, 1, 1)
+end = datetime.datetime(2020, 2, 1)
+n_hours = int((end - start).total_seconds() // 3600) + 1
+
+
+def backfill(path, client, storage, **kwargs):
+    return eia_etl.backfill_pipeline(api_key=api_key,
+                                     api_path=api_path,
+                                     series=series,
+                                     start=start,
+                                     end=end,
+                                     storage=storage,
+                                     meta_path=os.path.join(path, "log.csv"),
+                                     watermark_path=os.path.join(path, "watermarks.json"),
+                                     client=client,
+                                     rows=600,
+                                     workers=2,
+                                     **kwargs)
+
+
+@pytest.mark.parametrize("data_path", ["data.csv", "parquet", "data.db"])
+def test_backfill_resumes_from_checkpoint(tmp_path, fake_api, client, data_path):
+    storage = eia_data.get_storage(str(tmp_path / data_path))
+    checkpoint = str(tmp_path / "checkpoints")
+
+    # The first run is interrupted, the second one only fetches the missing windows
+    fake_api.limit = 3
+    first = backfill(str(tmp_path), client, storage, checkpoint=checkpoint)
+    assert len(first.failed) > 0
+    fake_api.limit = None
+    fake_api.requests = 0
+    second = backfill(str(tmp_path), client, storage, checkpoint=checkpoint)
+    assert second.failed == []
+    assert 0 < fake_api.requests < len(first.failed) + 3
+
+    # A rerun rebuilds the storage from the checkpoint, without duplicates or requests
+    fake_api.requests = 0
+    backfill(str(tmp_path), client, storage, checkpoint=checkpoint)
+    assert fake_api.requests == 0
+    data = storage.read()
+    assert len(data) == 3 * n_hours
+    assert not data.duplicated(["subba", "period"]).any()
+    assert data["value"].notna().all()
+
+
+@pytest.mark.parametrize("data_path", ["data.csv", "parquet", "data.db"])
+def test_refresh_fetches_failed_backfill_windows_again(tmp_path, fake_api, client, data_path):
+    storage = eia_data.get_storage(str(tmp_path / data_path))
+    meta_path = str(tmp_path / "log.csv")
+    watermark_path = str(tmp_path / "watermarks.json")
+
+    # The windows after the first ones fail and are stored as missing values
+    fake_api.limit = 3
+    run = backfill(str(tmp_path), client, storage)
+    first_failed = min(f[1] for f in run.failed)
+    assert storage.read()["value"].isna().any()
+
+    # The watermark stays before the first failed window
+    meta = eia_data.load_metadata(meta_path, series, watermark_path=watermark_path).request_meta
+    assert (meta["request_start"] == pd.Timestamp(first_failed)).all()
+
+    # The refresh fetches the failed hours again and fills them in place
+    fake_api.limit = None
+    meta["end"] = pd.Timestamp(end)
+    meta["updates_available"] = True
+    refresh = eia_etl.refresh_pipeline(api_key=api_key,
+                                       api_path=api_path,
+                                       request_meta=meta,
+                                       storage=storage,
+                                       meta_path=meta_path,
+                                       watermark_path=watermark_path,
+                                       client=client)
+    assert refresh.meta["success"].all()
+    data = storage.read()
+    assert len(data) == 3 * n_hours
+    assert not data.duplicated(["subba", "period"]).any()
+    assert data["value"].notna().all()
+
+
+def test_backfill_rollups_match_a_rebuild(tmp_path, client):
+    storage = eia_data.get_storage(str(tmp_path / "data.csv"))
+    backfill(str(tmp_path), client, storage, rollup_path=str(tmp_path / "rollups"))
+
+    # The rollups folded from the windows match the ones rebuilt from the stored history
+    rebuilt = eia_data.build_rollups(path=str(tmp_path / "rebuilt"), storage=storage, parents=["P01"])
+    for level in eia_data.rollup_levels:
+        folded = eia_data.read_rollup(str(tmp_path / "rollups"), level)
+        pd.testing.assert_frame_equal(folded, eia_data.read_rollup(str(tmp_path / "rebuilt"), level))
+        assert len(folded) == len(rebuilt[level]) > 0
+
+
+def test_backfill_qc_fails_the_series_but_keeps_its_watermark(tmp_path, fake_api, client):
+    # One value above the range, the same options as the refresh
+    data = fake_api.data
+
+    def spiked(query):
+        out = data(query)
+        for r in out["response"]["data"]:
+            if r["subba"] == "P01S2" and r["period"] == "2020-01-10T05":
+                r["value"] = "99999"
+        return out
+
+    fake_api.data = spiked
+    storage = eia_data.get_storage(str(tmp_path / "data.csv"))
+    run = backfill(str(tmp_path), client, storage, qc_options={"max_value": 10000, "workers": 2})
+    meta = run.meta.set_index("subba")
+    assert list(meta["success"]) == [True, False, True]
+    assert "1 out of range values" in meta.loc["P01S2", "comments"]
+
+    # The stored history of the failed series keeps its watermark
+    watermarks = eia_data.load_metadata(str(tmp_path / "log.csv"), series,
+                                        watermark_path=str(tmp_path / "watermarks.json")).request_meta
+    assert (watermarks["end_act"] == pd.Timestamp(end)).all()
+
+    # A finding that is not blocking does not fail the series
+    run = backfill(str(tmp_path), client, storage, qc_options={"max_value": 10000, "blocking": ["negative"]})
+    assert run.meta["success"].all()
+
+
+def test_refresh_runs_the_parents_in_parallel_like_a_serial_run(tmp_path, fake_api, client):
+    fake_api.universe = fake_eia_server.make_universe(2, 2)
+    two_parents = pd.DataFrame({"parent_id": ["P01", "P01", "P02", "P02"],
+                                "subba_id": ["P01S1", "P01S2", "P02S1", "P02S2"]})
+    runs = {}
+    for workers in [1, 4]:
+        path = tmp_path / str(workers)
+        path.mkdir()
+        storage = eia_data.get_storage(str(path / "data.csv"))
+        eia_etl.backfill_pipeline(api_key=api_key, api_path=api_path, series=two_parents, start=start, end=end,
+                                  storage=storage, meta_path=str(path / "log.csv"), client=client, workers=2)
+        meta = eia_data.load_metadata(str(path / "log.csv"), two_parents).request_meta
+        meta["end"] = pd.Timestamp(2020, 2, 10)
+        meta["updates_available"] = True
+        fake_api.requests = 0
+        refresh = eia_etl.refresh_pipeline(api_key=api_key, api_path=api_path, request_meta=meta, storage=storage,
+                                           meta_path=str(path / "log.csv"), workers=workers, client=client)
+        # The CSV rows are in the order the writer received the series
+        runs[workers] = (refresh, storage.read().sort_values(["subba", "period"], ignore_index=True))
+
+        # One stream per parent, and the stages of every series are timed
+        assert fake_api.requests == 2
+        assert list(refresh.meta["subba"]) == list(two_parents["subba_id"])
+        assert refresh.meta["success"].all()
+        assert set(refresh.timings["stage"]) == {"fetch", "qc", "validate", "append"}
+
+    serial, parallel = runs[1], runs[4]
+    pd.testing.assert_frame_equal(serial[0].data, parallel[0].data)
+    pd.testing.assert_frame_equal(serial[1], parallel[1])
+    assert len(parallel[1]) == 4 * (n_hours + 9 * 24)
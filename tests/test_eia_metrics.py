@@ -0,0 +1,43 @@
+import src.eia_metrics as eia_metrics
+
+
+def test_snapshot_reports_the_counters_and_timer_percentiles():
+    registry = eia_metrics.metrics_registry()
+    registry.inc("http_requests")
+    registry.inc("http_requests", 2)
+    registry.inc("custom")
+    for seconds in [1.0, 2.0, 3.0]:
+        registry.observe("parse", seconds)
+    values = registry.snapshot()
+
+    assert values["http_requests"] == 3 and values["custom"] == 1
+    assert values["parse_count"] == 3 and values["parse_seconds"] == 6.0 and values["parse_p50"] == 2.0
+    # The known metrics are reported even when they were not observed
+    assert values["http_retries"] == 0
+    assert values["csv_write_count"] == 0 and values["csv_write_p50"] is None
+
+    registry.reset()
+    assert registry.snapshot()["http_requests"] == 0
+
+
+def test_prometheus_text_has_the_counters_and_summaries(tmp_path):
+    registry = eia_metrics.metrics_registry()
+    registry.inc("rows_written", 10)
+    registry.observe("parse", 0.5)
+    text = registry.to_prometheus(path=str(tmp_path / "metrics.prom"), labels={"job": "refresh"})
+
+    assert "# TYPE eia_rows_written_total counter" in text
+    assert 'eia_rows_written_total{job="refresh"} 10' in text
+    assert 'eia_parse_seconds{job="refresh",quantile="0.5"} 0.5' in text
+    assert 'eia_parse_seconds_count{job="refresh"} 1' in text
+    assert (tmp_path / "metrics.prom").read_text() == text
+
+
+def test_timed_records_each_call_on_the_shared_registry():
+    @eia_metrics.timed("test_timed")
+    def work(x):
+        return x + 1
+
+    count = eia_metrics.registry.snapshot().get("test_timed_count", 0)
+    assert work(1) == 2 and work(2) == 3
+    assert eia_metrics.registry.snapshot()["test_timed_count"] == count + 2
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import src.eia_data as eia_data
+import src.eia_plot as eia_plot
+
+
+def wave(n):
+    # An hourly series with a daily cycle and a single spike
+    x = pd.date_range("2020-01-01", periods=n, freq="h").to_numpy()
+    y = 100 + 10 * np.sin(np.arange(n) * 2 * np.pi / 24)
+    y[n // 3] = 1000.0
+    return x, y
+
+
+def test_lttb_keeps_the_endpoints_and_the_peaks():
+    x, y = wave(2000)
+    dx, dy = eia_plot.lttb(x, y, 100)
+
+    assert len(dx) == len(dy) == 100
+    assert dx[0] == x[0] and dx[-1] == x[-1]
+    assert (np.diff(dx.astype("int64")) > 0).all()
+    assert dy.max() == 1000.0
+
+
+def test_lttb_returns_short_series_unchanged():
+    x, y = wave(50)
+
+    assert eia_plot.lttb(x, y, 50)[0] is x
+    assert eia_plot.lttb(x, y, 2)[1] is y
+
+
+def test_minmax_keeps_the_extremes_of_each_bucket():
+    x, y = wave(2000)
+    dx, dy = eia_plot.minmax(x, y, 100)
+
+    assert len(dx) <= 100
+    assert (np.diff(dx.astype("int64")) > 0).all()
+    assert dy.max() == y.max() and dy.min() == y.min()
+
+    # Each bucket keeps its own minimum and maximum
+    bucket = (np.arange(len(y)) * 50) // len(y)
+    kept = pd.Series(dy, index=pd.Index(x).get_indexer(dx))
+    for b in range(50):
+        rows = kept[bucket[kept.index] == b]
+        assert rows.min() == y[bucket == b].min() and rows.max() == y[bucket == b].max()
+
+
+def test_render_report_skips_the_unchanged_charts(tmp_path):
+    storage = eia_data.get_storage(str(tmp_path / "data.csv"))
+    x, y = wave(24 * 10)
+    data = pd.concat([pd.DataFrame({"period": x, "subba": s, "parent": "P01", "value": y + i})
+                      for i, s in enumerate(["P01S1", "P01S2"])], ignore_index=True)
+    storage.append(data, init=True)
+    rollup_path = str(tmp_path / "rollups")
+    eia_data.build_rollups(rollup_path, storage, ["P01"])
+
+    def render():
+        return eia_plot.render_report(storage=storage, rollup_path=rollup_path, path=str(tmp_path / "charts"),
+                                      width=2, height=1, dpi=50).set_index("chart")
+
+    first = render()
+    assert first["rendered"].all()
+    assert sorted(first.index) == ["P01", "P01/P01S1", "P01/P01S2"]
+
+    # Only the charts drawn from a revised series are rendered again
+    revised = data[(data["subba"] == "P01S2") & (data["period"] == x[5])].assign(value=-1.0)
+    storage.upsert(revised)
+    eia_data.update_rollups(rollup_path, revised, storage)
+    second = render()
+    assert second["rendered"].to_dict() == {"P01/P01S1": False, "P01/P01S2": True, "P01": True}
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+import src.eia_qc as eia_qc
+
+periods = pd.date_range("2024-01-01", periods=300, freq="h")
+
+
+def make_series(subba, values=None, units="megawatthours"):
+    if values is None:
+        values = 1000 + 100 * np.sin(np.arange(len(periods)) / 24 * 2 * np.pi)
+    return pd.DataFrame({"period": periods, "parent": "X", "subba": subba, "value": values, "value-units": units})
+
+
+def test_qc_checks_count_the_issues_of_each_series():
+    clean = make_series("A")
+    issues = make_series("B")
+    issues.loc[100:130, "value"] = 5.0
+    issues.loc[200, "value"] = -1.0
+    issues.loc[250, "value-units"] = "MWh"
+    issues = pd.concat([issues, issues.iloc[[10]]]).drop(index=[50, 51])
+    report = eia_qc.qc_report(pd.concat([clean, issues], ignore_index=True),
+                              start=periods[0] - pd.Timedelta(hours=2), end=periods[-1])
+    a, b = report.set_index("subba").loc["A"], report.set_index("subba").loc["B"]
+
+    assert a["passed"] and a["issues"] == "2 missing hours"
+    assert (b["duplicates"], b["negative"], b["flatlines"], b["unit_changes"]) == (1, 1, 1, 2)
+    assert b["missing_hours"] == 4 and b["longest_flatline"] == 31
+    assert not b["passed"]
+
+
+def test_qc_checks_only_report_the_counted_rows():
+    data = make_series("A")
+    data.loc[10, "value"] = -1.0
+    data["new"] = data["period"] >= periods[100]
+    data["lookback"] = ~data["new"]
+
+    assert eia_qc.qc_report(data, counted="new").loc[0, "passed"]
+    lookback = eia_qc.qc_report(data, counted="lookback")
+    assert lookback.loc[0, "negative"] == 1 and lookback.loc[0, "n_obs"] == 100
+
+
+def test_the_options_configure_qc_report_and_combined_reports_alike():
+    data = make_series("A")
+    data.loc[10, "value"] = 5000.0
+    options = {"max_value": 2000, "blocking": ["duplicates"], "workers": 2}
+
+    # The same options run the report, or the checks of each chunk combined with the same blocking checks
+    report = eia_qc.qc_report(data, **options)
+    thresholds, blocking, workers = eia_qc.split_options(options)
+    chunks = [eia_qc.qc_checks(data.iloc[:150], **thresholds), eia_qc.qc_checks(data.iloc[150:], **thresholds)]
+    combined = eia_qc.combine_reports(chunks, blocking=blocking)
+
+    assert (thresholds, blocking, workers) == ({"max_value": 2000}, ["duplicates"], 2)
+    for r in [report, combined]:
+        assert r.loc[0, "out_of_range"] == 1
+        assert r.loc[0, "passed"]
+    assert not eia_qc.combine_reports(chunks).loc[0, "passed"]
+    with pytest.raises(TypeError):
+        eia_qc.qc_report(data, unknown=1)